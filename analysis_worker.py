@@ -0,0 +1,224 @@
+# analysis_worker.py
+"""
+Drains the analysis_jobs queue filled by db_utils.add_submission().
+
+The parent process claims batches of queued jobs, hands chunks of submissions to
+a process pool (each worker process loads the detectors once and keeps them;
+LanguageTool servers are started once, in the parent, and shared by the pool),
+and writes the finished reports and job states back from the parent, so the
+database sees a single writer per worker host.
+
+Run it next to the web app or on other hosts sharing the database:
+
+    python analysis_worker.py --db app.db --concurrency 4 [--batch-size 16] [--once]
+    python analysis_worker.py --db app.db --purge-stale-reports
+
+Cached reports of other detector or idiom versions are kept until they are
+purged explicitly (after every process has moved to the new configuration).
+
+main_app starts an in-process worker with start_background_worker() unless
+ANALYSIS_EXTERNAL_WORKERS=1 says a standalone one is running.
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import db_utils
+import metrics_utils
+import perf
+
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", str(os.cpu_count() or 1)))
+BACKFILL_INTERVAL = 60.0   # seconds between idle sweeps: backfill issue aggregates, refresh planner stats
+
+
+def _init_process(db_file, idioms_file, warm_up, grammar_urls=None):
+    """
+    Pool process initializer: use the parent's database, idioms and LanguageTool servers
+    (spawned processes start from defaults).
+    """
+    db_utils.DB_FILE = db_file
+    db_utils.IDIOMS_FILE = idioms_file
+    if grammar_urls is not None:
+        metrics_utils.use_grammar_servers(grammar_urls)
+    if warm_up:
+        metrics_utils.warm_up_detectors(background=False)
+
+
+def _analyze_chunk(submissions):
+    """
+    Runs in a pool process: analyze submissions; returns their reports (same order), the
+    report version they were made under and perf metrics.
+    """
+    version = db_utils.get_report_version()
+    with perf.profiled("analysis"), perf.timer("analysis_chunk_seconds"):
+        reports = db_utils.classify_translation_issues_batch(submissions, version=version)
+    return reports, version, perf.drain()
+
+
+class AnalysisWorker:
+    def __init__(self, concurrency=ANALYSIS_WORKERS, batch_size=16, poll_interval=1.0, worker_id=None,
+                 warm_up=False):
+        self.concurrency = max(0, int(concurrency))
+        self.batch_size = max(1, int(batch_size))
+        self.poll_interval = poll_interval
+        self.warm_up = warm_up   # load the detectors in every pool process when the pool starts
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.processed = 0
+        self.failed = 0
+        self._stop = threading.Event()
+        self._pool = None
+        self._next_backfill = 0.0
+
+    def stop(self):
+        self._stop.set()
+
+    def _run_chunk(self, submissions):
+        if self._pool is None:
+            return _analyze_chunk(submissions)
+        return self._pool.submit(_analyze_chunk, submissions)
+
+    def _store(self, jobs, submissions, result):
+        reports, version, metrics = result
+        perf.merge(metrics)
+        db_utils.store_reports(version, {
+            db_utils.report_key(s["source_text"], s["student_translation"], s["reference"], s["target_lang"],
+                                version): rep
+            for s, rep in zip(submissions, reports)
+        })
+        db_utils.store_degraded_reports(version, zip(submissions, reports))
+        db_utils.record_submission_issues(version, zip(submissions, reports))
+        db_utils.finish_analysis_jobs(done_ids=[j for j, _sid in jobs])
+        self.processed += len(jobs)
+        perf.incr("analysis_jobs_total", len(jobs), status="done")
+
+    def _fail(self, jobs, error):
+        db_utils.finish_analysis_jobs(failed={j: error for j, _sid in jobs})
+        self.failed += len(jobs)
+        perf.incr("analysis_jobs_total", len(jobs), status="failed")
+
+    def run_once(self):
+        """Claim and analyze one round of jobs; returns the number of jobs claimed."""
+        db_utils.requeue_stale_jobs()
+        slots = max(1, self.concurrency)
+        jobs = db_utils.claim_analysis_jobs(self.worker_id, slots * self.batch_size)
+        if not jobs:
+            now = time.monotonic()
+            if now >= self._next_backfill:
+                self._next_backfill = now + BACKFILL_INTERVAL
+                db_utils.refresh_query_stats()
+                if db_utils.enqueue_unanalyzed_submissions(slots * self.batch_size * 4):
+                    jobs = db_utils.claim_analysis_jobs(self.worker_id, slots * self.batch_size)
+            if not jobs:
+                return 0
+        subs = db_utils.get_submissions_by_id([sid for _j, sid in jobs])
+        missing = [(j, sid) for j, sid in jobs if sid not in subs]
+        if missing:
+            self._fail(missing, "submission not found")
+        jobs = [(j, sid) for j, sid in jobs if sid in subs]
+        chunks = [jobs[i:i + self.batch_size] for i in range(0, len(jobs), self.batch_size)]
+        pending = {}
+        for chunk in chunks:
+            chunk_subs = [subs[sid] for _j, sid in chunk]
+            try:
+                result = self._run_chunk(chunk_subs)
+            except Exception as e:
+                self._fail(chunk, f"{type(e).__name__}: {e}")
+                continue
+            if self._pool is None:
+                self._store(chunk, chunk_subs, result)
+            else:
+                pending[result] = (chunk, chunk_subs)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                chunk, chunk_subs = pending.pop(fut)
+                try:
+                    self._store(chunk, chunk_subs, fut.result())
+                except Exception as e:
+                    self._fail(chunk, f"{type(e).__name__}: {e}")
+        return len(jobs) + len(missing)
+
+    def run(self, once=False, progress=None):
+        """
+        Drain the queue; with once=True stop when it is empty, else keep polling until stop().
+        progress(worker) is called after every round of jobs.
+        """
+        if self.concurrency > 0:
+            # Start the LanguageTool servers here, once, rather than one set per pool process.
+            grammar_urls = metrics_utils.shared_grammar_urls()
+            # spawn: the parent may be a threaded web server, which fork does not mix with
+            self._pool = ProcessPoolExecutor(max_workers=self.concurrency,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_process,
+                                             initargs=(db_utils.DB_FILE, db_utils.IDIOMS_FILE, self.warm_up,
+                                                       grammar_urls))
+        try:
+            while not self._stop.is_set():
+                claimed = self.run_once()
+                if claimed and progress is not None:
+                    progress(self)
+                if claimed == 0:
+                    if once:
+                        break
+                    self._stop.wait(self.poll_interval)
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+
+_background = None
+_background_lock = threading.Lock()
+
+
+def start_background_worker(concurrency=ANALYSIS_WORKERS, batch_size=16):
+    """Start (once per process) a daemon thread running an AnalysisWorker for this app."""
+    global _background
+    with _background_lock:
+        if _background is None:
+            worker = AnalysisWorker(concurrency=concurrency, batch_size=batch_size)
+            thread = threading.Thread(target=worker.run, name="analysis-worker", daemon=True)
+            thread.start()
+            _background = worker
+        return _background
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze queued submissions.")
+    parser.add_argument("--db", default=db_utils.DB_FILE, help="SQLite database file")
+    parser.add_argument("--idioms", default=db_utils.IDIOMS_FILE, help="idioms.json seeding an empty idiom dictionary")
+    parser.add_argument("--concurrency", type=int, default=ANALYSIS_WORKERS,
+                        help="worker processes (0 = analyze in this process)")
+    parser.add_argument("--batch-size", type=int, default=16, help="submissions per worker task")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds to sleep when the queue is empty")
+    parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    parser.add_argument("--purge-stale-reports", action="store_true",
+                        help="delete cached reports of other detector/idiom versions, then exit")
+    args = parser.parse_args(argv)
+
+    db_utils.DB_FILE = args.db
+    db_utils.IDIOMS_FILE = args.idioms
+    db_utils.init_db()
+    if args.purge_stale_reports:
+        version = db_utils.get_report_version()
+        print(f"deleted {db_utils.purge_stale_reports(version)} cached reports not under {version}")
+        return 0
+    worker = AnalysisWorker(args.concurrency, args.batch_size, args.poll_interval)
+    t0 = time.perf_counter()
+    try:
+        worker.run(once=args.once)
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.perf_counter() - t0
+    print(f"{worker.processed} analyzed, {worker.failed} failed in {elapsed:.1f} s "
+          f"({worker.processed / elapsed if elapsed else 0:.1f}/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+# auth.py
+"""
+Password hashing and signed session tokens.
+
+Passwords are stored as self-describing strings, so the cost can be raised later
+without invalidating existing hashes:
+
+    scrypt$<n>$<r>$<p>$<salt b64>$<hash b64>
+    pbkdf2_sha256$<iterations>$<salt b64>$<hash b64>
+
+PASSWORD_SCHEME picks the scheme for new hashes (default scrypt). AUTH_SCRYPT_N/R/P
+and AUTH_PBKDF2_ITERATIONS set the cost. verify_password() also accepts rows from
+before hashing existed (plaintext). It reports whether the stored value should be
+replaced, and db_utils.authenticate() rehashes those rows on the next successful
+login.
+
+Hashes are deliberately slow, and scrypt also needs 128*n*r bytes of memory. When
+a class logs in at once, at most AUTH_MAX_CONCURRENT_HASHES of them run together;
+the rest queue instead of swapping. benchmarks/bench_auth.py measures login
+latency under such a burst.
+
+Session tokens are "<payload b64>.<HMAC-SHA256 b64>", where the payload holds the
+username, role, issue time and expiry. Verified tokens are kept in an in-process
+LRU of MAX_CACHED_SESSIONS entries, so a page load with a known token costs one dict
+lookup and no database query; an evicted token is simply checked by its signature again.
+SESSION_SECRET signs them. Without it, a random per-process key is used, and
+sessions end when the app restarts.
+"""
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+
+PASSWORD_SCHEME = os.environ.get("PASSWORD_SCHEME", "scrypt")
+SCRYPT_N = int(os.environ.get("AUTH_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.environ.get("AUTH_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("AUTH_SCRYPT_P", "1"))
+PBKDF2_ITERATIONS = int(os.environ.get("AUTH_PBKDF2_ITERATIONS", "600000"))
+MAX_CONCURRENT_HASHES = int(os.environ.get("AUTH_MAX_CONCURRENT_HASHES", str(os.cpu_count() or 1)))
+SESSION_TTL = int(os.environ.get("SESSION_TTL", str(12 * 3600)))
+SALT_BYTES = 16
+
+_hash_slots = threading.BoundedSemaphore(max(1, MAX_CONCURRENT_HASHES))
+_secret = (os.environ.get("SESSION_SECRET") or "").encode("utf-8") or secrets.token_bytes(32)
+_sessions = OrderedDict()   # token -> (username, role, issued_at, expires_at), least recently used first
+_revoked = {}    # token -> expires_at, for logged-out tokens until they would have expired
+_not_before = {}  # username -> time; tokens issued earlier are rejected
+_sessions_lock = threading.Lock()
+MAX_CACHED_SESSIONS = 10000
+_dummy_hash = None
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem must cover 128*n*r bytes; hashlib's default (32 MiB) rejects n >= 2**15 at r=8.
+    with _hash_slots:
+        return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=32,
+                              maxmem=256 * n * r + (1 << 20))
+
+
+def _pbkdf2(password, salt, iterations):
+    with _hash_slots:
+        return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+
+
+def hash_password(password, scheme=None):
+    """Encoded salted hash of password under `scheme` (PASSWORD_SCHEME by default) at the configured cost."""
+    scheme = scheme or PASSWORD_SCHEME
+    salt = os.urandom(SALT_BYTES)
+    if scheme == "scrypt":
+        digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+    if scheme == "pbkdf2_sha256":
+        digest = _pbkdf2(password, salt, PBKDF2_ITERATIONS)
+        return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64(salt)}${_b64(digest)}"
+    raise ValueError(f"unknown password scheme: {scheme}")
+
+
+def is_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(("scrypt$", "pbkdf2_sha256$"))
+
+
+def verify_password(password, stored):
+    """
+    (matches, needs_rehash) for password against a stored value. needs_rehash is True
+    for plaintext rows and for hashes made with another scheme or cost than the current one.
+    """
+    if stored is None or password is None:
+        return False, False
+    if not is_hashed(stored):
+        return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8")), True
+    parts = stored.split("$")
+    try:
+        if parts[0] == "scrypt":
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            ok = hmac.compare_digest(_scrypt(password, _unb64(parts[4]), n, r, p), _unb64(parts[5]))
+            current = PASSWORD_SCHEME == "scrypt" and (n, r, p) == (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        else:
+            iterations = int(parts[1])
+            ok = hmac.compare_digest(_pbkdf2(password, _unb64(parts[2]), iterations), _unb64(parts[3]))
+            current = PASSWORD_SCHEME == "pbkdf2_sha256" and iterations == PBKDF2_ITERATIONS
+    except (IndexError, ValueError):
+        return False, False
+    return ok, ok and not current
+
+
+def burn_verify(password):
+    """Spend one verify's worth of time for an unknown user, so response times don't reveal which usernames exist."""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_hex(8))
+    verify_password(password or "", _dummy_hash)
+
+
+# ---------- session tokens ----------
+def _sign(payload):
+    return _b64(hmac.new(_secret, payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_session(username, role, ttl=None):
+    """A signed token for (username, role) that verify_session() accepts until it expires or is revoked."""
+    issued = time.time()
+    expires = int(issued) + (SESSION_TTL if ttl is None else ttl)
+    payload = _b64(json.dumps([username, role, issued, expires], separators=(",", ":")).encode("utf-8"))
+    token = f"{payload}.{_sign(payload)}"
+    _cache_session(token, (username, role, issued, expires))
+    return token
+
+
+def _cache_session(token, entry):
+    with _sessions_lock:
+        _sessions[token] = entry
+        if len(_sessions) > MAX_CACHED_SESSIONS:
+            _sessions.popitem(last=False)
+
+
+def _signed_expiry(token):
+    """The expiry in a correctly signed token, else None."""
+    payload, _dot, signature = token.partition(".")
+    if not hmac.compare_digest(_sign(payload), signature):
+        return None
+    try:
+        return float(json.loads(_unb64(payload))[3])
+    except (ValueError, TypeError, IndexError):
+        return None
+
+
+def verify_session(token):
+    """(username, role) for a valid token, else None. Known tokens are answered from memory."""
+    if not token:
+        return None
+    cached = _sessions.get(token)
+    if cached is None:
+        if token in _revoked:
+            return None
+        payload, _dot, signature = token.partition(".")
+        if not hmac.compare_digest(_sign(payload), signature):
+            return None
+        try:
+            username, role, issued, expires = json.loads(_unb64(payload))
+        except (ValueError, TypeError):
+            return None
+        if issued < _not_before.get(username, 0.0):
+            return None
+        cached = (username, role, issued, expires)
+        _cache_session(token, cached)
+    else:
+        with _sessions_lock:
+            if token in _sessions:
+                _sessions.move_to_end(token)
+    if cached[3] <= time.time():
+        with _sessions_lock:
+            _sessions.pop(token, None)
+        return None
+    return cached[0], cached[1]
+
+
+def revoke_session(token):
+    """Log a token out: it no longer verifies, even though its signature is still valid."""
+    if not token:
+        return
+    with _sessions_lock:
+        cached = _sessions.pop(token, None)
+    expires = cached[3] if cached else _signed_expiry(token)
+    now = time.time()
+    with _sessions_lock:
+        # An expired token fails verification anyway, so entries are only kept until then.
+        for t in [t for t, exp in _revoked.items() if exp <= now]:
+            del _revoked[t]
+        if expires is not None and expires > now:
+            _revoked[token] = expires
+
+
+def revoke_user_sessions(username):
+    """Invalidate every token issued to username so far (e.g. after a password or role change)."""
+    with _sessions_lock:
+        _not_before[username] = time.time()
+        for token in [t for t, s in _sessions.items() if s[0] == username]:
+            del _sessions[token]
+
+
+def prune_sessions():
+    """Drop expired tokens from the in-memory caches; returns how many sessions are left."""
+    now = time.time()
+    with _sessions_lock:
+        for token in [t for t, s in _sessions.items() if s[3] <= now]:
+            del _sessions[token]
+        for token in [t for t, expires in _revoked.items() if expires <= now]:
+            del _revoked[token]
+        return len(_sessions)
@@ -0,0 +1,132 @@
+"""
+Login latency under a start-of-class burst, and the cost of the pieces behind it.
+
+Times:
+  * one hash at the configured cost (AUTH_SCRYPT_N/R/P, AUTH_PBKDF2_ITERATIONS) and
+    at a few alternative scrypt costs, to help pick a cost for this machine;
+  * db_utils.authenticate for a hashed account and for a legacy plaintext row
+    (verify + rehash);
+  * auth.verify_session for a cached and a not-yet-seen token;
+  * a burst: --students logins arriving at random over --window seconds, each on
+    its own thread as Streamlit sessions would. Latency runs from arrival to
+    answer, so it includes waiting for a hash slot.
+
+Exits 1 if the burst p95 exceeds --budget-ms.
+
+    python benchmarks/bench_auth.py [--students 300] [--window 30] [--budget-ms 500]
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import auth
+import db_utils
+
+PASSWORD = "correct horse battery staple"
+
+
+def time_calls(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(timings), max(timings)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def burst(usernames, window, seed=0):
+    """Logins at uniformly random arrival times within `window` seconds; returns latencies in ms."""
+    rng = random.Random(seed)
+    arrivals = sorted(rng.uniform(0.0, window) for _ in usernames)
+    latencies = [None] * len(usernames)
+    start = time.perf_counter() + 0.1
+
+    def login(i, username, at):
+        time.sleep(max(0.0, start + at - time.perf_counter()))
+        t0 = time.perf_counter()
+        ok = db_utils.authenticate(username, PASSWORD)
+        latencies[i] = (time.perf_counter() - t0) * 1000.0 if ok else float("inf")
+
+    threads = [threading.Thread(target=login, args=(i, u, at)) for i, (u, at) in enumerate(zip(usernames, arrivals))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=300)
+    parser.add_argument("--window", type=float, default=30.0, help="seconds over which the burst arrives")
+    parser.add_argument("--budget-ms", type=float, default=500.0, help="p95 login latency budget")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"scheme {auth.PASSWORD_SCHEME}: scrypt n={auth.SCRYPT_N} r={auth.SCRYPT_R} p={auth.SCRYPT_P}, "
+          f"pbkdf2 {auth.PBKDF2_ITERATIONS} iterations, {auth.MAX_CONCURRENT_HASHES} concurrent hash slot(s)")
+    print(f"{'operation':<44} {'p50 ms':>9} {'max ms':>9}")
+    salt = os.urandom(auth.SALT_BYTES)
+    for n in sorted({2 ** 13, 2 ** 14, 2 ** 15, auth.SCRYPT_N}):
+        p50, worst = time_calls(lambda: auth._scrypt(PASSWORD, salt, n, auth.SCRYPT_R, auth.SCRYPT_P), args.repeat)
+        print(f"{f'scrypt n=2^{n.bit_length() - 1} r={auth.SCRYPT_R}':<44} {p50:>9.2f} {worst:>9.2f}")
+    p50, worst = time_calls(lambda: auth._pbkdf2(PASSWORD, salt, auth.PBKDF2_ITERATIONS), args.repeat)
+    print(f"{f'pbkdf2_sha256 {auth.PBKDF2_ITERATIONS} iterations':<44} {p50:>9.2f} {worst:>9.2f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_utils.close_all_connections()
+        db_utils.DB_FILE = os.path.join(tmp, "app.db")
+        db_utils.init_db()
+        # One hash shared by every account: the burst measures verifying, not registering.
+        shared = auth.hash_password(PASSWORD)
+        usernames = [f"student{i:04d}" for i in range(args.students)]
+        with db_utils.db_cursor(commit=True) as c:
+            c.executemany("INSERT INTO users (username, password, role, approved) VALUES (?,?,?,1)",
+                          [(u, shared, "Student") for u in usernames] +
+                          [(f"legacy{i}", PASSWORD, "Student") for i in range(args.repeat)])
+
+        p50, worst = time_calls(lambda: db_utils.authenticate(usernames[0], PASSWORD), args.repeat)
+        print(f"{'authenticate (hashed)':<44} {p50:>9.2f} {worst:>9.2f}")
+        legacy = iter(range(args.repeat))
+        p50, worst = time_calls(lambda: db_utils.authenticate(f"legacy{next(legacy)}", PASSWORD), args.repeat)
+        print(f"{'authenticate (plaintext row, rehashed)':<44} {p50:>9.2f} {worst:>9.2f}")
+        p50, worst = time_calls(lambda: db_utils.authenticate("nobody", PASSWORD), args.repeat)
+        print(f"{'authenticate (unknown user)':<44} {p50:>9.2f} {worst:>9.2f}")
+
+        token = auth.issue_session(usernames[0], "Student")
+        p50, worst = time_calls(lambda: auth.verify_session(token), 1000)
+        print(f"{'verify_session (cached)':<44} {p50:>9.4f} {worst:>9.4f}")
+
+        def fresh():
+            t = auth.issue_session(usernames[0], "Student")
+            auth._sessions.pop(t)
+            return t
+        fresh_tokens = [fresh() for _ in range(1000)]
+        p50, worst = time_calls(lambda: auth.verify_session(fresh_tokens.pop()), 1000)
+        print(f"{'verify_session (first sight, HMAC check)':<44} {p50:>9.4f} {worst:>9.4f}")
+
+        latencies = burst(usernames, args.window)
+        db_utils.close_all_connections()
+
+    failed = sum(1 for v in latencies if v == float("inf"))
+    ok = [v for v in latencies if v != float("inf")]
+    p95 = percentile(ok, 0.95) if ok else float("inf")
+    print(f"burst of {args.students} logins over {args.window:.0f} s: p50 {percentile(ok, 0.5):.1f} ms, "
+          f"p95 {p95:.1f} ms, max {max(ok):.1f} ms, {failed} failed; budget p95 <= {args.budget_ms:.0f} ms")
+    sys.exit(0 if p95 <= args.budget_ms and not failed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Build time, size and per-sentence lookup latency of the collocation index.
+
+Uses the Brown corpus when NLTK can provide it, otherwise (or with --synthetic)
+a generated corpus of the same order of size. --legacy also times the old
+detector's per-call nltk.FreqDist(brown.words()) pass for comparison.
+
+    python benchmarks/bench_collocation.py [--synthetic] [--sentences 2000] [--legacy]
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import collocation_index
+
+VOCAB = [f"w{i}" for i in range(20000)]
+
+
+def synthetic_tokens(n=1_100_000, seed=0):
+    rng = random.Random(seed)
+    # Zipf-ish word frequencies with some sticky bigrams
+    weights = [1.0 / (r + 1) for r in range(len(VOCAB))]
+    words = rng.choices(VOCAB, weights=weights, k=n)
+    for i in range(0, n - 1, 7):
+        words[i + 1] = VOCAB[(VOCAB.index(words[i]) * 7 + 1) % 200] if words[i] in VOCAB[:200] else words[i + 1]
+    return words
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", action="store_true")
+    parser.add_argument("--sentences", type=int, default=2000)
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+
+    tokens = None
+    if args.synthetic:
+        tokens = synthetic_tokens()
+    else:
+        try:
+            tokens = list(collocation_index.brown_tokens())
+        except Exception as e:
+            print(f"Brown corpus unavailable ({e}); using a synthetic corpus")
+            tokens = synthetic_tokens()
+
+    rng = random.Random(1)
+    sentences = [" ".join(rng.choices(tokens[:200_000], k=rng.randint(8, 25))) for _ in range(args.sentences)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bigrams.db")
+        t0 = time.perf_counter()
+        collocation_index.build_index(path, tokens)
+        t_build = time.perf_counter() - t0
+        idx = collocation_index.CollocationIndex(path)
+        idx.rare_bigrams(sentences[0])
+
+        t0 = time.perf_counter()
+        for s in sentences:
+            idx.rare_bigrams(s)
+        per_sentence = (time.perf_counter() - t0) / len(sentences)
+        size = os.path.getsize(path)
+        idx.conn.close()
+
+    print(f"corpus tokens:     {len(tokens):,}")
+    print(f"build:             {t_build:.2f} s, index {size / 1e6:.1f} MB")
+    print(f"lookup:            {per_sentence * 1e6:.1f} us/sentence over {len(sentences)} sentences")
+
+    if args.legacy:
+        import nltk
+        from nltk.corpus import brown
+        t0 = time.perf_counter()
+        nltk.FreqDist(brown.words())
+        print(f"legacy FreqDist:   {(time.perf_counter() - t0) * 1e6:.0f} us/sentence (paid on every call)")
+
+
+if __name__ == "__main__":
+    main()
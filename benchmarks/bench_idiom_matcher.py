@@ -0,0 +1,91 @@
+"""
+Compiled idiom matcher vs the original linear scan of idioms_dict, at 10 / 1k / 50k idioms.
+
+Times detect_idiomatic_issues over synthetic submissions (each source contains a
+couple of idioms) and reports how often both implementations return the same
+statuses; differences come from the matcher's word-boundary and Arabic
+normalization rules.
+
+    python benchmarks/bench_idiom_matcher.py [--sizes 10 1000 50000] [--submissions 500]
+"""
+import os
+import sys
+import random
+import argparse
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import idiom_matcher
+
+EN = "time ice bucket beans cat bag rain dogs leg break kick spill hit road sack moon blue once piece cake".split()
+AR = "كسر الجمود فارق الحياة كشف السر قطعة كعكة نادر جدا سهل للغاية".split()
+
+
+def legacy_detect(source_text, student_translation, idioms_dict):
+    # the pre-matcher implementation: one substring search per idiom
+    detected = {}
+    s_low = source_text.lower()
+    st_low = (student_translation or "").lower()
+    for eng, data in idioms_dict.items():
+        eng_low = eng.lower()
+        if eng_low in s_low:
+            expected = data.get("arabic") if isinstance(data, dict) else data
+            if expected and expected.strip() and expected in (student_translation or ""):
+                detected[eng] = {"status": "idiomatic", "expected": expected}
+            elif eng_low in st_low:
+                detected[eng] = {"status": "non-idiomatic-literal", "expected": expected}
+            else:
+                detected[eng] = {"status": "non-idiomatic-missing", "expected": expected}
+    return detected
+
+
+def make_idioms(n, rng):
+    idioms = {}
+    while len(idioms) < n:
+        eng = " ".join(rng.choices(EN, k=3)) + f" {len(idioms)}"
+        idioms[eng] = {"arabic": " ".join(rng.choices(AR, k=2)) + f" {len(idioms)}"}
+    return idioms
+
+
+def make_submissions(idioms, n, rng):
+    keys = list(idioms)
+    subs = []
+    for _ in range(n):
+        picked = rng.sample(keys, min(2, len(keys)))
+        source = "Yesterday the class said " + " and then ".join(picked) + " before leaving."
+        parts = [idioms[k]["arabic"] if rng.random() < 0.5 else k for k in picked]
+        subs.append((source, "قال الطلاب " + " ثم ".join(parts)))
+    return subs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1_000, 50_000])
+    parser.add_argument("--submissions", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'idioms':>8} {'build ms':>9} {'legacy us/sub':>14} {'matcher us/sub':>15} {'speedup':>8} {'agree':>6}")
+    for n in args.sizes:
+        rng = random.Random(n)
+        idioms = make_idioms(n, rng)
+        subs = make_submissions(idioms, args.submissions, rng)
+
+        t0 = time.perf_counter()
+        matcher = idiom_matcher.get_matcher(idioms)
+        t_build = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        legacy = [legacy_detect(s, t, idioms) for s, t in subs]
+        t_legacy = (time.perf_counter() - t0) / len(subs)
+
+        t0 = time.perf_counter()
+        new = [matcher.detect(s, t) for s, t in subs]
+        t_new = (time.perf_counter() - t0) / len(subs)
+
+        agree = sum(a == b for a, b in zip(legacy, new)) / len(subs)
+        print(f"{n:>8} {t_build * 1000:>9.1f} {t_legacy * 1e6:>14.1f} {t_new * 1e6:>15.1f} "
+              f"{t_legacy / t_new:>7.1f}x {agree:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
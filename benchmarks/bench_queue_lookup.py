@@ -0,0 +1,75 @@
+"""
+Latency of get_user_practice_queue at 1k / 100k / 1M practice_assignments rows,
+with the migration indexes and with them dropped (the pre-migration schema).
+
+    python benchmarks/bench_queue_lookup.py [--sizes 1000 100000 1000000] [--lookups 200]
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+import statistics
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_utils
+
+ASSIGNMENTS_PER_STUDENT = 20
+PRACTICE_ITEMS = 500
+ASSIGNMENT_INDEXES = ("idx_assignments_user_practice", "idx_assignments_practice")
+
+
+def populate(n_rows, seed=0):
+    rng = random.Random(seed)
+    n_students = max(1, n_rows // ASSIGNMENTS_PER_STUDENT)
+    students = [f"student{i:07d}" for i in range(n_students)]
+    with db_utils.db_cursor(commit=True) as c:
+        c.executemany("INSERT INTO users (username, password, role, approved) VALUES (?,?,?,1)",
+                      [(u, "pw", "Student") for u in students])
+        c.executemany("INSERT INTO practice_bank (category, prompt, reference) VALUES (?,?,?)",
+                      [(rng.choice(["idiom", "grammar", "semantic"]), f"prompt {i}", "") for i in range(PRACTICE_ITEMS)])
+        c.executemany("INSERT INTO practice_assignments (username, practice_id) VALUES (?,?)",
+                      ((students[i % n_students], rng.randint(1, PRACTICE_ITEMS)) for i in range(n_rows)))
+    return students
+
+
+def time_lookups(students, lookups, seed=1):
+    rng = random.Random(seed)
+    timings = []
+    for _ in range(lookups):
+        user = rng.choice(students)
+        t0 = time.perf_counter()
+        db_utils.get_user_practice_queue(user)
+        timings.append((time.perf_counter() - t0) * 1000.0)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'indexed p50 ms':>15} {'indexed p95 ms':>15} {'no-index p50 ms':>16} {'no-index p95 ms':>16}")
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_utils.close_all_connections()
+            db_utils.DB_FILE = os.path.join(tmp, "bench.db")
+            db_utils.init_db()
+            students = populate(n)
+            with db_utils.db_cursor(commit=True) as c:
+                c.execute("ANALYZE")
+            idx = time_lookups(students, args.lookups)
+            with db_utils.db_cursor(commit=True) as c:
+                for name in ASSIGNMENT_INDEXES:
+                    c.execute(f"DROP INDEX IF EXISTS {name}")
+                c.execute("ANALYZE")
+            scan = time_lookups(students, args.lookups)
+            db_utils.close_all_connections()
+        print(f"{n:>10} {idx[0]:>15.3f} {idx[1]:>15.3f} {scan[0]:>16.3f} {scan[1]:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
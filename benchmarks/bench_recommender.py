@@ -0,0 +1,118 @@
+"""
+Practice recommender index: build, incremental refresh and top-k search latency.
+
+For each bank size, fills practice_bank with synthetic prompts and times:
+  * the first refresh, which embeds the whole bank;
+  * a refresh after --add new items (only the new rows are embedded);
+  * search: one query of k results in a category, excluding a 20-item queue;
+  * recommend() for a report with one issue of each type.
+
+Detectors are stubbed (BENCH_DETECTORS=stub, the default), so the hashed-trigram
+backend is used; with --detectors real and the sentence-transformer installed,
+the MiniLM embeddings are used instead.
+
+    python benchmarks/bench_recommender.py [--sizes 1000 10000 50000] [--add 100] [--repeat 50]
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+import statistics
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+import db_utils
+import metrics_utils
+import recommender
+import run_suite
+import synthetic
+
+PROMPT_TEMPLATES = {
+    "idiom": "Translate: '{w}' idiomatically into Arabic (expected: {a}).",
+    "semantic": "Paraphrase '{w}' preserving meaning; translate both versions and compare.",
+    "grammar": "Fix the agreement error in: {w} {a}",
+    "collocation": "Replace the phrase '{w}' with a natural collocation.",
+}
+REPORT = {
+    "semantic_score": 40.0, "semantic_flag": True,
+    "idiom_issues": {"break the ice": {"status": "non-idiomatic (literal)", "expected": "كسر الجمود"}},
+    "grammar": [{"message": "Possible agreement error", "replacements": ["are"]}],
+    "collocation_flags": ["strong rain"],
+}
+
+
+def make_prompts(n, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        category = rng.choice(list(PROMPT_TEMPLATES))
+        w = " ".join(rng.sample(synthetic.EN_WORDS, rng.randint(2, 4)))
+        a = " ".join(rng.sample(synthetic.AR_WORDS, 2))
+        rows.append((category, PROMPT_TEMPLATES[category].format(w=w, a=a), ""))
+    return rows
+
+
+def time_calls(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--add", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--detectors", choices=["stub", "real"], default=os.environ.get("BENCH_DETECTORS", "stub"))
+    args = parser.parse_args()
+    if args.detectors == "stub":
+        run_suite.stub_detectors()
+    else:
+        metrics_utils.warm_up_detectors(["semantic"], background=False)
+
+    print(f"{'bank size':>9} {'backend':<13} {'build ms':>9} {'+' + str(args.add) + ' ms':>9} "
+          f"{'search p50':>11} {'search max':>11} {'recommend p50':>14}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_utils.close_all_connections()
+            db_utils.DB_FILE = os.path.join(tmp, "app.db")
+            db_utils.init_db()
+            with db_utils.db_cursor(commit=True) as c:
+                c.executemany("INSERT INTO practice_bank (category, prompt, reference) VALUES (?,?,?)",
+                              make_prompts(size))
+                c.execute("INSERT INTO users (username, role, approved) VALUES ('student', 'Student', 1)")
+            db_utils.assign_practices_to_user("student", random.Random(1).sample(range(1, size + 1), 20))
+            index = recommender.get_index()
+            index._clear()
+            index.backend = None
+
+            t0 = time.perf_counter()
+            index.refresh(force=True)
+            build_ms = (time.perf_counter() - t0) * 1000.0
+            with db_utils.db_cursor(commit=True) as c:
+                c.executemany("INSERT INTO practice_bank (category, prompt, reference) VALUES (?,?,?)",
+                              make_prompts(args.add, seed=size))
+            t0 = time.perf_counter()
+            added = index.refresh(force=True)
+            add_ms = (time.perf_counter() - t0) * 1000.0
+            assert added == args.add and len(index) == size + args.add
+
+            queued = db_utils.get_assigned_practice_ids("student")
+            search_p50, search_max = time_calls(
+                lambda: index.search(["Translate: 'break the ice' idiomatically into Arabic."], args.k, "idiom", queued),
+                args.repeat)
+            rec_p50, _ = time_calls(lambda: recommender.recommend(REPORT, "student", args.k), args.repeat)
+            print(f"{size:>9} {index.backend:<13} {build_ms:>9.1f} {add_ms:>9.1f} "
+                  f"{search_p50:>11.3f} {search_max:>11.3f} {rec_p50:>14.3f}")
+            db_utils.close_all_connections()
+
+
+if __name__ == "__main__":
+    main()
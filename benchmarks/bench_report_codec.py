@@ -0,0 +1,164 @@
+"""
+Size and speed of report_codec binary reports against the JSON they replace.
+
+Builds --submissions synthetic reports shaped like the analyzer's (idiom issues
+from a synthetic idiom list, LanguageTool-style grammar matches, collocation
+flags, sentence segments) and compares, for JSON text and for the codec:
+  * total encoded size, and the database file after storing every report in
+    submission_reports (the codec's file includes its report_strings table);
+  * encode and decode time per report;
+  * reading all reports back through db_utils.get_cached_reports;
+  * memory held by the decoded reports (dicts vs report_codec.Report objects).
+
+    python benchmarks/bench_report_codec.py [--submissions 100000] [--idioms 1000] [--seed 0]
+"""
+import gc
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import tracemalloc
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+import db_utils
+import report_codec
+import synthetic
+
+GRAMMAR_MESSAGES = [
+    "Possible spelling mistake found.",
+    "This sentence does not start with an uppercase letter.",
+    "Possible agreement error. Did you mean the plural form?",
+    "Unpaired symbol: ')' seems to be missing",
+    "Use a comma before 'and' if it connects two independent clauses.",
+    "The word order seems unusual here.",
+]
+STATUSES = ("idiomatic", "non-idiomatic-literal", "non-idiomatic-missing")
+
+
+def make_reports(n, idioms, seed=0):
+    rng = random.Random(seed)
+    items = list(idioms.items())
+    reports = []
+    for _ in range(n):
+        score = round(rng.uniform(20.0, 100.0), 2)
+        issues = {}
+        for eng, data in rng.sample(items, rng.choice((0, 1, 1, 2))):
+            issues[eng] = {"status": rng.choice(STATUSES), "expected": data["arabic"]}
+        grammar = []
+        for _ in range(rng.choice((0, 0, 1, 2, 3))):
+            grammar.append({"message": rng.choice(GRAMMAR_MESSAGES),
+                            "replacements": rng.sample(synthetic.AR_WORDS, rng.randint(0, 3)),
+                            "offset": rng.randint(0, 200), "length": rng.randint(1, 12)})
+        colloc = [" ".join(rng.sample(synthetic.EN_WORDS, 2)) for _ in range(rng.choice((0, 0, 1)))]
+        segments, start = [], 0
+        for _ in range(rng.randint(1, 4)):
+            length = rng.randint(20, 90)
+            seg_score = round(rng.uniform(20.0, 100.0), 2)
+            segments.append({"source": [start, start + length], "translation": [start, start + length - 5],
+                             "semantic_score": seg_score, "semantic_flag": seg_score < 65.0})
+            start += length + 1
+        rep = {"semantic_score": score, "semantic_flag": score < 65.0, "idiom_issues": issues,
+               "grammar": grammar, "collocation_flags": colloc}
+        rep["priority"] = [name for name, on in (("semantic", rep["semantic_flag"]), ("idiom", issues),
+                                                 ("grammar", grammar), ("collocation", colloc)) if on]
+        rep["segments"] = segments
+        reports.append(rep)
+    return reports
+
+
+def timed(fn):
+    # like timeit: collector pauses over 100k live reports would swamp the per-report cost
+    gc.disable()
+    try:
+        t0 = time.perf_counter()
+        result = fn()
+        return result, time.perf_counter() - t0
+    finally:
+        gc.enable()
+
+
+def held_mb(fn):
+    """MB still allocated by fn's result."""
+    tracemalloc.start()
+    result = fn()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size / 1e6
+
+
+def store(db_path, keyed_values):
+    db_utils.close_all_connections()
+    db_utils.DB_FILE = db_path
+    db_utils.init_db()
+    with db_utils.db_cursor(commit=True) as c:
+        c.executemany("INSERT INTO submission_reports (report_key, version, report) VALUES (?,?,?)",
+                      [(k, "bench", v) for k, v in keyed_values])
+    db_utils.close_all_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", type=int, default=100000)
+    parser.add_argument("--idioms", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    n = args.submissions
+    reports = make_reports(n, synthetic.make_idioms(args.idioms, args.seed), args.seed)
+    keys = [f"{i:016x}" for i in range(n)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_blobs, json_enc = timed(lambda: [json.dumps(r, ensure_ascii=False) for r in reports])
+        _, json_dec = timed(lambda: [json.loads(b) for b in json_blobs])
+        json_db = os.path.join(tmp, "json.db")
+        store(json_db, zip(keys, json_blobs))
+
+        codec_db = os.path.join(tmp, "codec.db")
+        db_utils.close_all_connections()
+        db_utils.DB_FILE = codec_db
+        db_utils.init_db()
+        # first run interns every string through report_strings; the second is the steady state
+        _, intern_enc = timed(lambda: db_utils.encode_reports(reports))
+        codec_blobs, codec_enc = timed(lambda: db_utils.encode_reports(reports))
+        texts = db_utils._report_string_table()["texts"]
+        decoded, codec_dec = timed(lambda: [report_codec.decode(b, texts) for b in codec_blobs])
+        assert all(d == r for d, r in zip(decoded, reports))
+        _, codec_dict = timed(lambda: [d.to_dict() for d in decoded])
+        with db_utils.db_cursor(commit=True) as c:
+            c.executemany("INSERT INTO submission_reports (report_key, version, report) VALUES (?,?,?)",
+                          [(k, "bench", b) for k, b in zip(keys, codec_blobs)])
+        db_utils.close_all_connections()
+
+        read = {}
+        for name, path in (("json", json_db), ("codec", codec_db)):
+            db_utils.DB_FILE = path
+            _, read[name] = timed(lambda: db_utils.get_cached_reports(keys))
+            db_utils.close_all_connections()
+        json_mem = held_mb(lambda: [json.loads(b) for b in json_blobs])
+        codec_mem = held_mb(lambda: [report_codec.decode(b, texts) for b in codec_blobs])
+
+        json_bytes = sum(len(b.encode("utf-8")) for b in json_blobs)
+        codec_bytes = sum(len(b) for b in codec_blobs)
+        table_bytes = sum(len(t.encode("utf-8")) for t in texts if t)
+        us = 1e6 / n
+        print(f"{n} reports, {len(texts) - 1} interned strings ({table_bytes / 1e3:.1f} kB)")
+        print(f"{'':<30} {'json':>12} {'codec':>12} {'ratio':>7}")
+        for label, a, b in (
+                ("bytes per report", json_bytes / n, codec_bytes / n),
+                ("database file MB", os.path.getsize(json_db) / 1e6, os.path.getsize(codec_db) / 1e6),
+                ("encode us/report", json_enc * us, codec_enc * us),
+                ("decode us/report", json_dec * us, codec_dec * us),
+                ("decode + to_dict us/report", json_dec * us, (codec_dec + codec_dict) * us),
+                ("get_cached_reports s (all)", read["json"], read["codec"]),
+                ("decoded reports held MB", json_mem, codec_mem)):
+            print(f"{label:<30} {a:>12.2f} {b:>12.2f} {b / a if a else 0:>7.2f}")
+        print(f"first encode, interning every string: {intern_enc * us:.2f} us/report")
+
+
+if __name__ == "__main__":
+    main()
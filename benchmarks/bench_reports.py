@@ -0,0 +1,107 @@
+"""
+Per-report latency of the PDF report builder, and batch rendering throughput.
+
+Builds a synthetic class, analyzes it once (stubbed detectors) so the issue
+aggregates are populated, then times:
+  * the class report and a per-student report (report_builder.build_report);
+  * the previous implementation: a pass over every cached report plus a pyplot
+    PNG chart (only if matplotlib is installed);
+  * render_reports for every student with 1 worker and with --workers.
+
+    python benchmarks/bench_reports.py [--students 100] [--submissions 5000] [--repeat 10] [--workers 4]
+"""
+import os
+import io
+import sys
+import argparse
+import tempfile
+import statistics
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+import db_utils
+import metrics_utils
+import report_builder
+import synthetic
+
+
+def legacy_report(target):
+    # the pre-aggregate report: tally every cached report, chart through pyplot's global figure
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, Image
+    from reportlab.lib.styles import getSampleStyleSheet
+    error_counts = {"semantic": 0, "idiom": 0, "grammar": 0}
+    for rep in db_utils.get_reports_for_submissions(db_utils.get_all_submissions()):
+        error_counts["semantic"] += bool(rep.get("semantic_flag"))
+        error_counts["idiom"] += sum(i["status"].startswith("non-idiomatic") for i in rep.get("idiom_issues", {}).values())
+        error_counts["grammar"] += len(rep.get("grammar") or [])
+    styles = getSampleStyleSheet()
+    elements = [Paragraph("Instructor Report", styles["Title"]),
+                Table([["Error Type", "Count"]] + [[k, v] for k, v in error_counts.items()])]
+    plt.bar(error_counts.keys(), error_counts.values())
+    plt.title("Error Distribution")
+    buf = io.BytesIO()
+    plt.savefig(buf, format="png")
+    plt.close()
+    buf.seek(0)
+    elements.append(Image(buf, width=400, height=200))
+    SimpleDocTemplate(target).build(elements)
+
+
+def time_calls(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--submissions", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    for det in metrics_utils.DETECTORS.values():
+        det.disable("stubbed by benchmark")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "app.db")
+        students = synthetic.generate_class(db_file, os.path.join(tmp, "idioms.json"), students=args.students,
+                                            submissions=args.submissions, idioms=200)
+        t0 = time.perf_counter()
+        db_utils.get_reports_for_submissions(db_utils.get_all_submissions())
+        print(f"analyzed {args.submissions} submissions in {time.perf_counter() - t0:.1f} s")
+
+        rows = [
+            ("class report", lambda: report_builder.build_report(io.BytesIO())),
+            ("student report", lambda: report_builder.build_report(io.BytesIO(), username=students[0])),
+        ]
+        try:
+            import matplotlib  # noqa: F401
+            rows.append(("legacy class report (pyplot)", lambda: legacy_report(io.BytesIO())))
+        except ImportError:
+            print("matplotlib not installed: skipping the legacy report")
+        print(f"{'report':<30} {'p50 ms':>10} {'max ms':>10}")
+        for name, fn in rows:
+            p50, worst = time_calls(fn, args.repeat)
+            print(f"{name:<30} {p50:>10.2f} {worst:>10.2f}")
+
+        jobs = [{"username": u} for u in students]
+        for workers in sorted({0, args.workers}):
+            t0 = time.perf_counter()
+            report_builder.render_reports(jobs, os.path.join(tmp, f"out{workers}"), workers=workers, db_file=db_file)
+            elapsed = time.perf_counter() - t0
+            print(f"batch of {len(jobs)} student reports, {workers or 'no'} worker processes: "
+                  f"{elapsed:.2f} s ({1000.0 * elapsed / len(jobs):.1f} ms/report)")
+        db_utils.close_all_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Per-pair semantic_similarity_score vs semantic_similarity_scores_batch on CPU.
+
+Models a class where every student translates the same handful of source
+sentences, so references repeat and the batch path's string dedup matters.
+
+    python benchmarks/bench_semantic_batch.py [--pairs 2000] [--sources 20] [--batch-size 64]
+"""
+import os
+import sys
+import random
+import argparse
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics_utils
+
+WORDS = ("the student quickly finished a long translation of this difficult text about history "
+         "science culture language meaning idiom sentence river city market morning").split()
+
+
+def make_pairs(n_pairs, n_sources, seed=0):
+    rng = random.Random(seed)
+    refs = [" ".join(rng.choices(WORDS, k=rng.randint(8, 20))) for _ in range(n_sources)]
+    pairs = []
+    for i in range(n_pairs):
+        ref = refs[i % n_sources]
+        words = ref.split()
+        rng.shuffle(words)
+        pairs.append((ref, " ".join(words[:max(1, len(words) - rng.randint(0, 4))]), ref))
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=2000)
+    parser.add_argument("--sources", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    if metrics_utils.DETECTORS["semantic"].get() is None:
+        print("sentence-transformers model not available; timing the difflib fallback only")
+    pairs = make_pairs(args.pairs, args.sources)
+    metrics_utils.semantic_similarity_scores_batch(pairs[:8])  # warm up the model
+
+    t0 = time.perf_counter()
+    single = [metrics_utils.semantic_similarity_score(*p) for p in pairs]
+    t_single = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batch = metrics_utils.semantic_similarity_scores_batch(pairs, batch_size=args.batch_size)
+    t_batch = time.perf_counter() - t0
+
+    max_diff = max(abs(a - b) for a, b in zip(single, batch))
+    print(f"pairs={len(pairs)} distinct texts={len(set(t for p in pairs for t in p[1:]))}")
+    print(f"per-pair: {t_single:8.3f} s  ({len(pairs) / t_single:9.1f} pairs/s)")
+    print(f"batched:  {t_batch:8.3f} s  ({len(pairs) / t_batch:9.1f} pairs/s)  speedup x{t_single / t_batch:.1f}")
+    print(f"max |score difference| = {max_diff:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Cold-start cost of the app modules, measured with `python -X importtime`.
+
+Each module is imported in a fresh interpreter; the script prints the wall time
+and the slowest imports (cumulative microseconds from -X importtime).
+
+    python benchmarks/bench_startup.py [--modules metrics_utils db_utils] [--top 10]
+"""
+import os
+import sys
+import argparse
+import subprocess
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_profile(module):
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=ROOT, capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    rows = []
+    for line in proc.stderr.splitlines():
+        # "import time:      self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _self_us, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    return wall, proc.returncode, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=["metrics_utils", "db_utils"])
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        wall, rc, rows = import_profile(module)
+        status = "ok" if rc == 0 else f"failed (exit {rc})"
+        print(f"== import {module}: {wall * 1000:.1f} ms wall, {status}")
+        for cumulative, name in sorted(rows, reverse=True)[:args.top]:
+            print(f"   {cumulative / 1000:10.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
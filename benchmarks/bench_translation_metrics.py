@@ -0,0 +1,139 @@
+"""
+Throughput of translation_metrics.score_batch against a straightforward per-pair
+implementation (Counter n-grams, row-by-row edit distance).
+
+    python benchmarks/bench_translation_metrics.py [--pairs 5000] [--check-only]
+
+The check step asserts that the batch engine matches the per-pair implementation on
+random pairs and exits non-zero on any mismatch; the hand-computed scores live in
+tests/test_translation_metrics.py.
+"""
+import os
+import sys
+import math
+import random
+import argparse
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import translation_metrics as tm
+
+# ---------- per-pair reference implementation ----------
+def _ngrams(seq, n):
+    return Counter(tuple(seq[i:i + n]) for i in range(len(seq) - n + 1))
+
+
+def _levenshtein(a, b):
+    prev = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        cur = [i]
+        for j, y in enumerate(b, 1):
+            cur.append(min(prev[j - 1] + (x != y), prev[j] + 1, cur[j - 1] + 1))
+        prev = cur
+    return prev[-1]
+
+
+def naive_scores(hyp, ref):
+    hw, rw = tm.tokenize(hyp), tm.tokenize(ref)
+    precisions, smooth, order = [], 1.0, 0
+    for n in range(1, tm.BLEU_ORDER + 1):
+        total = max(len(hw) - n + 1, 0)
+        if total == 0:
+            break
+        order = n
+        h, r = _ngrams(hw, n), _ngrams(rw, n)
+        match = sum(min(c, r[g]) for g, c in h.items())
+        if match == 0:
+            smooth *= 2
+            precisions.append(100.0 / (smooth * total))
+        else:
+            precisions.append(100.0 * match / total)
+    any_match = bool(set(hw) & set(rw))
+    if order and any_match:
+        bp = math.exp(1 - len(rw) / len(hw)) if len(hw) < len(rw) else 1.0
+        bleu = bp * math.exp(sum(math.log(p) for p in precisions) / order)
+    else:
+        bleu = 0.0
+
+    hc, rc = "".join(hyp.split()), "".join(ref.split())
+    ps, rs, k = 0.0, 0.0, 0
+    for n in range(1, tm.CHRF_ORDER + 1):
+        h, r = _ngrams(hc, n), _ngrams(rc, n)
+        if not h or not r:
+            continue
+        match = sum(min(c, r[g]) for g, c in h.items())
+        ps += match / sum(h.values())
+        rs += match / sum(r.values())
+        k += 1
+    p, r = (ps / k, rs / k) if k else (0.0, 0.0)
+    beta2 = tm.CHRF_BETA ** 2
+    chrf = 100.0 * (1 + beta2) * p * r / (beta2 * p + r) if p + r else 0.0
+
+    def rate(edits, length):
+        return 100.0 * edits / length if length else (100.0 if edits else 0.0)
+
+    return {"bleu": bleu, "chrf": chrf, "ter": rate(_levenshtein(hw, rw), len(rw)),
+            "char_edit_rate": rate(_levenshtein(hyp, ref), len(ref))}
+
+
+# ---------- synthetic data ----------
+WORDS = ("the a cat dog sat ran on under mat table quickly slowly red blue he she it "
+         "was is will have had bucket kick time fly , .").split()
+
+
+def synthetic_pairs(n, seed=0):
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(n):
+        ref = [rng.choice(WORDS) for _ in range(rng.randint(3, 25))]
+        hyp = [w if rng.random() < 0.7 else rng.choice(WORDS) for w in ref]
+        if rng.random() < 0.3:
+            del hyp[rng.randrange(len(hyp))]
+        pairs.append((" ".join(hyp), " ".join(ref)))
+    return pairs
+
+
+def check(n_random=300):
+    failures = []
+    pairs = synthetic_pairs(n_random, seed=42)
+    batch = tm.score_batch([h for h, _r in pairs], [r for _h, r in pairs])
+    for k, (hyp, ref) in enumerate(pairs):
+        for metric, value in naive_scores(hyp, ref).items():
+            if abs(batch[metric][k] - value) > 1e-6:
+                failures.append(f"{metric} pair {k}: batch {batch[metric][k]:.6f} != per-pair {value:.6f}")
+    for line in failures[:20]:
+        print("FAIL", line)
+    print(f"checks: {n_random} random pairs, {len(failures)} failures")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=5000)
+    parser.add_argument("--check-only", action="store_true")
+    args = parser.parse_args()
+
+    ok = check()
+    if args.check_only or not ok:
+        sys.exit(0 if ok else 1)
+
+    pairs = synthetic_pairs(args.pairs)
+    hyps, refs = [h for h, _r in pairs], [r for _h, r in pairs]
+    t0 = time.perf_counter()
+    for hyp, ref in pairs:
+        naive_scores(hyp, ref)
+    naive = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    tm.score_batch(hyps, refs)
+    batch = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    corpus = tm.corpus_scores(hyps, refs)
+    corpus_t = time.perf_counter() - t0
+    print(f"{args.pairs} pairs: per-pair {naive:.2f} s ({args.pairs / naive:,.0f}/s), "
+          f"batch {batch:.2f} s ({args.pairs / batch:,.0f}/s), {naive / batch:.1f}x")
+    print(f"corpus scores in {corpus_t:.2f} s: " + ", ".join(f"{k}={v:.2f}" for k, v in corpus.items()))
+
+
+if __name__ == "__main__":
+    main()
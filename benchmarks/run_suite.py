@@ -0,0 +1,228 @@
+"""
+Benchmark suite: times the main db, detector and export paths on synthetic classes
+of several sizes and writes time and peak memory per case to JSON.
+
+    python benchmarks/run_suite.py [--scales small medium] [--detectors stub|real] [--out results.json]
+    python benchmarks/run_suite.py --compare base.json head.json [--threshold 1.15]
+
+Each case runs --repeat times on a database built by benchmarks/synthetic.py. The
+first run is recorded separately because it is usually cold: report caches are
+empty and detectors are not loaded yet. Peak memory comes from one more run under
+tracemalloc, so its overhead does not distort the timings. --detectors stub
+(the default, also BENCH_DETECTORS=stub) marks the heavy detector backends as
+unavailable, so the difflib/heuristic fallbacks run and results do not depend on
+which models are installed.
+
+--compare prints the median-time ratio per case and scale and exits 1 if any case
+is slower than the threshold.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+import db_utils
+import metrics_utils
+import synthetic
+
+SCALES = {
+    "small": {"students": 20, "submissions": 500, "idioms": 50},
+    "medium": {"students": 200, "submissions": 5000, "idioms": 1000},
+    "large": {"students": 2000, "submissions": 50000, "idioms": 10000},
+}
+QUEUE_LOOKUPS = 200
+CLASSIFY_SAMPLE = 200
+IDIOM_SAMPLE = 2000
+
+
+def stub_detectors():
+    for det in metrics_utils.DETECTORS.values():
+        det.disable("stubbed by benchmark")
+
+
+# ---------- cases: each takes the context and returns the number of items processed ----------
+def case_practice_queue(ctx):
+    rng = random.Random(1)
+    for _ in range(QUEUE_LOOKUPS):
+        db_utils.get_user_practice_queue(rng.choice(ctx["students"]))
+    return QUEUE_LOOKUPS
+
+
+def case_all_submissions(ctx):
+    return len(db_utils.get_all_submissions())
+
+
+def case_classify(ctx):
+    for s in ctx["sample"][:CLASSIFY_SAMPLE]:
+        db_utils.classify_translation_issues(s["source_text"], s["student_translation"], ctx["idioms"],
+                                             lang=s["target_lang"], reference=s["reference"])
+    return min(CLASSIFY_SAMPLE, len(ctx["sample"]))
+
+
+def case_detect_idioms(ctx):
+    for s in ctx["sample"][:IDIOM_SAMPLE]:
+        metrics_utils.detect_idiomatic_issues(s["source_text"], s["student_translation"], ctx["idioms"])
+    return min(IDIOM_SAMPLE, len(ctx["sample"]))
+
+
+def case_export_csv(ctx):
+    db_utils.export_submissions_with_errors(os.path.join(ctx["tmp"], "export.csv"))
+    return ctx["scale"]["submissions"]
+
+
+def case_export_pdf(ctx):
+    db_utils.export_instructor_report_pdf(os.path.join(ctx["tmp"], "report.pdf"))
+    return 1
+
+
+CASES = [
+    ("get_user_practice_queue", case_practice_queue),
+    ("get_all_submissions", case_all_submissions),
+    ("classify_translation_issues", case_classify),
+    ("detect_idiomatic_issues", case_detect_idioms),
+    ("export_submissions_with_errors", case_export_csv),
+    ("export_instructor_report_pdf", case_export_pdf),
+]
+
+
+def run_case(fn, ctx, repeat):
+    timings = []
+    items = 0
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        items = fn(ctx)
+        timings.append(time.perf_counter() - t0)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn(ctx)
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    warm = timings[1:] or timings
+    median = statistics.median(warm)
+    return {
+        "items": items,
+        "first_s": round(timings[0], 6),
+        "median_s": round(median, 6),
+        "min_s": round(min(warm), 6),
+        "per_item_ms": round(1000.0 * median / items, 6) if items else None,
+        "peak_mb": round(peak / 1e6, 3),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(scales, detectors, repeat, cases, seed=0):
+    if detectors == "stub":
+        stub_detectors()
+    results = []
+    for scale_name in scales:
+        scale = SCALES[scale_name]
+        with tempfile.TemporaryDirectory() as tmp:
+            t0 = time.perf_counter()
+            students = synthetic.generate_class(os.path.join(tmp, "app.db"), os.path.join(tmp, "idioms.json"),
+                                                students=scale["students"], submissions=scale["submissions"],
+                                                idioms=scale["idioms"], seed=seed)
+            print(f"[{scale_name}] generated {scale} in {time.perf_counter() - t0:.1f} s", flush=True)
+            ctx = {
+                "tmp": tmp, "scale": scale, "students": students,
+                "idioms": metrics_utils.load_idioms_from_file(db_utils.IDIOMS_FILE),
+                "sample": random.Random(seed).sample(db_utils.get_all_submissions(),
+                                                     min(IDIOM_SAMPLE, scale["submissions"])),
+            }
+            for name, fn in CASES:
+                if cases and name not in cases:
+                    continue
+                try:
+                    row = run_case(fn, ctx, repeat)
+                except ImportError as e:
+                    row = {"skipped": f"missing dependency: {e.name or e}"}
+                results.append({"case": name, "scale": scale_name, **row})
+                shown = (f"median {row['median_s'] * 1000:.1f} ms, first {row['first_s'] * 1000:.1f} ms, "
+                         f"peak {row['peak_mb']:.1f} MB") if "median_s" in row else row["skipped"]
+                print(f"[{scale_name}] {name}: {shown}", flush=True)
+            db_utils.close_all_connections()
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "detectors": detectors,
+            "detector_version": metrics_utils.detector_version(),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare(base_path, head_path, threshold):
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(head_path, encoding="utf-8") as f:
+        head = json.load(f)
+    base_rows = {(r["case"], r["scale"]): r for r in base["results"] if "median_s" in r}
+    print(f"base {base['meta'].get('revision')} ({base['meta'].get('detectors')}) -> "
+          f"head {head['meta'].get('revision')} ({head['meta'].get('detectors')})")
+    print(f"{'case':<32} {'scale':<7} {'base ms':>10} {'head ms':>10} {'ratio':>7} {'base MB':>8} {'head MB':>8}")
+    regressions = 0
+    for row in head["results"]:
+        old = base_rows.get((row["case"], row["scale"]))
+        if old is None or "median_s" not in row:
+            continue
+        ratio = row["median_s"] / old["median_s"] if old["median_s"] else float("inf")
+        flag = ""
+        if ratio > threshold:
+            flag = "  SLOWER"
+            regressions += 1
+        elif ratio < 1.0 / threshold:
+            flag = "  faster"
+        print(f"{row['case']:<32} {row['scale']:<7} {old['median_s'] * 1000:>10.2f} {row['median_s'] * 1000:>10.2f} "
+              f"{ratio:>7.2f} {old['peak_mb']:>8.1f} {row['peak_mb']:>8.1f}{flag}")
+    print(f"{regressions} case(s) slower than x{threshold}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small", "medium"])
+    parser.add_argument("--detectors", choices=["stub", "real"], default=os.environ.get("BENCH_DETECTORS", "stub"))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cases", nargs="+", choices=[name for name, _fn in CASES])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"))
+    parser.add_argument("--threshold", type=float, default=1.15)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+    report = run_suite(args.scales, args.detectors, max(1, args.repeat), args.cases, args.seed)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
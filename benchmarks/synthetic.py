@@ -0,0 +1,120 @@
+"""
+Deterministic synthetic class for benchmarks: N students, M submissions, K idioms and
+practice assignments, written into an app database plus an idioms JSON file.
+
+The same arguments and seed always give the same rows, so timings from two
+checkouts are comparable.
+
+    python benchmarks/synthetic.py --db bench/app.db [--idioms bench/idioms.json] \
+        [--students 200] [--submissions 5000] [--idioms-count 1000] [--assignments 20] [--seed 0]
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_utils
+
+EN_WORDS = ("time ice bucket beans cat bag rain dogs leg break kick spill hit road sack moon blue once "
+            "piece cake river city market morning student quickly finished long text history").split()
+AR_WORDS = ("كسر الجمود فارق الحياة كشف السر قطعة كعكة نادر جدا سهل للغاية النهر المدينة السوق "
+            "الصباح الطالب بسرعة أنهى النص الطويل التاريخ").split()
+SOURCE_FRAMES = [
+    "Yesterday he decided to {idiom} before the meeting.",
+    "Nobody expected her to {idiom} so soon.",
+    "When the market opened they had to {idiom} again.",
+    "It is hard to {idiom} in a city like this.",
+]
+PRACTICE_CATEGORIES = ("idiom", "grammar", "semantic", "collocation")
+START_DAY = datetime.date(2024, 1, 1)
+
+
+def make_idioms(k, seed=0):
+    """{english idiom: {"arabic": rendering}}; the first three are the ones shipped in idioms.json."""
+    rng = random.Random(seed)
+    idioms = {
+        "kick the bucket": {"arabic": "فارق الحياة"},
+        "break the ice": {"arabic": "كسر الجمود"},
+        "spill the beans": {"arabic": "كشف السر"},
+    }
+    while len(idioms) < k:
+        eng = " ".join(rng.sample(EN_WORDS, rng.randint(2, 4)))
+        idioms.setdefault(eng, {"arabic": " ".join(rng.sample(AR_WORDS, rng.randint(2, 3)))})
+    return dict(list(idioms.items())[:k])
+
+
+def make_submission(rng, idioms_list):
+    eng, data = rng.choice(idioms_list)
+    source = rng.choice(SOURCE_FRAMES).format(idiom=eng)
+    reference = f"{' '.join(rng.sample(AR_WORDS, 3))} {data['arabic']}"
+    roll = rng.random()
+    if roll < 0.5:
+        translation = f"{' '.join(rng.sample(AR_WORDS, 3))} {data['arabic']}"
+    elif roll < 0.7:
+        translation = f"{' '.join(rng.sample(AR_WORDS, 3))} {eng}"
+    else:
+        translation = " ".join(rng.sample(AR_WORDS, rng.randint(3, 8)))
+    if rng.random() < 0.1:
+        translation += "  !!!"
+    return source, translation, reference
+
+
+def generate_class(db_path, idioms_path, students=200, submissions=5000, idioms=1000,
+                   assignments_per_student=20, practice_items=500, seed=0):
+    """Create (or replace) db_path and idioms_path; returns the generated usernames."""
+    rng = random.Random(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    db_utils.close_all_connections()
+    db_utils.DB_FILE = db_path
+    db_utils.IDIOMS_FILE = idioms_path
+    db_utils.init_db()
+
+    idioms_dict = make_idioms(idioms, seed)
+    with open(idioms_path, "w", encoding="utf-8") as f:
+        json.dump(idioms_dict, f, ensure_ascii=False, indent=1)
+    idioms_list = list(idioms_dict.items())
+
+    usernames = [f"student{i:06d}" for i in range(students)]
+    with db_utils.db_cursor(commit=True) as c:
+        c.executemany("INSERT INTO users (username, password, role, approved) VALUES (?,?,?,1)",
+                      [(u, "pw", "Student") for u in usernames] + [("instructor", "pw", "Instructor")])
+        c.executemany("INSERT INTO practice_bank (category, prompt, reference) VALUES (?,?,?)",
+                      [(rng.choice(PRACTICE_CATEGORIES), f"Practice prompt {i}: {rng.choice(idioms_list)[0]}", "")
+                       for i in range(practice_items)])
+        c.executemany("INSERT OR IGNORE INTO practice_assignments (username, practice_id) VALUES (?,?)",
+                      [(u, rng.randint(1, practice_items)) for u in usernames for _ in range(assignments_per_student)])
+        rows = []
+        for i in range(submissions):
+            source, translation, reference = make_submission(rng, idioms_list)
+            day = START_DAY + datetime.timedelta(days=rng.randrange(90), seconds=rng.randrange(86400))
+            rows.append((usernames[i % students], source, translation, reference, "ar",
+                         day.strftime("%Y-%m-%d %H:%M:%S")))
+        c.executemany("""INSERT INTO submissions (username, source_text, student_translation, reference,
+                         target_lang, created_at) VALUES (?,?,?,?,?,?)""", rows)
+    return usernames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", required=True, help="database file to create (replaced if it exists)")
+    parser.add_argument("--idioms", help="idioms JSON to write (default: next to --db)")
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--submissions", type=int, default=5000)
+    parser.add_argument("--idioms-count", type=int, default=1000)
+    parser.add_argument("--assignments", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.idioms = args.idioms or os.path.join(os.path.dirname(os.path.abspath(args.db)), "idioms.json")
+    generate_class(args.db, args.idioms, args.students, args.submissions, args.idioms_count,
+                   args.assignments, seed=args.seed)
+    print(f"wrote {args.db} and {args.idioms}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+# collocation_index.py
+"""
+Precomputed Brown-corpus unigram/bigram counts for detect_collocation_issues.
+
+The corpus is counted once (`python collocation_index.py build`) into a compact
+SQLite file: words get integer ids and bigram counts live in a WITHOUT ROWID
+table keyed by (id1, id2). At runtime the file is opened read-only and
+memory-mapped, and scoring a sentence costs one indexed query for its words plus
+one primary-key probe per adjacent pair.
+
+A bigram is flagged when both words are common enough in the corpus but the pair
+itself is rarer than chance, measured by smoothed pointwise mutual information:
+
+    pmi(w1, w2) = log2((c(w1 w2) + 0.5) * N / (c(w1) * c(w2)))
+"""
+import os
+import re
+import sys
+import math
+import sqlite3
+import argparse
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+COLLOCATION_INDEX_FILE = os.environ.get("COLLOCATION_INDEX", "brown_bigrams.db")
+MIN_UNIGRAM_COUNT = 5     # rarer words say more about the corpus than about the student
+PMI_THRESHOLD = 0.0       # below 0 the pair occurs less often than chance
+SMOOTHING = 0.5
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def brown_tokens():
+    from metrics_utils import ensure_nltk_resource
+    ensure_nltk_resource("corpora/brown", "brown")
+    from nltk.corpus import brown
+    for w in brown.words():
+        w = w.lower()
+        if _TOKEN_RE.fullmatch(w):
+            yield w
+
+
+def build_index(path=None, tokens=None, source="brown"):
+    """Count unigrams and bigrams of tokens (default: the Brown corpus) into an index file."""
+    path = path or COLLOCATION_INDEX_FILE
+    tokens = brown_tokens() if tokens is None else tokens
+    unigrams = Counter()
+    bigrams = Counter()
+    prev = None
+    for w in tokens:
+        unigrams[w] += 1
+        if prev is not None:
+            bigrams[(prev, w)] += 1
+        prev = w
+    ids = {w: i for i, (w, _n) in enumerate(unigrams.most_common())}
+
+    # A private temp file next to the target, so concurrent builds never share one
+    # and os.replace stays on the same filesystem.
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                               dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        _write_index(tmp, unigrams, bigrams, ids, source)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+def _write_index(tmp, unigrams, bigrams, ids, source):
+    conn = sqlite3.connect(tmp)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE unigrams (word TEXT PRIMARY KEY, id INTEGER NOT NULL, n INTEGER NOT NULL) WITHOUT ROWID")
+    conn.execute("""CREATE TABLE bigrams (id1 INTEGER NOT NULL, id2 INTEGER NOT NULL, n INTEGER NOT NULL,
+                    PRIMARY KEY (id1, id2)) WITHOUT ROWID""")
+    conn.executemany("INSERT INTO unigrams VALUES (?,?,?)", ((w, ids[w], n) for w, n in unigrams.items()))
+    conn.executemany("INSERT INTO bigrams VALUES (?,?,?)",
+                     sorted((ids[a], ids[b], n) for (a, b), n in bigrams.items()))
+    conn.executemany("INSERT INTO meta VALUES (?,?)", [
+        ("source", source),
+        ("tokens", str(sum(unigrams.values()))),
+        ("unigrams", str(len(unigrams))),
+        ("bigrams", str(len(bigrams))),
+    ])
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+
+@contextmanager
+def _build_lock(path):
+    """Exclusive lock on path + ".lock" across processes (flock; msvcrt on Windows)."""
+    with open(path + ".lock", "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:   # LK_LOCK gives up after ~10 s; keep waiting for the builder
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class CollocationIndex:
+    def __init__(self, path=None):
+        self.path = path or COLLOCATION_INDEX_FILE
+        self.conn = sqlite3.connect(f"file:{os.path.abspath(self.path)}?mode=ro", uri=True,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA mmap_size=268435456")
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        self.total = int(meta["tokens"])
+        self.source = meta.get("source", "?")
+
+    def unigram_info(self, words):
+        """{word: (id, count)} for the words present in the index."""
+        words = list(set(words))
+        if not words:
+            return {}
+        marks = ",".join("?" * len(words))
+        return {w: (i, n) for w, i, n in
+                self.conn.execute(f"SELECT word, id, n FROM unigrams WHERE word IN ({marks})", words)}
+
+    def bigram_counts(self, id_pairs):
+        # One primary-key probe per pair with the same cached statement; a row-value
+        # IN (VALUES ...) list is planned as a scan of the bigram table.
+        counts = {}
+        for pair in set(id_pairs):
+            row = self.conn.execute("SELECT n FROM bigrams WHERE id1=? AND id2=?", pair).fetchone()
+            if row:
+                counts[pair] = row[0]
+        return counts
+
+    def score_bigrams(self, words, min_unigram=MIN_UNIGRAM_COUNT):
+        """[(w1, w2, pmi, bigram_count)] for adjacent pairs whose words both occur >= min_unigram times."""
+        info = self.unigram_info(words)
+        pairs = [(a, b) for a, b in zip(words, words[1:])
+                 if a in info and b in info and info[a][1] >= min_unigram and info[b][1] >= min_unigram]
+        counts = self.bigram_counts((info[a][0], info[b][0]) for a, b in pairs)
+        scored = []
+        for a, b in pairs:
+            n12 = counts.get((info[a][0], info[b][0]), 0)
+            pmi = math.log2((n12 + SMOOTHING) * self.total / (info[a][1] * info[b][1]))
+            scored.append((a, b, pmi, n12))
+        return scored
+
+    def rare_bigrams(self, text, top_n=3, threshold=PMI_THRESHOLD):
+        """The top_n lowest-PMI adjacent bigrams of text below threshold, as "w1 w2" strings."""
+        scored = [s for s in self.score_bigrams(tokenize(text)) if s[2] < threshold]
+        scored.sort(key=lambda s: s[2])
+        seen = []
+        for a, b, _pmi, _n in scored:
+            phrase = f"{a} {b}"
+            if phrase not in seen:
+                seen.append(phrase)
+            if len(seen) == top_n:
+                break
+        return seen
+
+
+def load_or_build(path=None):
+    """
+    Open the index, building it from the Brown corpus the first time. Processes starting
+    together (an analysis pool, the web app) build it once: the others wait for the lock
+    and then open the finished file.
+    """
+    path = path or COLLOCATION_INDEX_FILE
+    if not os.path.exists(path):
+        with _build_lock(path):
+            if not os.path.exists(path):
+                build_index(path)
+    return CollocationIndex(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the Brown bigram index.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="count the Brown corpus into the index file")
+    b.add_argument("--output", default=COLLOCATION_INDEX_FILE)
+    q = sub.add_parser("check", help="print rare bigrams of a sentence")
+    q.add_argument("text")
+    q.add_argument("--index", default=COLLOCATION_INDEX_FILE)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        t0 = time.perf_counter()
+        build_index(args.output)
+        print(f"built {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB) in {time.perf_counter() - t0:.1f} s")
+    else:
+        idx = CollocationIndex(args.index)
+        for a, b, pmi, n in sorted(idx.score_bigrams(tokenize(args.text)), key=lambda s: s[2]):
+            print(f"{a} {b}\tpmi={pmi:.2f}\tcount={n}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
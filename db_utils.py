@@ -1,221 +1,1684 @@
 import sqlite3
 import json
 import csv
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
-import matplotlib.pyplot as plt
+import queue
+import threading
+import time
+import functools
+from contextlib import contextmanager
 import io
+import gzip
+import hashlib
+import datetime
+
+import auth
+import metrics_utils
+import perf
+import report_codec
+from idiom_matcher import IdiomSnapshot
 
 DB_FILE = "app.db"
+IDIOMS_FILE = "idioms.json"
+
+# ----------------- CHANGE COUNTERS -----------------
+# Callers that memoize query results (the Streamlit app) put data_generation(topic, key)
+# in their cache key. Writes below bump the counters after they commit, so the next
+# read misses while every other cached entry stays valid. Only writes made by this
+# process are seen; cache TTLs bound staleness from standalone analysis workers.
+# Topics: "users", "practice_bank", "practice" and "submissions" (keyed by username),
+# and "issues" (also keyed by username).
+_generations_lock = threading.Lock()
+_generation_totals = {}      # topic -> writes of any key
+_generation_broadcasts = {}  # topic -> writes that touched every key
+_generation_keys = {}        # (topic, key) -> writes for that key
+
+def bump_generation(topic, key=None):
+    """Record a write to `topic`, for one key or (key=None) for all of them."""
+    with _generations_lock:
+        _generation_totals[topic] = _generation_totals.get(topic, 0) + 1
+        if key is None:
+            _generation_broadcasts[topic] = _generation_broadcasts.get(topic, 0) + 1
+        else:
+            _generation_keys[(topic, key)] = _generation_keys.get((topic, key), 0) + 1
+
+def data_generation(topic, key=None):
+    """A number that changes whenever this process writes to `topic` (to `key`, if given)."""
+    if key is None:
+        return _generation_totals.get(topic, 0)
+    return _generation_broadcasts.get(topic, 0) + _generation_keys.get((topic, key), 0)
+
+# ----------------- CONNECTIONS -----------------
+# Connections are pooled per database file and reused across calls (and across
+# Streamlit script threads) instead of being opened and closed every time.
+DB_POOL_SIZE = 8
+DB_BUSY_TIMEOUT = 5.0       # seconds sqlite waits on a locked database
+DB_RETRIES = 5              # extra attempts when the lock outlives the timeout
+DB_STATEMENT_CACHE = 256    # prepared statements kept per connection
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # readers no longer block the writer
+    "PRAGMA synchronous=NORMAL",    # safe with WAL, far fewer fsyncs
+    "PRAGMA cache_size=-16000",     # ~16 MB page cache per connection
+    "PRAGMA mmap_size=268435456",   # 256 MB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _open_connection(path):
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+                           cached_statements=DB_STATEMENT_CACHE)
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _get_pool(path):
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        return pool
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection to DB_FILE; it goes back to the pool afterwards."""
+    pool = _get_pool(DB_FILE)
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection(DB_FILE)
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+@contextmanager
+def db_cursor(commit=False):
+    """Cursor on a pooled connection. With commit=True the block runs in one transaction."""
+    with db_connection() as conn:
+        if commit:
+            with conn:
+                yield conn.cursor()
+        else:
+            yield conn.cursor()
+
+def close_all_connections():
+    """Close every pooled connection (e.g. before switching DB_FILE or deleting it)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+def _is_busy_error(exc):
+    msg = str(exc).lower()
+    return "locked" in msg or "busy" in msg
+
+def db_retry(fn):
+    """Retry fn with exponential backoff when sqlite reports the database as locked/busy."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        delay = 0.05
+        for attempt in range(DB_RETRIES + 1):
+            try:
+                return fn(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if attempt == DB_RETRIES or not _is_busy_error(e):
+                    raise
+                perf.incr("db_busy_retries_total", query=fn.__name__)
+                time.sleep(delay)
+                delay *= 2
+    # With PERF_METRICS=1, every query function reports its latency and result size.
+    return perf.timed("db_query_seconds", rows="db_rows_total", query=fn.__name__)(wrapper)
 
 # ----------------- DATABASE -----------------
+@db_retry
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("""CREATE TABLE IF NOT EXISTS users (
+    with db_cursor(commit=True) as c:
+        c.execute("""CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT,
+            role TEXT,
+            approved INTEGER DEFAULT 0
+        )""")
+        c.execute("""CREATE TABLE IF NOT EXISTS submissions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            source_text TEXT,
+            student_translation TEXT,
+            reference TEXT,
+            target_lang TEXT
+        )""")
+        c.execute("""CREATE TABLE IF NOT EXISTS practice_bank (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT,
+            prompt TEXT,
+            reference TEXT
+        )""")
+        c.execute("""CREATE TABLE IF NOT EXISTS practice_assignments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            practice_id INTEGER
+        )""")
+    migrate()
+
+# ----------------- MIGRATIONS -----------------
+# init_db() creates the original (version 0) tables; everything after that is an
+# ordered migration recorded in schema_version, so old app.db files are upgraded
+# in place on the next start. Append new migrations, never edit applied ones.
+def _rebuild_table(c, table, create_sql, columns):
+    """Recreate `table` from create_sql (which must create `<table>_new`), keeping `columns`."""
+    cols = ", ".join(columns)
+    c.execute(create_sql)
+    c.execute(f"INSERT INTO {table}_new ({cols}) SELECT {cols} FROM {table}")
+    c.execute(f"DROP TABLE {table}")
+    c.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+def _migration_001_indexes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_assignments_user_practice "
+              "ON practice_assignments(username, practice_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_submissions_username ON submissions(username)")
+
+def _migration_002_foreign_keys_and_timestamps(c):
+    # SQLite cannot add foreign keys (or a CURRENT_TIMESTAMP default) with ALTER TABLE,
+    # so the three tables are rebuilt, parents first. Copied rows get the upgrade
+    # time as created_at.
+    _rebuild_table(c, "users", """CREATE TABLE users_new (
         username TEXT PRIMARY KEY,
         password TEXT,
         role TEXT,
-        approved INTEGER DEFAULT 0
-    )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS submissions (
+        approved INTEGER DEFAULT 0,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )""", ["username", "password", "role", "approved"])
+    # Keep submissions from accounts that no longer exist as unapproved stub users.
+    c.execute("""INSERT OR IGNORE INTO users (username, approved)
+                 SELECT DISTINCT username, 0 FROM submissions WHERE username IS NOT NULL""")
+    _rebuild_table(c, "submissions", """CREATE TABLE submissions_new (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT,
+        username TEXT REFERENCES users(username) ON UPDATE CASCADE,
         source_text TEXT,
         student_translation TEXT,
         reference TEXT,
-        target_lang TEXT
+        target_lang TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )""", ["id", "username", "source_text", "student_translation", "reference", "target_lang"])
+    # Assignments pointing at deleted users/items are unreachable anyway.
+    c.execute("""DELETE FROM practice_assignments
+                 WHERE username NOT IN (SELECT username FROM users)
+                    OR practice_id NOT IN (SELECT id FROM practice_bank)""")
+    _rebuild_table(c, "practice_assignments", """CREATE TABLE practice_assignments_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT REFERENCES users(username) ON UPDATE CASCADE ON DELETE CASCADE,
+        practice_id INTEGER REFERENCES practice_bank(id) ON DELETE CASCADE,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )""", ["id", "username", "practice_id"])
+    _migration_001_indexes(c)  # dropped together with the old tables
+    c.execute("CREATE INDEX IF NOT EXISTS idx_assignments_practice ON practice_assignments(practice_id)")
+
+def _migration_003_submission_reports(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS submission_reports (
+        report_key TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        report TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
     )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS practice_bank (
+    c.execute("CREATE INDEX IF NOT EXISTS idx_submission_reports_version ON submission_reports(version)")
+
+def _migration_004_analysis_jobs(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS analysis_jobs (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        category TEXT,
-        prompt TEXT,
-        reference TEXT
+        submission_id INTEGER NOT NULL REFERENCES submissions(id) ON DELETE CASCADE,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        error TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
     )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS practice_assignments (
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs(status, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_submission ON analysis_jobs(submission_id)")
+
+def _migration_005_issue_aggregates(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS submission_issues (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT,
-        practice_id INTEGER
+        submission_id INTEGER NOT NULL REFERENCES submissions(id) ON DELETE CASCADE,
+        username TEXT NOT NULL,
+        target_lang TEXT NOT NULL,
+        issue_type TEXT NOT NULL,
+        idiom TEXT NOT NULL DEFAULT '',
+        severity REAL,
+        created_at TEXT NOT NULL
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_submission_issues_submission ON submission_issues(submission_id)")
+    c.execute("""CREATE TABLE IF NOT EXISTS submission_analysis (
+        submission_id INTEGER PRIMARY KEY REFERENCES submissions(id) ON DELETE CASCADE,
+        version TEXT NOT NULL,
+        analyzed_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS issue_daily_counts (
+        day TEXT NOT NULL,
+        issue_type TEXT NOT NULL,
+        idiom TEXT NOT NULL,
+        username TEXT NOT NULL,
+        target_lang TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        PRIMARY KEY (day, issue_type, idiom, username, target_lang)
+    ) WITHOUT ROWID""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_issue_daily_user ON issue_daily_counts(username, day)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_issue_daily_lang ON issue_daily_counts(target_lang, day)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_issue_daily_idiom ON issue_daily_counts(issue_type, idiom)")
+
+def _migration_006_issue_covering_indexes(c):
+    # Report queries filter on username or target_lang and sum n per issue_type; covering
+    # indexes answer them without touching the table, and ANALYZE stops the planner from
+    # picking the idiom index for every query.
+    for name in ("idx_issue_daily_user", "idx_issue_daily_lang", "idx_issue_daily_idiom"):
+        c.execute(f"DROP INDEX IF EXISTS {name}")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_issue_daily_user ON issue_daily_counts(username, issue_type, day, n)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_issue_daily_lang ON issue_daily_counts(target_lang, issue_type, day, n)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_issue_daily_type ON issue_daily_counts(issue_type, idiom, n)")
+    c.execute("ANALYZE issue_daily_counts")
+
+def _migration_007_assignment_status(c):
+    # Assigning the same item twice used to add a second row; keep the oldest one.
+    c.execute("""DELETE FROM practice_assignments WHERE id NOT IN
+                 (SELECT MIN(id) FROM practice_assignments GROUP BY username, practice_id)""")
+    c.execute("DROP INDEX IF EXISTS idx_assignments_user_practice")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_assignments_user_practice "
+              "ON practice_assignments(username, practice_id)")
+    c.execute("ALTER TABLE practice_assignments ADD COLUMN status TEXT NOT NULL DEFAULT 'assigned'")
+    c.execute("ALTER TABLE practice_assignments ADD COLUMN due_date TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_assignments_queue ON practice_assignments(username, status, id)")
+
+def _migration_008_student_progress(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS submission_metrics (
+        submission_id INTEGER PRIMARY KEY REFERENCES submissions(id) ON DELETE CASCADE,
+        username TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        semantic REAL,
+        bleu REAL,
+        chrf REAL,
+        word_accuracy REAL,
+        char_accuracy REAL,
+        semantic_issues INTEGER NOT NULL DEFAULT 0,
+        idiom_issues INTEGER NOT NULL DEFAULT 0,
+        grammar_issues INTEGER NOT NULL DEFAULT 0
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_submission_metrics_user "
+              "ON submission_metrics(username, created_at, submission_id)")
+    c.execute("""CREATE TABLE IF NOT EXISTS student_metric_weekly (
+        username TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        week TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        total REAL NOT NULL,
+        PRIMARY KEY (username, metric, week)
+    ) WITHOUT ROWID""")
+    c.execute("""CREATE TABLE IF NOT EXISTS student_metric_rollup (
+        username TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        total REAL NOT NULL,
+        sum_x REAL NOT NULL,
+        sum_xx REAL NOT NULL,
+        sum_xy REAL NOT NULL,
+        last_n INTEGER NOT NULL DEFAULT 0,
+        last_total REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (username, metric)
+    ) WITHOUT ROWID""")
+    # Already-analyzed submissions have no metrics yet: mark them stale so the worker's
+    # backfill re-records them (their old issues are subtracted first, as on any re-analysis).
+    c.execute("UPDATE submission_analysis SET version = version || '+pre-progress'")
+
+def _migration_009_import_checkpoints(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS import_checkpoints (
+        source TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        rows_done INTEGER NOT NULL,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+def _migration_010_report_strings(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS report_strings (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL UNIQUE
+    )""")
+
+def _migration_011_idioms(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS idioms (
+        id INTEGER PRIMARY KEY,
+        phrase TEXT NOT NULL UNIQUE,
+        category TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
     )""")
-    conn.commit()
-    conn.close()
+    # Keyed by language first: a language's snapshot is one primary-key range scan.
+    c.execute("""CREATE TABLE IF NOT EXISTS idiom_renderings (
+        target_lang TEXT NOT NULL,
+        idiom_id INTEGER NOT NULL REFERENCES idioms(id) ON DELETE CASCADE,
+        rendering TEXT NOT NULL,
+        is_primary INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (target_lang, idiom_id, rendering)
+    ) WITHOUT ROWID""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_idiom_renderings_idiom ON idiom_renderings(idiom_id)")
+    c.execute("""CREATE TABLE IF NOT EXISTS data_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    ) WITHOUT ROWID""")
+    # Running idiom miss totals per language; target_lang '*' holds the total over all languages.
+    c.execute("""CREATE TABLE IF NOT EXISTS idiom_miss_counts (
+        target_lang TEXT NOT NULL,
+        idiom TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        PRIMARY KEY (target_lang, idiom)
+    ) WITHOUT ROWID""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_idiom_miss_counts_top ON idiom_miss_counts(target_lang, n DESC, idiom)")
+    c.execute("""INSERT INTO idiom_miss_counts (target_lang, idiom, n)
+                 SELECT target_lang, idiom, SUM(n) FROM issue_daily_counts WHERE issue_type = 'idiom'
+                 GROUP BY target_lang, idiom HAVING SUM(n) > 0""")
+    c.execute("""INSERT INTO idiom_miss_counts (target_lang, idiom, n)
+                 SELECT '*', idiom, SUM(n) FROM issue_daily_counts WHERE issue_type = 'idiom'
+                 GROUP BY idiom HAVING SUM(n) > 0""")
+
+MIGRATIONS = [
+    (1, "indexes on practice_assignments(username, practice_id) and submissions(username)",
+     _migration_001_indexes),
+    (2, "foreign keys and created_at columns", _migration_002_foreign_keys_and_timestamps),
+    (3, "submission_reports analysis cache", _migration_003_submission_reports),
+    (4, "analysis_jobs queue", _migration_004_analysis_jobs),
+    (5, "per-submission issues and daily issue aggregates", _migration_005_issue_aggregates),
+    (6, "covering indexes on issue_daily_counts", _migration_006_issue_covering_indexes),
+    (7, "unique practice assignments with status and due_date", _migration_007_assignment_status),
+    (8, "per-submission metrics and student progress rollups", _migration_008_student_progress),
+    (9, "bulk import checkpoints", _migration_009_import_checkpoints),
+    (10, "interned strings of binary reports", _migration_010_report_strings),
+    (11, "idiom dictionary tables, data versions and idiom miss counts", _migration_011_idioms),
+]
+
+def get_schema_version():
+    with db_cursor() as c:
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='schema_version'")
+        if c.fetchone() is None:
+            return 0
+        c.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return c.fetchone()[0]
+
+@db_retry
+def migrate(target=None):
+    """Apply pending MIGRATIONS in order (up to `target`); returns the resulting version."""
+    with db_connection() as conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )""")
+        # foreign_keys can only be toggled outside a transaction; table rebuilds need it off.
+        conn.execute("PRAGMA foreign_keys=OFF")
+        try:
+            for version, description, apply in MIGRATIONS:
+                if target is not None and version > target:
+                    break
+                # BEGIN IMMEDIATE takes the write lock up front so concurrent app
+                # processes starting together apply each migration exactly once.
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    done = conn.execute("SELECT 1 FROM schema_version WHERE version=?", (version,)).fetchone()
+                    if not done:
+                        c = conn.cursor()
+                        apply(c)
+                        bad = c.execute("PRAGMA foreign_key_check").fetchall()
+                        if bad:
+                            raise sqlite3.IntegrityError(f"migration {version} left foreign key violations: {bad[:5]}")
+                        c.execute("INSERT INTO schema_version (version, description) VALUES (?,?)",
+                                  (version, description))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        finally:
+            conn.execute("PRAGMA foreign_keys=ON")
+        return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
 
 # ----------------- USER -----------------
-def register_user(username, password, role):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO users (username, password, role, approved) VALUES (?,?,?,0)",
-              (username, password, role))
-    conn.commit()
-    conn.close()
+# Passwords are stored as auth.hash_password() strings; rows from before hashing hold
+# plaintext and are rehashed by authenticate() on their next successful login.
+def register_user(username, password, role, approved=0):
+    """Set an account's password, role and approval, creating it if needed (admin use; see create_user)."""
+    # Hashed outside db_retry so a busy retry doesn't pay for the hash again.
+    _upsert_user(username, auth.hash_password(password), role, approved)
+    auth.revoke_user_sessions(username)
+
+def create_user(username, password, role):
+    """
+    Self-registration: add an account awaiting an instructor's approval; False if the
+    username is taken. Nobody is approved here, instructors included: the first one is
+    created with `grade_cli.py --add-instructor`. An account a bulk import created (no
+    password yet) can be claimed, but keeps its imported role and still needs approval.
+    """
+    return _insert_user(username, auth.hash_password(password), role)
+
+@db_retry
+def _insert_user(username, password_hash, role):
+    with db_cursor(commit=True) as c:
+        c.execute("""INSERT INTO users (username, password, role, approved) VALUES (?,?,?,0)
+                     ON CONFLICT(username) DO UPDATE SET password=excluded.password, approved=0
+                     WHERE users.password IS NULL""", (username, password_hash, role))
+        if not c.rowcount:
+            return False
+    bump_generation("users")
+    return True
+
+@db_retry
+def _upsert_user(username, password_hash, role, approved):
+    # Upsert rather than INSERT OR REPLACE: REPLACE deletes the old row, which would
+    # cascade to the user's practice assignments.
+    with db_cursor(commit=True) as c:
+        c.execute("""INSERT INTO users (username, password, role, approved) VALUES (?,?,?,?)
+                     ON CONFLICT(username) DO UPDATE SET
+                        password=excluded.password, role=excluded.role, approved=excluded.approved""",
+                  (username, password_hash, role, approved))
+    bump_generation("users")
+
+@db_retry
+def _get_credentials(username):
+    with db_cursor() as c:
+        c.execute("SELECT password, role, approved FROM users WHERE username=?", (username,))
+        return c.fetchone()
+
+@db_retry
+def _rehash_password(username, old_value, new_hash):
+    # Compare-and-set: a password changed since old_value was read is left alone.
+    with db_cursor(commit=True) as c:
+        c.execute("UPDATE users SET password=? WHERE username=? AND password=?", (new_hash, username, old_value))
+
+def authenticate(username, password):
+    """
+    {"username", "role"} if the password matches an approved account, else None. One query
+    reads the hash, role and approval; no connection is held while the hash runs. Plaintext
+    or outdated hashes are replaced with a current one.
+    """
+    row = _get_credentials(username)
+    if row is None:
+        auth.burn_verify(password)
+        return None
+    stored, role, approved = row
+    ok, needs_rehash = auth.verify_password(password, stored)
+    if not ok or not approved:
+        return None
+    if needs_rehash:
+        _rehash_password(username, stored, auth.hash_password(password))
+    return {"username": username, "role": role}
 
 def login_user(username, password):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username=? AND password=? AND approved=1", (username, password))
-    user = c.fetchone()
-    conn.close()
-    return user is not None
+    return authenticate(username, password) is not None
 
+@db_retry
 def get_user_role(username):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT role FROM users WHERE username=?", (username,))
-    role = c.fetchone()
-    conn.close()
+    with db_cursor() as c:
+        c.execute("SELECT role FROM users WHERE username=?", (username,))
+        role = c.fetchone()
     return role[0] if role else None
 
+@db_retry
 def approve_user(username):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("UPDATE users SET approved=1 WHERE username=?", (username,))
-    conn.commit()
-    conn.close()
+    with db_cursor(commit=True) as c:
+        c.execute("UPDATE users SET approved=1 WHERE username=?", (username,))
+    bump_generation("users")
 
+@db_retry
 def get_all_users():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT username, role, approved FROM users")
-    rows = c.fetchall()
-    conn.close()
-    return [{"username": r[0], "role": r[1], "approved": r[2]} for r in rows]
+    """Every account; "registered" is False for rows a bulk import created, which cannot log in."""
+    with db_cursor() as c:
+        c.execute("SELECT username, role, approved, password IS NOT NULL FROM users")
+        rows = c.fetchall()
+    return [{"username": r[0], "role": r[1], "approved": r[2], "registered": bool(r[3])} for r in rows]
 
 # ----------------- PRACTICE -----------------
+@db_retry
 def add_practice_item(category, prompt, reference):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT INTO practice_bank (category, prompt, reference) VALUES (?,?,?)", (category, prompt, reference))
-    conn.commit()
-    pid = c.lastrowid
-    conn.close()
+    with db_cursor(commit=True) as c:
+        c.execute("INSERT INTO practice_bank (category, prompt, reference) VALUES (?,?,?)", (category, prompt, reference))
+        pid = c.lastrowid
+    bump_generation("practice_bank")
     return pid
 
-def assign_practices_to_user(username, practice_ids):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    for pid in practice_ids:
-        c.execute("INSERT INTO practice_assignments (username, practice_id) VALUES (?,?)", (username, pid))
-    conn.commit()
-    conn.close()
-
-def get_user_practice_queue(username):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("""SELECT p.category, p.prompt FROM practice_assignments a
-                 JOIN practice_bank p ON a.practice_id = p.id
-                 WHERE a.username=?""", (username,))
-    rows = c.fetchall()
-    conn.close()
-    return [{"category": r[0], "prompt": r[1]} for r in rows]
+@db_retry
+def get_practice_items(category=None, limit=500):
+    with db_cursor() as c:
+        if category:
+            c.execute("SELECT id, category, prompt FROM practice_bank WHERE category=? ORDER BY id DESC LIMIT ?",
+                      (category, limit))
+        else:
+            c.execute("SELECT id, category, prompt FROM practice_bank ORDER BY id DESC LIMIT ?", (limit,))
+        rows = c.fetchall()
+    return [{"id": r[0], "category": r[1], "prompt": r[2]} for r in rows]
+
+@db_retry
+def get_practice_items_after(after_id=0, limit=5000):
+    """practice_bank rows with id > after_id, oldest first (for incremental index builds)."""
+    with db_cursor() as c:
+        c.execute("SELECT id, category, prompt FROM practice_bank WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit))
+        rows = c.fetchall()
+    return [{"id": r[0], "category": r[1], "prompt": r[2]} for r in rows]
+
+PRACTICE_STATUSES = ("assigned", "completed")
+
+@db_retry
+def assign_practices(practice_ids, usernames=None, role=None, due_date=None):
+    """
+    Assign every item in practice_ids to every user in one INSERT ... SELECT. Users are
+    `usernames`, or every approved user with `role` (e.g. "Student" for the whole class).
+    Pairs that are already assigned, unknown users and unknown practice ids are skipped;
+    returns {"inserted": n, "skipped": m}.
+    """
+    if usernames is None and role is None:
+        raise ValueError("assign_practices needs usernames or role")
+    ids = sorted({int(pid) for pid in practice_ids})
+    with db_cursor(commit=True) as c:
+        if usernames is not None:
+            names = sorted(set(usernames))
+            users_sql = "SELECT username FROM users WHERE username IN (SELECT value FROM json_each(?))"
+            users_params = [json.dumps(names)]
+            n_users = len(names)
+        else:
+            users_sql = "SELECT username FROM users WHERE role=? AND approved=1"
+            users_params = [role]
+            c.execute(f"SELECT COUNT(*) FROM ({users_sql})", users_params)
+            n_users = c.fetchone()[0]
+        c.execute(f"""INSERT OR IGNORE INTO practice_assignments (username, practice_id, due_date)
+                      SELECT u.username, p.id, ? FROM ({users_sql}) u
+                      JOIN practice_bank p ON p.id IN (SELECT value FROM json_each(?))""",
+                  [str(due_date) if due_date else None] + users_params + [json.dumps(ids)])
+        inserted = c.rowcount
+    if inserted:
+        for name in (names if usernames is not None else [None]):
+            bump_generation("practice", name)
+    return {"inserted": inserted, "skipped": n_users * len(ids) - inserted}
+
+def assign_practices_to_user(username, practice_ids, due_date=None):
+    return assign_practices(practice_ids, usernames=[username], due_date=due_date)
+
+@db_retry
+def get_user_practice_queue(username, limit=50, after_id=0, status="assigned"):
+    """
+    One page of a user's assignments, oldest first: pass the last row's "id" as after_id
+    for the next page. status=None returns assignments in any status.
+    """
+    clauses, params = ["a.username=?", "a.id>?"], [username, after_id]
+    if status:
+        clauses.append("a.status=?")
+        params.append(status)
+    with db_cursor() as c:
+        c.execute(f"""SELECT a.id, p.category, p.prompt, a.status, a.due_date FROM practice_assignments a
+                      JOIN practice_bank p ON a.practice_id = p.id
+                      WHERE {' AND '.join(clauses)} ORDER BY a.id LIMIT ?""", params + [limit])
+        rows = c.fetchall()
+    return [{"id": r[0], "category": r[1], "prompt": r[2], "status": r[3], "due_date": r[4]} for r in rows]
+
+@db_retry
+def get_assigned_practice_ids(username, status="assigned"):
+    """Set of practice_bank ids in a user's queue (any status with status=None)."""
+    with db_cursor() as c:
+        if status:
+            c.execute("SELECT practice_id FROM practice_assignments WHERE username=? AND status=?", (username, status))
+        else:
+            c.execute("SELECT practice_id FROM practice_assignments WHERE username=?", (username,))
+        return {r[0] for r in c.fetchall()}
+
+@db_retry
+def set_practice_status(username, assignment_id, status):
+    if status not in PRACTICE_STATUSES:
+        raise ValueError(f"unknown practice status: {status}")
+    with db_cursor(commit=True) as c:
+        c.execute("UPDATE practice_assignments SET status=? WHERE id=? AND username=?",
+                  (status, assignment_id, username))
+        changed = c.rowcount
+    bump_generation("practice", username)
+    return changed
 
 # ----------------- SUBMISSIONS -----------------
+@db_retry
+def add_submission(username, source_text, student_translation, reference, target_lang):
+    """
+    Store a submission and queue its analysis; returns (submission_id, job_id).
+    A worker (analysis_worker.py) writes the report to the cache; poll get_submission_report().
+    """
+    with db_cursor(commit=True) as c:
+        c.execute("""INSERT INTO submissions (username, source_text, student_translation, reference, target_lang)
+                     VALUES (?,?,?,?,?)""", (username, source_text, student_translation, reference, target_lang))
+        sub_id = c.lastrowid
+        c.execute("INSERT INTO analysis_jobs (submission_id) VALUES (?)", (sub_id,))
+        job_id = c.lastrowid
+    bump_generation("submissions", username)
+    return sub_id, job_id
+
+@db_retry
+def add_submissions(rows, checkpoint=None):
+    """
+    Store many submission dicts (username, source_text, student_translation, reference,
+    target_lang, optional created_at) and queue their analysis, in one transaction.
+    checkpoint=(source, fingerprint, rows_done) is saved in the same transaction, so an
+    import resumed from get_import_checkpoint() neither skips nor repeats rows.
+    Usernames without an account get an unapproved Student row with no password (it
+    cannot log in until registered). Returns the number of submissions stored.
+    """
+    usernames = {row["username"] for row in rows}
+    with db_cursor(commit=True) as c:
+        c.executemany("INSERT OR IGNORE INTO users (username, role, approved) VALUES (?, 'Student', 0)",
+                      [(u,) for u in usernames])
+        created = c.rowcount
+        for row in rows:
+            c.execute("""INSERT INTO submissions
+                         (username, source_text, student_translation, reference, target_lang, created_at)
+                         VALUES (?,?,?,?,?,COALESCE(?, CURRENT_TIMESTAMP))""",
+                      (row["username"], row["source_text"], row["student_translation"], row.get("reference"),
+                       row["target_lang"], row.get("created_at") or None))
+            c.execute("INSERT INTO analysis_jobs (submission_id) VALUES (?)", (c.lastrowid,))
+        if checkpoint is not None:
+            c.execute("""INSERT INTO import_checkpoints (source, fingerprint, rows_done) VALUES (?,?,?)
+                         ON CONFLICT(source) DO UPDATE SET fingerprint=excluded.fingerprint,
+                            rows_done=excluded.rows_done, updated_at=CURRENT_TIMESTAMP""", checkpoint)
+    if created:
+        bump_generation("users")
+    for username in usernames:
+        bump_generation("submissions", username)
+    return len(rows)
+
+@db_retry
+def get_import_checkpoint(source):
+    """(fingerprint, rows_done) saved by add_submissions for an import source, or None."""
+    with db_cursor() as c:
+        c.execute("SELECT fingerprint, rows_done FROM import_checkpoints WHERE source=?", (source,))
+        return c.fetchone()
+
+@db_retry
+def clear_import_checkpoint(source):
+    with db_cursor(commit=True) as c:
+        c.execute("DELETE FROM import_checkpoints WHERE source=?", (source,))
+
+@db_retry
+def get_submissions_by_id(submission_ids):
+    """{id: submission dict} for the given ids."""
+    found = {}
+    ids = list(submission_ids)
+    with db_cursor() as c:
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            c.execute(f"""SELECT id, username, source_text, student_translation, reference, target_lang
+                          FROM submissions WHERE id IN ({marks})""", chunk)
+            for r in c.fetchall():
+                found[r[0]] = {"id": r[0], "username": r[1], "source_text": r[2], "student_translation": r[3],
+                               "reference": r[4], "target_lang": r[5]}
+    return found
+
+@db_retry
 def get_all_submissions():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT username, source_text, student_translation, reference, target_lang FROM submissions")
-    rows = c.fetchall()
-    conn.close()
+    with db_cursor() as c:
+        c.execute("SELECT id, username, source_text, student_translation, reference, target_lang FROM submissions")
+        rows = c.fetchall()
     return [
-        {"username": r[0], "source_text": r[1], "student_translation": r[2], "reference": r[3], "target_lang": r[4]}
+        {"id": r[0], "username": r[1], "source_text": r[2], "student_translation": r[3], "reference": r[4],
+         "target_lang": r[5]}
         for r in rows
     ]
 
-def export_submissions_with_errors(filepath="submissions_with_errors.csv"):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT username, source_text, student_translation, reference, target_lang FROM submissions")
-    rows = c.fetchall()
-    conn.close()
-
-    headers = ["username", "source_text", "student_translation", "reference", "target_lang",
-               "semantic_score", "semantic_flag", "idiom_issues", "grammar_issues"]
-
-    idioms_dict = load_idioms_from_file("idioms.json")
-    export_rows = []
-    for r in rows:
-        uname, src, stud_tr, ref, tgt_lang = r
-        rep = classify_translation_issues(src, stud_tr, idioms_dict, lang=tgt_lang)
-        export_rows.append([
-            uname, src, stud_tr, ref, tgt_lang,
+# ----------------- IDIOM DICTIONARY -----------------
+# Idioms live in the idioms table, with one idiom_renderings row per accepted
+# rendering in each target language (the primary one first, then variants).
+# import_idioms() loads JSON or CSV files and bumps data_versions 'idioms' in the
+# same transaction. get_idioms(target_lang) keeps the parsed dictionary per
+# language in this process and only reloads it when that version has changed; the
+# snapshot carries that version, so the compiled matcher (idiom_matcher.get_matcher)
+# is rebuilt once per import, in every process, instead of per submission.
+# An empty table is seeded from IDIOMS_FILE on first use; later edits to that
+# file are loaded with import_idioms (the instructor dashboard or grade_cli --idioms).
+IDIOM_CSV_FIELDS = ("phrase", "target_lang", "rendering", "variants", "category")
+DEFAULT_IDIOM_LANG = "ar"
+_idiom_snapshots = {}   # (DB_FILE, target_lang) -> (version, {phrase: {"expected", "variants"}})
+
+def _bump_data_version(c, name):
+    c.execute("""INSERT INTO data_versions (name, version) VALUES (?, 1)
+                 ON CONFLICT(name) DO UPDATE SET version = version + 1""", (name,))
+
+@db_retry
+def get_data_version(name):
+    """Version counter of a shared data set (e.g. 'idioms'); 0 if it was never written."""
+    with db_cursor() as c:
+        c.execute("SELECT version FROM data_versions WHERE name=?", (name,))
+        row = c.fetchone()
+    return row[0] if row else 0
+
+def _renderings_list(value):
+    if isinstance(value, str):
+        value = [value]
+    out = []
+    for r in value or []:
+        r = r.strip() if isinstance(r, str) else ""
+        if r and r not in out:
+            out.append(r)
+    return out
+
+def parse_idioms(source, fmt=None, target_lang=DEFAULT_IDIOM_LANG):
+    """
+    [{"phrase", "category", "renderings": {lang: [primary, variants...]}}] from an idiom file
+    (path or file object). JSON may be the legacy {phrase: {"arabic": ..., "variants": [...],
+    "category": ...}} or {phrase: rendering} (both read as target_lang), {phrase: {"renderings":
+    {lang: str or [primary, variants...]}, "category": ...}}, or a list of CSV-like records. CSV has
+    columns IDIOM_CSV_FIELDS, variants separated by "|", one row per idiom and language.
+    """
+    name = source if isinstance(source, str) else getattr(source, "name", "") or ""
+    fmt = fmt or ("csv" if name.lower().endswith(".csv") else "json")
+    if isinstance(source, str):
+        with open(source, encoding="utf-8-sig", newline="") as f:
+            return parse_idioms(f, fmt, target_lang)
+    data = source.read()
+    if isinstance(data, bytes):
+        data = data.decode("utf-8-sig")
+    if fmt == "csv":
+        records = list(csv.DictReader(io.StringIO(data, newline="")))
+    else:
+        records = json.loads(data)
+    entries = {}
+    if isinstance(records, dict):
+        for phrase, value in records.items():
+            if isinstance(value, dict):
+                renderings = value.get("renderings")
+                if renderings is None:
+                    primary = value.get("arabic") or value.get("expected")
+                    variants = value.get("variants") or []
+                    renderings = {target_lang: [primary] + ([variants] if isinstance(variants, str) else variants)}
+                category = value.get("category")
+            else:
+                renderings, category = {target_lang: value}, None
+            entry = entries.setdefault(phrase.strip(), {"category": None, "renderings": {}})
+            entry["category"] = category or entry["category"]
+            for lang, value in (renderings or {}).items():
+                entry["renderings"].setdefault(lang, [])
+                entry["renderings"][lang] += [r for r in _renderings_list(value) if r not in entry["renderings"][lang]]
+    elif isinstance(records, list):
+        for rec in records:
+            if not isinstance(rec, dict) or not (rec.get("phrase") or "").strip():
+                continue
+            variants = rec.get("variants") or []
+            if isinstance(variants, str):
+                variants = variants.split("|")
+            entry = entries.setdefault(rec["phrase"].strip(), {"category": None, "renderings": {}})
+            entry["category"] = (rec.get("category") or "").strip() or entry["category"]
+            lang = (rec.get("target_lang") or "").strip() or target_lang
+            have = entry["renderings"].setdefault(lang, [])
+            have += [r for r in _renderings_list([rec.get("rendering") or ""] + list(variants)) if r not in have]
+    else:
+        raise ValueError("idiom JSON must be an object or a list of records")
+    return [{"phrase": phrase, **entry} for phrase, entry in entries.items() if phrase]
+
+def import_idioms(source, fmt=None, target_lang=DEFAULT_IDIOM_LANG):
+    """
+    Load an idiom file (see parse_idioms) into the idioms tables. Each idiom and language
+    in the file replaces that idiom's stored renderings in the language; others are kept.
+    Returns {"idioms": n, "renderings": n, "version": new data version}.
+    """
+    return _store_idioms(parse_idioms(source, fmt, target_lang))
+
+@db_retry
+def _store_idioms(entries, only_if_empty=False):
+    with db_cursor(commit=True) as c:
+        if only_if_empty:
+            c.execute("SELECT 1 FROM data_versions WHERE name='idioms'")
+            if c.fetchone():
+                return None
+        c.executemany("""INSERT INTO idioms (phrase, category) VALUES (?,?)
+                         ON CONFLICT(phrase) DO UPDATE SET category = COALESCE(excluded.category, category)""",
+                      [(e["phrase"], e["category"]) for e in entries])
+        ids = {}
+        phrases = [e["phrase"] for e in entries]
+        for i in range(0, len(phrases), 500):
+            chunk = phrases[i:i + 500]
+            c.execute(f"SELECT phrase, id FROM idioms WHERE phrase IN ({','.join('?' * len(chunk))})", chunk)
+            ids.update(c.fetchall())
+        pairs, rows = [], []
+        for e in entries:
+            for lang, renderings in e["renderings"].items():
+                if renderings:
+                    pairs.append((lang, ids[e["phrase"]]))
+                    rows += [(lang, ids[e["phrase"]], r, int(k == 0)) for k, r in enumerate(renderings)]
+        c.executemany("DELETE FROM idiom_renderings WHERE target_lang=? AND idiom_id=?", pairs)
+        c.executemany("INSERT INTO idiom_renderings (target_lang, idiom_id, rendering, is_primary) VALUES (?,?,?,?)",
+                      rows)
+        _bump_data_version(c, "idioms")
+        c.execute("SELECT version FROM data_versions WHERE name='idioms'")
+        version = c.fetchone()[0]
+    bump_generation("idioms")
+    return {"idioms": len(entries), "renderings": len(rows), "version": version}
+
+def _idioms_version():
+    """data_versions 'idioms', seeding an empty dictionary from IDIOMS_FILE the first time."""
+    version = get_data_version("idioms")
+    if version == 0:
+        try:
+            entries = parse_idioms(IDIOMS_FILE)
+        except (OSError, ValueError):
+            entries = []
+        # checked again inside the write transaction: concurrent first uses seed once
+        _store_idioms(entries, only_if_empty=True)
+        version = get_data_version("idioms")
+    return version
+
+@db_retry
+def _load_idiom_snapshot(target_lang):
+    with db_cursor() as c:
+        c.execute("""SELECT i.phrase, r.rendering FROM idiom_renderings r JOIN idioms i ON i.id = r.idiom_id
+                     WHERE r.target_lang = ? ORDER BY r.idiom_id, r.is_primary DESC, r.rendering""",
+                  (target_lang,))
+        rows = c.fetchall()
+    snapshot = {}
+    for phrase, rendering in rows:
+        entry = snapshot.get(phrase)
+        if entry is None:
+            snapshot[phrase] = {"expected": rendering, "variants": []}
+        else:
+            entry["variants"].append(rendering)
+    return snapshot
+
+def get_idioms(target_lang=DEFAULT_IDIOM_LANG):
+    """
+    {phrase: {"expected": primary rendering, "variants": [...]}} for idioms with a rendering
+    in target_lang, as detect_idiomatic_issues takes it. The same dict object is returned
+    until the dictionary is re-imported, so the compiled matcher stays cached.
+    """
+    version = _idioms_version()
+    key = (DB_FILE, target_lang or "")
+    cached = _idiom_snapshots.get(key)
+    if cached is None or cached[0] != version:
+        with perf.timer("idiom_snapshot_load_seconds"):
+            snapshot = IdiomSnapshot(_load_idiom_snapshot(target_lang or ""), version=key + (version,))
+            cached = _idiom_snapshots[key] = (version, snapshot)
+    return cached[1]
+
+@db_retry
+def count_idioms():
+    """(idioms, renderings) stored in the idiom dictionary."""
+    with db_cursor() as c:
+        c.execute("SELECT (SELECT COUNT(*) FROM idioms), (SELECT COUNT(*) FROM idiom_renderings)")
+        return c.fetchone()
+
+# ----------------- ANALYSIS REPORT CACHE -----------------
+# Reports are keyed by a hash of everything that determines them: the submission
+# text, the target language, the detector versions and configured backends, and
+# the idiom dictionary version. Importing idioms or changing the detector setup
+# therefore changes every key. Rows of other versions are left alone by readers
+# (another process may still be configured differently) and deleted only by
+# purge_stale_reports, e.g. `python analysis_worker.py --purge-stale-reports`.
+def get_report_version():
+    return f"{metrics_utils.detector_version()};idioms=v{_idioms_version()}"
+
+# Sentence-segment reports (see segmenter) share submission_reports under "<version>/segment".
+SEGMENT_VERSION_SUFFIX = "/segment"
+# Reports made while a configured detector was down are "degraded". They are never
+# reused as cache hits, but the worker keeps them under "<version>+degraded", for
+# get_submission_report to serve, and records their issues under that version too,
+# so the dashboard counts them and the backfill retries them only after
+# DEGRADED_RETRY_SECONDS instead of on every idle sweep.
+DEGRADED_VERSION_SUFFIX = "+degraded"
+DEGRADED_RETRY_SECONDS = 600
+
+def report_key(source_text, student_translation, reference, target_lang, version):
+    payload = json.dumps([source_text, student_translation, reference, target_lang, version], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+@db_retry
+def purge_stale_reports(version=None):
+    """Delete cached reports not written under `version` (default: this process's); returns how many."""
+    version = version or get_report_version()
+    with db_cursor(commit=True) as c:
+        c.execute("DELETE FROM submission_reports WHERE version NOT IN (?, ?, ?)",
+                  (version, version + SEGMENT_VERSION_SUFFIX, version + DEGRADED_VERSION_SUFFIX))
+        return c.rowcount
+
+# Reports are stored as report_codec blobs whose strings (idioms, statuses, grammar
+# messages, replacements, bigrams) are ids into report_strings. Each process keeps
+# the table in memory: ids are appended, never changed, so an unknown id only
+# means another process added strings since the last load. The ids are dense
+# (rows are never deleted), and the table is always extended with every row past
+# the last id it holds, so it never has gaps. Rows written before the codec hold
+# JSON text and are still read. Idiom phrases and renderings are interned as text
+# like every other string, independent of idioms.id (see report_codec): a
+# re-import may change the idioms table, never what a stored report says.
+_report_strings_lock = threading.Lock()
+_report_strings = {"db": None, "ids": {}, "texts": [None]}
+
+def _report_string_table():
+    table = _report_strings
+    if table["db"] != DB_FILE:
+        table.update(db=DB_FILE, ids={}, texts=[None])
+    return table
+
+def _add_report_strings(table, rows):
+    texts = table["texts"]
+    for sid, text in rows:
+        if sid >= len(texts):
+            texts.extend([None] * (sid + 1 - len(texts)))
+        texts[sid] = text
+        table["ids"][text] = sid
+
+@db_retry
+def _load_report_strings():
+    with _report_strings_lock:
+        table = _report_string_table()
+        with db_cursor() as c:
+            c.execute("SELECT id, text FROM report_strings WHERE id >= ? ORDER BY id", (len(table["texts"]),))
+            _add_report_strings(table, c.fetchall())
+
+@db_retry
+def _intern_report_strings(strings):
+    """{string: id} for strings, adding the new ones to report_strings."""
+    with _report_strings_lock:
+        table = _report_string_table()
+        missing = [t for t in strings if t not in table["ids"]]
+        if missing:
+            with db_cursor(commit=True) as c:
+                c.executemany("INSERT OR IGNORE INTO report_strings (text) VALUES (?)", [(t,) for t in missing])
+                # Everything past our last id: ours, and those other processes added meanwhile.
+                c.execute("SELECT id, text FROM report_strings WHERE id >= ? ORDER BY id", (len(table["texts"]),))
+                _add_report_strings(table, c.fetchall())
+        return table["ids"]
+
+def encode_reports(reports):
+    """report_codec bytes for each report, interning their strings in one transaction."""
+    reports = [report_codec.Report.from_dict(rep) for rep in reports]
+    strings = set()
+    for rep in reports:
+        strings |= rep.strings()
+    ids = _intern_report_strings(strings)
+    return [report_codec.encode(rep, ids) for rep in reports]
+
+def decode_report(blob):
+    """A stored report: a report_codec.Report for binary rows, a dict for JSON ones."""
+    if not isinstance(blob, bytes):
+        return json.loads(blob)
+    table = _report_string_table()
+    try:
+        return report_codec.decode(blob, table["texts"])
+    except IndexError:
+        _load_report_strings()
+        return report_codec.decode(blob, _report_string_table()["texts"])
+
+@db_retry
+def get_cached_reports(keys, chunk_size=500):
+    """Bulk-read cached reports; returns {report_key: report} for the keys that are present."""
+    rows = []
+    keys = list(keys)
+    with db_cursor() as c:
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            marks = ",".join("?" * len(chunk))
+            c.execute(f"SELECT report_key, report FROM submission_reports WHERE report_key IN ({marks})", chunk)
+            rows += c.fetchall()
+    return {key: decode_report(blob) for key, blob in rows}
+
+def store_reports(version, keyed_reports):
+    # Degraded reports (a detector fell back while down) are served but not cached;
+    # see store_degraded_reports.
+    keyed = [(k, rep) for k, rep in keyed_reports.items() if not rep.get("degraded")]
+    if keyed:
+        blobs = encode_reports([rep for _k, rep in keyed])
+        _store_encoded_reports(version, [(k, blob) for (k, _rep), blob in zip(keyed, blobs)])
+
+def store_degraded_reports(version, pairs):
+    """Keep the degraded reports of (submission, report) pairs under version + DEGRADED_VERSION_SUFFIX."""
+    degraded_version = version + DEGRADED_VERSION_SUFFIX
+    keyed = [(report_key(s["source_text"], s["student_translation"], s.get("reference"), s["target_lang"],
+                         degraded_version), rep) for s, rep in pairs if rep.get("degraded")]
+    if keyed:
+        blobs = encode_reports([rep for _k, rep in keyed])
+        _store_encoded_reports(degraded_version, [(k, blob) for (k, _rep), blob in zip(keyed, blobs)])
+
+@db_retry
+def _store_encoded_reports(version, keyed_blobs):
+    with db_cursor(commit=True) as c:
+        c.executemany("INSERT OR REPLACE INTO submission_reports (report_key, version, report) VALUES (?,?,?)",
+                      [(k, version, blob) for k, blob in keyed_blobs])
+
+def get_reports_for_submissions(submissions, idioms_dict=None):
+    """
+    Reports for a list of submission dicts, in the same order. Cached reports are read
+    in bulk; only cache misses are analyzed, and their reports are stored. Idioms come
+    from get_idioms(target_lang) unless idioms_dict is given.
+    """
+    version = get_report_version()
+    keys = [report_key(s["source_text"], s["student_translation"], s.get("reference"), s["target_lang"], version)
+            for s in submissions]
+    reports = get_cached_reports(set(keys))
+    todo = {}
+    for key, sub in zip(keys, submissions):
+        if key not in reports:
+            todo.setdefault(key, sub)
+    perf.incr("report_cache_hits_total", len(keys) - len(todo))
+    perf.incr("report_cache_misses_total", len(todo))
+    if todo:
+        missing = dict(zip(todo, classify_translation_issues_batch(list(todo.values()), idioms_dict, version)))
+        store_reports(version, missing)
+        reports.update(missing)
+    result = [reports[k] for k in keys]
+    record_submission_issues(version, zip(submissions, result))
+    return result
+
+# ----------------- ISSUE AGGREGATES -----------------
+# Every analyzed submission is broken down into submission_issues rows, and
+# issue_daily_counts (day x issue type x idiom x student x language) is updated
+# in the same transaction. Dashboard and PDF figures are GROUP BY queries over
+# that small aggregate table rather than a pass over all reports. Re-analysis
+# under a new report version first subtracts the submission's old issues.
+ISSUE_TYPES = ("semantic", "idiom", "grammar")
+
+def report_issues(report):
+    """[(issue_type, idiom, severity)] for one report."""
+    issues = []
+    if report.get("semantic_flag"):
+        issues.append(("semantic", "", round(100.0 - (report.get("semantic_score") or 0.0), 2)))
+    for idiom, info in (report.get("idiom_issues") or {}).items():
+        if info["status"].startswith("non-idiomatic"):
+            issues.append(("idiom", idiom, 1.0))
+    for _match in report.get("grammar") or []:
+        issues.append(("grammar", "", 1.0))
+    for _flag in report.get("collocation_flags") or []:
+        issues.append(("collocation", "", 1.0))
+    return issues
+
+def _update_idiom_misses(c, deltas):
+    """Fold [(target_lang, idiom, n)] into idiom_miss_counts, per language and under '*'."""
+    totals = {}
+    for lang, idiom, n in deltas:
+        for key in ((lang, idiom), ("*", idiom)):
+            totals[key] = totals.get(key, 0) + n
+    changed = [key + (n,) for key, n in totals.items() if n]
+    c.executemany("""INSERT INTO idiom_miss_counts (target_lang, idiom, n) VALUES (?,?,?)
+                     ON CONFLICT(target_lang, idiom) DO UPDATE SET n = n + excluded.n""", changed)
+    c.executemany("DELETE FROM idiom_miss_counts WHERE target_lang=? AND idiom=? AND n <= 0",
+                  [key[:2] for key in changed])
+
+_UPSERT_DAILY = """INSERT INTO issue_daily_counts (day, issue_type, idiom, username, target_lang, n)
+                   VALUES (?,?,?,?,?,?)
+                   ON CONFLICT(day, issue_type, idiom, username, target_lang) DO UPDATE SET n = n + excluded.n"""
+
+@db_retry
+def record_submission_issues(version, pairs):
+    """
+    Store issue rows and update daily aggregates for (submission, report) pairs.
+    Submissions already recorded under `version` are skipped, so this is idempotent.
+    Degraded reports are recorded under version + DEGRADED_VERSION_SUFFIX.
+    Returns the number of submissions (re)recorded.
+    """
+    pairs = [(sub, rep) for sub, rep in pairs if sub.get("id") is not None]
+    if not pairs:
+        return 0
+    versions = {sub["id"]: version + DEGRADED_VERSION_SUFFIX if rep.get("degraded") else version
+                for sub, rep in pairs}
+    with db_cursor(commit=True) as c:
+        info = {}
+        ids = list({sub["id"] for sub, _rep in pairs})
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            c.execute(f"""SELECT s.id, COALESCE(s.created_at, CURRENT_TIMESTAMP), COALESCE(s.username, ''),
+                                 COALESCE(s.target_lang, ''), a.version
+                          FROM submissions s LEFT JOIN submission_analysis a ON a.submission_id = s.id
+                          WHERE s.id IN ({marks})""", chunk)
+            for sid, created, uname, lang, old_version in c.fetchall():
+                info[sid] = (created, uname, lang, old_version)
+        todo = {}
+        subs = {}
+        for sub, rep in pairs:
+            sid = sub["id"]
+            if sid in info and info[sid][3] != versions[sid]:
+                todo[sid] = rep
+                subs[sid] = sub
+        # degraded again on a retry: restart the backoff, the recorded issues stay
+        c.executemany("UPDATE submission_analysis SET analyzed_at=CURRENT_TIMESTAMP WHERE submission_id=?",
+                      [(sid,) for sid, v in versions.items()
+                       if v != version and sid in info and info[sid][3] == v])
+        if not todo:
+            return 0
+        stale = [sid for sid in todo if info[sid][3] is not None]
+        misses = []
+        for i in range(0, len(stale), 500):
+            chunk = stale[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            c.execute(f"""SELECT date(created_at), issue_type, idiom, username, target_lang, -COUNT(*)
+                          FROM submission_issues WHERE submission_id IN ({marks})
+                          GROUP BY 1, 2, 3, 4, 5""", chunk)
+            removed = c.fetchall()
+            c.executemany(_UPSERT_DAILY, removed)
+            misses += [(lang, idiom, n) for _day, issue_type, idiom, _uname, lang, n in removed if issue_type == "idiom"]
+            c.execute(f"DELETE FROM submission_issues WHERE submission_id IN ({marks})", chunk)
+        rows = []
+        daily = {}
+        for sid, rep in todo.items():
+            created, uname, lang, _old = info[sid]
+            day = created[:10]
+            for issue_type, idiom, severity in report_issues(rep):
+                rows.append((sid, uname, lang, issue_type, idiom, severity, created))
+                key = (day, issue_type, idiom, uname, lang)
+                daily[key] = daily.get(key, 0) + 1
+        c.executemany("""INSERT INTO submission_issues
+                         (submission_id, username, target_lang, issue_type, idiom, severity, created_at)
+                         VALUES (?,?,?,?,?,?,?)""", rows)
+        c.executemany(_UPSERT_DAILY, [key + (n,) for key, n in daily.items()])
+        c.execute("DELETE FROM issue_daily_counts WHERE n <= 0")
+        misses += [(lang, idiom, n) for (_day, issue_type, idiom, _uname, lang), n in daily.items()
+                   if issue_type == "idiom"]
+        _update_idiom_misses(c, misses)
+        _record_submission_metrics(c, [(sid, subs[sid], rep, info[sid][0], info[sid][1])
+                                       for sid, rep in todo.items()])
+        c.executemany("""INSERT INTO submission_analysis (submission_id, version) VALUES (?,?)
+                         ON CONFLICT(submission_id) DO UPDATE SET version=excluded.version,
+                                                                 analyzed_at=CURRENT_TIMESTAMP""",
+                      [(sid, versions[sid]) for sid in todo])
+    for uname in {info[sid][1] for sid in todo}:
+        bump_generation("issues", uname)
+    return len(todo)
+
+# ----------------- STUDENT PROGRESS -----------------
+# record_submission_issues also writes one submission_metrics row per analyzed
+# submission and folds it into two rollups, in the same transaction:
+#   student_metric_weekly  (username, metric, week) -> n, total      weekly means
+#   student_metric_rollup  (username, metric)       -> n, total, least-squares sums
+#                                                      and the last PROGRESS_WINDOW submissions
+# Both are updated by adding the new rows (and subtracting a re-analyzed submission's
+# old row), so the dashboard reads one short primary-key range per student however
+# many submissions they have. Only the last-N window is re-summed on write, from at
+# most PROGRESS_WINDOW rows read through idx_submission_metrics_user.
+PROGRESS_METRICS = ("semantic", "bleu", "chrf", "word_accuracy", "char_accuracy")
+PROGRESS_COUNTS = tuple(f"{t}_issues" for t in ISSUE_TYPES)
+PROGRESS_WINDOW = 10
+_PROGRESS_EPOCH = datetime.datetime(2020, 1, 1)
+_METRIC_COLUMNS = PROGRESS_METRICS + PROGRESS_COUNTS
+
+def _metric_day_and_week(created_at):
+    """(days since _PROGRESS_EPOCH, ISO date of that week's Monday) for a created_at timestamp."""
+    ts = datetime.datetime.fromisoformat(created_at[:19])
+    monday = ts.date() - datetime.timedelta(days=ts.weekday())
+    return (ts - _PROGRESS_EPOCH).total_seconds() / 86400.0, monday.isoformat()
+
+def _submission_metric_rows(items):
+    """submission_metrics rows for [(sid, submission, report, created_at, username)]."""
+    with_ref = [(i, sub) for i, (_sid, sub, _rep, _created, _user) in enumerate(items) if sub.get("reference")]
+    scores = {}
+    if with_ref:
+        import translation_metrics  # numpy; only needed once there is something to score
+        batch = translation_metrics.score_batch([sub.get("student_translation") or "" for _i, sub in with_ref],
+                                                [sub["reference"] for _i, sub in with_ref])
+        for j, (i, _sub) in enumerate(with_ref):
+            scores[i] = (round(float(batch["bleu"][j]), 3), round(float(batch["chrf"][j]), 3),
+                         round(max(0.0, 100.0 - float(batch["ter"][j])), 3),
+                         round(max(0.0, 100.0 - float(batch["char_edit_rate"][j])), 3))
+    rows = []
+    for i, (sid, _sub, rep, created, username) in enumerate(items):
+        counts = dict.fromkeys(ISSUE_TYPES, 0)
+        for issue_type, _idiom, _severity in report_issues(rep):
+            if issue_type in counts:
+                counts[issue_type] += 1
+        semantic = rep.get("semantic_score")
+        rows.append((sid, username, created, None if semantic is None else round(float(semantic), 3),
+                     *scores.get(i, (None, None, None, None)), *(counts[t] for t in ISSUE_TYPES)))
+    return rows
+
+def _metric_deltas(rows, sign, weekly, rollup):
+    """Add sign * each submission_metrics row into the weekly/rollup delta dicts."""
+    for row in rows:
+        username, created = row[1], row[2]
+        x, week = _metric_day_and_week(created)
+        for metric, y in zip(_METRIC_COLUMNS, row[3:]):
+            if y is None:
+                continue
+            w = weekly.setdefault((username, metric, week), [0, 0.0])
+            w[0] += sign
+            w[1] += sign * y
+            r = rollup.setdefault((username, metric), [0, 0.0, 0.0, 0.0, 0.0])
+            r[0] += sign
+            r[1] += sign * y
+            r[2] += sign * x
+            r[3] += sign * x * x
+            r[4] += sign * x * y
+
+def _record_submission_metrics(c, items):
+    """Write submission_metrics for [(sid, submission, report, created_at, username)] and update the rollups."""
+    if not items:
+        return
+    new_rows = _submission_metric_rows(items)
+    ids = [row[0] for row in new_rows]
+    cols = ", ".join(_METRIC_COLUMNS)
+    old_rows = []
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        c.execute(f"SELECT submission_id, username, created_at, {cols} FROM submission_metrics "
+                  f"WHERE submission_id IN ({marks})", chunk)
+        old_rows += c.fetchall()
+    weekly, rollup = {}, {}
+    _metric_deltas(old_rows, -1, weekly, rollup)
+    _metric_deltas(new_rows, 1, weekly, rollup)
+    c.executemany(f"""INSERT OR REPLACE INTO submission_metrics (submission_id, username, created_at, {cols})
+                      VALUES ({",".join("?" * (3 + len(_METRIC_COLUMNS)))})""", new_rows)
+    c.executemany("""INSERT INTO student_metric_weekly (username, metric, week, n, total) VALUES (?,?,?,?,?)
+                     ON CONFLICT(username, metric, week) DO UPDATE SET
+                         n = n + excluded.n, total = total + excluded.total""",
+                  [key + tuple(v) for key, v in weekly.items()])
+    c.execute("DELETE FROM student_metric_weekly WHERE n <= 0")
+    c.executemany("""INSERT INTO student_metric_rollup (username, metric, n, total, sum_x, sum_xx, sum_xy)
+                     VALUES (?,?,?,?,?,?,?)
+                     ON CONFLICT(username, metric) DO UPDATE SET
+                         n = n + excluded.n, total = total + excluded.total, sum_x = sum_x + excluded.sum_x,
+                         sum_xx = sum_xx + excluded.sum_xx, sum_xy = sum_xy + excluded.sum_xy""",
+                  [key + tuple(v) for key, v in rollup.items()])
+    c.execute("DELETE FROM student_metric_rollup WHERE n <= 0")
+    sums = ", ".join(f"COUNT({m}), TOTAL({m})" for m in _METRIC_COLUMNS)
+    for username in {row[1] for row in new_rows + old_rows}:
+        c.execute(f"""SELECT {sums} FROM (SELECT * FROM submission_metrics WHERE username = ?
+                                         ORDER BY created_at DESC, submission_id DESC LIMIT ?)""",
+                  (username, PROGRESS_WINDOW))
+        window = c.fetchone()
+        c.executemany("UPDATE student_metric_rollup SET last_n = ?, last_total = ? WHERE username = ? AND metric = ?",
+                      [(window[2 * i], window[2 * i + 1], username, m) for i, m in enumerate(_METRIC_COLUMNS)])
+
+@db_retry
+def get_student_progress(username):
+    """
+    {metric: {"n", "mean", "last_n", "last_mean", "slope_per_week"}} over a student's analyzed
+    submissions. last_* cover the latest PROGRESS_WINDOW submissions; slope_per_week is the
+    least-squares trend of the metric against submission time (None until it is defined).
+    Metrics are PROGRESS_METRICS (0..100, higher is better) and PROGRESS_COUNTS (issues per submission).
+    """
+    with db_cursor() as c:
+        c.execute("""SELECT metric, n, total, sum_x, sum_xx, sum_xy, last_n, last_total
+                     FROM student_metric_rollup WHERE username = ?""", (username,))
+        rows = c.fetchall()
+    out = {}
+    for metric, n, total, sx, sxx, sxy, last_n, last_total in rows:
+        denom = n * sxx - sx * sx
+        slope = (n * sxy - sx * total) / denom if n > 1 and denom > 1e-9 * n * sxx else None
+        out[metric] = {
+            "n": n,
+            "mean": round(total / n, 3),
+            "last_n": last_n,
+            "last_mean": round(last_total / last_n, 3) if last_n else None,
+            "slope_per_week": round(7.0 * slope, 3) if slope is not None else None,
+        }
+    return out
+
+@db_retry
+def get_student_timeline(username, start=None, end=None):
+    """[(week, {metric: mean})] for a student, oldest week first; week is the ISO date of its Monday."""
+    clauses, params = ["username = ?"], [username]
+    if start:
+        clauses.append("week >= ?")
+        params.append(str(start))
+    if end:
+        clauses.append("week <= ?")
+        params.append(str(end))
+    weeks = {}
+    with db_cursor() as c:
+        c.execute(f"""SELECT week, metric, total / n FROM student_metric_weekly
+                      WHERE {' AND '.join(clauses)}""", params)
+        for week, metric, mean in c.fetchall():
+            weeks.setdefault(week, {})[metric] = round(mean, 3)
+    return sorted(weeks.items())
+
+def _issue_filters(start=None, end=None, username=None, target_lang=None):
+    clauses, params = [], []
+    if start:
+        clauses.append("day >= ?")
+        params.append(str(start))
+    if end:
+        clauses.append("day <= ?")
+        params.append(str(end))
+    if username:
+        clauses.append("username = ?")
+        params.append(username)
+    if target_lang:
+        clauses.append("target_lang = ?")
+        params.append(target_lang)
+    return clauses, params
+
+@db_retry
+def get_error_distribution(start=None, end=None, username=None, target_lang=None):
+    """{issue_type: count} for ISSUE_TYPES, optionally filtered by day range (YYYY-MM-DD), student and language."""
+    clauses, params = _issue_filters(start, end, username, target_lang)
+    marks = ",".join("?" * len(ISSUE_TYPES))
+    where = " AND ".join([f"issue_type IN ({marks})"] + clauses)
+    with db_cursor() as c:
+        c.execute(f"SELECT issue_type, SUM(n) FROM issue_daily_counts WHERE {where} GROUP BY issue_type",
+                  list(ISSUE_TYPES) + params)
+        counts = dict(c.fetchall())
+    return {t: counts.get(t, 0) for t in ISSUE_TYPES}
+
+@db_retry
+def get_top_missed_idioms(limit=5, start=None, end=None, username=None, target_lang=None):
+    """[(idiom, miss_count)] most-missed first, with the same filters as get_error_distribution."""
+    if not (start or end or username):
+        return get_most_missed_idioms(limit, target_lang)
+    clauses, params = _issue_filters(start, end, username, target_lang)
+    where = " AND ".join(["issue_type = 'idiom'"] + clauses)
+    with db_cursor() as c:
+        c.execute(f"""SELECT idiom, SUM(n) AS misses FROM issue_daily_counts WHERE {where}
+                      GROUP BY idiom ORDER BY misses DESC, idiom LIMIT ?""", params + [limit])
+        return c.fetchall()
+
+@db_retry
+def get_most_missed_idioms(limit=5, target_lang=None):
+    """
+    [(idiom, miss_count)] most-missed first over all time, for one language or all of them:
+    the first `limit` entries of idx_idiom_miss_counts_top, with no aggregation.
+    """
+    with db_cursor() as c:
+        c.execute("SELECT idiom, n FROM idiom_miss_counts WHERE target_lang = ? ORDER BY n DESC, idiom LIMIT ?",
+                  (target_lang or "*", limit))
+        return c.fetchall()
+
+@db_retry
+def get_issue_filter_options():
+    """(students, languages) that appear in the issue aggregates, for dashboard filters."""
+    with db_cursor() as c:
+        c.execute("SELECT DISTINCT username FROM issue_daily_counts WHERE username != '' ORDER BY username")
+        students = [r[0] for r in c.fetchall()]
+        c.execute("SELECT DISTINCT target_lang FROM issue_daily_counts WHERE target_lang != '' ORDER BY target_lang")
+        langs = [r[0] for r in c.fetchall()]
+    return students, langs
+
+@db_retry
+def get_error_distribution_by_student(start=None, end=None, target_lang=None):
+    """{username: {issue_type: count}} over ISSUE_TYPES, for per-class report tables."""
+    clauses, params = _issue_filters(start, end, None, target_lang)
+    marks = ",".join("?" * len(ISSUE_TYPES))
+    where = " AND ".join([f"issue_type IN ({marks})", "username > ''"] + clauses)
+    out = {}
+    with db_cursor() as c:
+        c.execute(f"""SELECT username, issue_type, SUM(n) FROM issue_daily_counts WHERE {where}
+                      GROUP BY username, issue_type ORDER BY username""", list(ISSUE_TYPES) + params)
+        for username, issue_type, n in c.fetchall():
+            out.setdefault(username, dict.fromkeys(ISSUE_TYPES, 0))[issue_type] = n
+    return out
+
+@db_retry
+def count_submissions(username=None, start=None, end=None, target_lang=None):
+    clauses, params = [], []
+    if username:
+        clauses.append("username = ?")
+        params.append(username)
+    if start:
+        clauses.append("created_at >= ?")
+        params.append(str(start))
+    if end:
+        clauses.append("created_at < date(?, '+1 day')")
+        params.append(str(end))
+    if target_lang:
+        clauses.append("target_lang = ?")
+        params.append(target_lang)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    with db_cursor() as c:
+        c.execute(f"SELECT COUNT(*) FROM submissions {where}", params)
+        return c.fetchone()[0]
+
+@db_retry
+def enqueue_unanalyzed_submissions(limit=1000):
+    """
+    Queue analysis jobs for submissions with no issue breakdown under the current
+    report version (older rows after an upgrade, or after idioms/detectors changed).
+    Degraded analyses are retried once they are DEGRADED_RETRY_SECONDS old.
+    Returns the number of jobs queued.
+    """
+    version = get_report_version()
+    with db_cursor(commit=True) as c:
+        c.execute("""INSERT INTO analysis_jobs (submission_id)
+                     SELECT s.id FROM submissions s
+                     LEFT JOIN submission_analysis a ON a.submission_id = s.id
+                     WHERE (a.submission_id IS NULL OR a.version != ?)
+                       AND NOT (COALESCE(a.version, '') = ? AND a.analyzed_at > datetime('now', ?))
+                       AND NOT EXISTS (SELECT 1 FROM analysis_jobs j WHERE j.submission_id = s.id
+                                       AND j.status IN ('queued', 'running', 'failed'))
+                     ORDER BY s.id LIMIT ?""",
+                  (version, version + DEGRADED_VERSION_SUFFIX, f"-{int(DEGRADED_RETRY_SECONDS)} seconds", limit))
+        return c.rowcount
+
+@db_retry
+def refresh_query_stats():
+    """Re-ANALYZE the issue aggregates (sampled, so cheap at any size) as the table grows."""
+    with db_cursor(commit=True) as c:
+        c.execute("PRAGMA analysis_limit=1000")
+        c.execute("ANALYZE issue_daily_counts")
+
+# ----------------- ANALYSIS JOBS -----------------
+# Submissions are analyzed off the request path: add_submission() queues a row in
+# analysis_jobs, workers claim batches of queued jobs, and finished reports land in
+# submission_reports. A job whose worker disappears is requeued once its lease
+# expires; after JOB_MAX_ATTEMPTS it is marked failed.
+JOB_LEASE_SECONDS = 300
+JOB_MAX_ATTEMPTS = 3
+
+@db_retry
+def claim_analysis_jobs(worker, limit):
+    """Atomically mark up to `limit` queued jobs as running for `worker`; returns [(job_id, submission_id)]."""
+    with db_cursor(commit=True) as c:
+        c.execute("""UPDATE analysis_jobs
+                     SET status='running', worker=?, attempts=attempts+1, updated_at=CURRENT_TIMESTAMP
+                     WHERE id IN (SELECT id FROM analysis_jobs WHERE status='queued' ORDER BY id LIMIT ?)
+                     RETURNING id, submission_id""", (worker, limit))
+        return sorted(c.fetchall())
+
+@db_retry
+def finish_analysis_jobs(done_ids=(), failed=None):
+    """Mark jobs done, and failed ones ({job_id: error}) queued again or failed after JOB_MAX_ATTEMPTS."""
+    with db_cursor(commit=True) as c:
+        c.executemany("UPDATE analysis_jobs SET status='done', error=NULL, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+                      [(j,) for j in done_ids])
+        c.executemany("""UPDATE analysis_jobs
+                         SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                             error=?, updated_at=CURRENT_TIMESTAMP
+                         WHERE id=?""", [(JOB_MAX_ATTEMPTS, err, j) for j, err in (failed or {}).items()])
+
+@db_retry
+def requeue_stale_jobs(lease_seconds=JOB_LEASE_SECONDS):
+    with db_cursor(commit=True) as c:
+        c.execute("""UPDATE analysis_jobs
+                     SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                         error='lease expired', updated_at=CURRENT_TIMESTAMP
+                     WHERE status='running' AND updated_at < datetime('now', ?)""",
+                  (JOB_MAX_ATTEMPTS, f"-{int(lease_seconds)} seconds"))
+        return c.rowcount
+
+@db_retry
+def requeue_worker_jobs(worker):
+    """Queue again the jobs `worker` left running (e.g. a restarted batch run with a fixed worker id)."""
+    with db_cursor(commit=True) as c:
+        c.execute("""UPDATE analysis_jobs SET status='queued', attempts=MAX(attempts - 1, 0), error='worker restarted',
+                         updated_at=CURRENT_TIMESTAMP
+                     WHERE status='running' AND worker=?""", (worker,))
+        return c.rowcount
+
+@db_retry
+def get_analysis_job(job_id):
+    with db_cursor() as c:
+        c.execute("SELECT id, submission_id, status, attempts, error FROM analysis_jobs WHERE id=?", (job_id,))
+        r = c.fetchone()
+    if r is None:
+        return None
+    return {"id": r[0], "submission_id": r[1], "status": r[2], "attempts": r[3], "error": r[4]}
+
+@db_retry
+def get_job_counts():
+    with db_cursor() as c:
+        c.execute("SELECT status, COUNT(*) FROM analysis_jobs GROUP BY status")
+        return dict(c.fetchall())
+
+@db_retry
+def _latest_job(submission_id):
+    """(status, error) of the submission's newest analysis job, or None if it was never queued."""
+    with db_cursor() as c:
+        c.execute("SELECT status, error FROM analysis_jobs WHERE submission_id=? ORDER BY id DESC LIMIT 1",
+                  (submission_id,))
+        return c.fetchone()
+
+@db_retry
+def requeue_submission(submission_id):
+    """Queue a submission's analysis again unless a job for it is already queued or running."""
+    with db_cursor(commit=True) as c:
+        c.execute("""INSERT INTO analysis_jobs (submission_id)
+                     SELECT ? WHERE NOT EXISTS (SELECT 1 FROM analysis_jobs WHERE submission_id = ?
+                                                AND status IN ('queued', 'running'))""",
+                  (submission_id, submission_id))
+        return c.rowcount
+
+def get_submission_report(submission_id):
+    """
+    {"status", "report", "error"} for a submission: "ready" with its cached report,
+    "failed" with the last error once its analysis gave up (JOB_MAX_ATTEMPTS), else
+    "pending". A report missing from the cache although its job is done (analyzed under
+    an older detector or idiom version, or never queued) is queued again for the workers
+    rather than analyzed in the caller's request.
+    """
+    sub = get_submissions_by_id([submission_id]).get(submission_id)
+    if sub is None:
+        return {"status": "failed", "report": None, "error": "submission not found"}
+    version = get_report_version()
+    key = report_key(sub["source_text"], sub["student_translation"], sub["reference"], sub["target_lang"], version)
+    degraded_key = report_key(sub["source_text"], sub["student_translation"], sub["reference"], sub["target_lang"],
+                              version + DEGRADED_VERSION_SUFFIX)
+    cached = get_cached_reports([key, degraded_key])
+    # a degraded report stands in until the retry after DEGRADED_RETRY_SECONDS replaces it
+    report = cached.get(key, cached.get(degraded_key))
+    if report is not None:
+        return {"status": "ready", "report": report, "error": None}
+    job = _latest_job(submission_id)
+    if job is not None and job[0] == "failed":
+        return {"status": "failed", "report": None, "error": job[1]}
+    if job is None or job[0] == "done":
+        requeue_submission(submission_id)
+    return {"status": "pending", "report": None, "error": None}
+
+EXPORT_HEADERS = ["username", "source_text", "student_translation", "reference", "target_lang",
+                  "semantic_score", "semantic_flag", "idiom_issues", "grammar_issues"]
+
+@db_retry
+def _fetch_submissions_after(last_id, limit):
+    with db_cursor() as c:
+        c.execute("""SELECT id, username, source_text, student_translation, reference, target_lang
+                     FROM submissions WHERE id > ? ORDER BY id LIMIT ?""", (last_id, limit))
+        rows = c.fetchmany(limit)
+    return [{"id": r[0], "username": r[1], "source_text": r[2], "student_translation": r[3], "reference": r[4],
+             "target_lang": r[5]} for r in rows]
+
+def iter_submission_chunks(chunk_size=500):
+    """
+    Yield the submissions table as lists of at most chunk_size dicts, in id order.
+    Each chunk is its own short query (keyset pagination on id), so no connection or
+    read transaction is held while the caller processes a chunk.
+    """
+    last_id = 0
+    while True:
+        chunk = _fetch_submissions_after(last_id, chunk_size)
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]["id"]
+
+def iter_export_rows(chunk_size=500):
+    """Yield lists of EXPORT_HEADERS rows; reports come from the cache, misses are analyzed per chunk."""
+    for chunk in iter_submission_chunks(chunk_size):
+        reports = get_reports_for_submissions(chunk)
+        yield [[
+            sub["username"], sub["source_text"], sub["student_translation"], sub["reference"], sub["target_lang"],
             rep.get("semantic_score"), rep.get("semantic_flag"),
             json.dumps(rep.get("idiom_issues", {}), ensure_ascii=False),
             json.dumps(rep.get("grammar", []), ensure_ascii=False)
-        ])
+        ] for sub, rep in zip(chunk, reports)]
+
+def export_submissions_with_errors(filepath="submissions_with_errors.csv", fileobj=None, fmt=None, chunk_size=500):
+    """
+    Stream all submissions with their analysis to CSV, gzip'd CSV or Parquet.
+    Rows are written chunk by chunk, so memory use does not grow with the table.
+    fmt is "csv", "csv.gz" or "parquet" (default: from filepath's extension). If a
+    binary fileobj is given (e.g. a download buffer) the export is written to it
+    instead of filepath. Returns filepath, or fileobj.
+    """
+    if fmt is None:
+        fmt = "parquet" if filepath.endswith(".parquet") else "csv.gz" if filepath.endswith(".gz") else "csv"
+    if fmt == "parquet":
+        _export_parquet(fileobj if fileobj is not None else filepath, chunk_size)
+        return fileobj if fileobj is not None else filepath
 
-    with open(filepath, "w", newline="", encoding="utf-8") as f:
+    raw = fileobj if fileobj is not None else open(filepath, "wb")
+    try:
+        binary = gzip.GzipFile(fileobj=raw, mode="wb") if fmt == "csv.gz" else raw
+        f = io.TextIOWrapper(binary, encoding="utf-8", newline="")
         writer = csv.writer(f)
-        writer.writerow(headers)
-        writer.writerows(export_rows)
-
-    return filepath
-
-def export_instructor_report_pdf(filepath="instructor_report.pdf"):
-    submissions = get_all_submissions()
-    idioms_dict = load_idioms_from_file("idioms.json")
-
-    error_counts = {"semantic": 0, "idiom": 0, "grammar": 0}
-    idiom_misses = {}
-
-    for sub in submissions:
-        rep = classify_translation_issues(sub["source_text"], sub["student_translation"], idioms_dict, lang=sub["target_lang"])
-        if rep.get("semantic_flag"):
-            error_counts["semantic"] += 1
-        for idiom, info in rep.get("idiom_issues", {}).items():
-            if info["status"] == "non-idiomatic":
-                error_counts["idiom"] += 1
-                idiom_misses[idiom] = idiom_misses.get(idiom, 0) + 1
-        if rep.get("grammar"):
-            error_counts["grammar"] += len(rep["grammar"])
-
-    doc = SimpleDocTemplate(filepath, pagesize=A4)
-    styles = getSampleStyleSheet()
-    elements = []
-    elements.append(Paragraph("Instructor Report", styles["Title"]))
-    elements.append(Spacer(1, 12))
-
-    elements.append(Paragraph("Error Distribution:", styles["Heading2"]))
-    data = [["Error Type", "Count"]] + [[k, v] for k, v in error_counts.items()]
-    table = Table(data)
-    table.setStyle(TableStyle([("BACKGROUND", (0, 0), (-1, 0), colors.grey),
-                               ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-                               ("GRID", (0, 0), (-1, -1), 1, colors.black)]))
-    elements.append(table)
-    elements.append(Spacer(1, 12))
-
-    if idiom_misses:
-        elements.append(Paragraph("Most Frequently Mistranslated Idioms:", styles["Heading2"]))
-        idiom_data = [["Idiom", "Miss Count"]] + sorted(idiom_misses.items(), key=lambda x: -x[1])[:5]
-        idiom_table = Table(idiom_data)
-        idiom_table.setStyle(TableStyle([("GRID", (0, 0), (-1, -1), 1, colors.black)]))
-        elements.append(idiom_table)
-        elements.append(Spacer(1, 12))
-
-    plt.bar(error_counts.keys(), error_counts.values())
-    plt.title("Error Distribution")
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png")
-    plt.close()
-    buf.seek(0)
-    elements.append(Image(buf, width=400, height=200))
-
-    doc.build(elements)
-    return filepath
+        writer.writerow(EXPORT_HEADERS)
+        for rows in iter_export_rows(chunk_size):
+            writer.writerows(rows)
+        f.flush()
+        f.detach()  # leave the underlying stream open for the caller
+        if binary is not raw:
+            binary.close()
+    finally:
+        if fileobj is None:
+            raw.close()
+    return fileobj if fileobj is not None else filepath
+
+def _export_parquet(target, chunk_size):
+    # optional dependency: only needed for Parquet exports
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([
+        ("username", pa.string()), ("source_text", pa.string()), ("student_translation", pa.string()),
+        ("reference", pa.string()), ("target_lang", pa.string()), ("semantic_score", pa.float64()),
+        ("semantic_flag", pa.bool_()), ("idiom_issues", pa.string()), ("grammar_issues", pa.string()),
+    ])
+    with pq.ParquetWriter(target, schema, compression="zstd") as writer:
+        for rows in iter_export_rows(chunk_size):
+            columns = list(zip(*rows))
+            writer.write_table(pa.table([pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+                                        schema=schema))
+
+def export_instructor_report_pdf(filepath="instructor_report.pdf", username=None, start=None, end=None,
+                                 target_lang=None):
+    """Class report (or one student's with username) built from the issue aggregates; see report_builder."""
+    import report_builder  # imports reportlab; only needed when a PDF is requested
+    return report_builder.build_report(filepath, username=username, start=start, end=end, target_lang=target_lang)
 
 # ----------------- TUTOR UTILS -----------------
-# Add your previous tutor_utils functions here
-# Example placeholders:
+# The detectors live in metrics_utils (formerly tutor_utils); these wrappers keep
+# the report shape the dashboards and exports use ("grammar" list).
 def load_idioms_from_file(filepath):
-    with open(filepath, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return metrics_utils.load_idioms_from_file(filepath)
+
+def classify_translation_issues(source, student, idioms_dict=None, lang="en", reference=None):
+    return classify_translation_issues_batch([{"source_text": source, "student_translation": student,
+                                               "reference": reference, "target_lang": lang}], idioms_dict)[0]
 
-def classify_translation_issues(source, student, idioms_dict, lang="en"):
-    # Placeholder for your logic
-    return {"semantic_score": 1.0, "semantic_flag": False, "idiom_issues": {}, "grammar": []}
+def classify_translation_issues_batch(submissions, idioms_dict=None, version=None):
+    """
+    classify_translation_issues for many submission dicts. Texts are analyzed sentence by
+    sentence, with per-segment reports cached, so an edit only re-analyzes what changed; see segmenter.
+    With idioms_dict=None each submission uses get_idioms(its target_lang).
+    """
+    import segmenter
+    reps = segmenter.analyze(submissions, idioms_dict, version)
+    for rep in reps:
+        rep["grammar"] = rep.pop("grammar_matches", [])
+    return reps
 
 def highlight_errors(student_text, report):
     return student_text  # Placeholder
 
-def suggest_activities(report):
-    return []  # Placeholder
+def suggest_activities(report, username=None, k=3):
+    """Suggestions for a report, each with the k closest existing practice items; see recommender."""
+    import recommender  # imports numpy; only needed once a report is shown
+    return recommender.recommend(report, username=username, k=k)
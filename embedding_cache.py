@@ -0,0 +1,207 @@
+# embedding_cache.py
+"""
+Embedding store for the sentence-transformer model, keyed by (model name, text hash).
+
+Two tiers:
+  * an in-process LRU of float32 vectors bounded by a memory budget;
+  * an on-disk float16 matrix (<cache_dir>/<model>.f16, one row per text) with a small
+    SQLite index mapping text hashes to rows. The matrix is memory-mapped read-only,
+    so every Streamlit worker process on the host shares the same pages.
+
+Writers append rows under an IMMEDIATE transaction on the index database, which
+serializes appends across processes. Fresh embeddings are rounded through float16
+before they are returned, so a score never depends on whether the vector came
+from the model or from the cache.
+"""
+import os
+import re
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", ".embedding_cache")
+EMBEDDING_CACHE_MB = float(os.environ.get("EMBEDDING_CACHE_MB", "64"))
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    def __init__(self, model_name, cache_dir=None, memory_budget_mb=None):
+        self.model_name = model_name
+        self.cache_dir = cache_dir or EMBEDDING_CACHE_DIR
+        budget = EMBEDDING_CACHE_MB if memory_budget_mb is None else memory_budget_mb
+        self.memory_budget = int(budget * 1024 * 1024)
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        self.matrix_path = os.path.join(self.cache_dir, f"{safe}.f16")
+        self.index_path = os.path.join(self.cache_dir, f"{safe}.idx.db")
+        self.dim = None
+        self._lru = OrderedDict()
+        self._lru_bytes = 0
+        self._mmap = None
+        self._lock = threading.RLock()
+        self._index = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---------- public API ----------
+    def encode(self, texts, encoder):
+        """
+        Embeddings for texts as a float32 (len(texts), dim) array.
+        encoder(list_of_texts) -> array is only called for texts found in neither tier.
+        """
+        texts = list(texts)
+        hashes = [text_hash(t) for t in texts]
+        with self._lock:
+            found = {}
+            for h in dict.fromkeys(hashes):
+                vec = self._lru.get(h)
+                if vec is not None:
+                    self._lru.move_to_end(h)
+                    found[h] = vec
+                    self.hits += 1
+            lookup = [h for h in dict.fromkeys(hashes) if h not in found]
+            try:
+                stored = self._read_disk(lookup)
+            except (OSError, sqlite3.Error):
+                stored = {}  # unusable cache directory: encode instead
+            for h, vec in stored.items():
+                found[h] = vec
+                self._remember(h, vec)
+                self.disk_hits += 1
+            todo = {}
+            for h, t in zip(hashes, texts):
+                if h not in found:
+                    todo.setdefault(h, t)
+        if todo:
+            fresh = np.asarray(encoder(list(todo.values())), dtype=np.float32)
+            fresh = fresh.astype(np.float16).astype(np.float32)
+            with self._lock:
+                self.misses += len(todo)
+                try:
+                    self._write_disk(list(todo), fresh)
+                except (OSError, sqlite3.Error):
+                    pass  # read-only or full disk: keep serving from memory
+                for h, vec in zip(todo, fresh):
+                    found[h] = vec
+                    self._remember(h, vec)
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return np.stack([found[h] for h in hashes])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "model": self.model_name,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "lru_entries": len(self._lru),
+                "lru_bytes": self._lru_bytes,
+                "disk_rows": self._disk_rows(),
+            }
+
+    def clear_memory(self):
+        with self._lock:
+            self._lru.clear()
+            self._lru_bytes = 0
+
+    # ---------- LRU tier ----------
+    def _remember(self, h, vec):
+        if h in self._lru:
+            self._lru.move_to_end(h)
+            return
+        self._lru[h] = vec
+        self._lru_bytes += vec.nbytes
+        while self._lru_bytes > self.memory_budget and len(self._lru) > 1:
+            _old, old_vec = self._lru.popitem(last=False)
+            self._lru_bytes -= old_vec.nbytes
+            self.evictions += 1
+
+    # ---------- disk tier ----------
+    def _conn(self):
+        if self._index is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            conn = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS rows (text_hash TEXT PRIMARY KEY, row INTEGER) WITHOUT ROWID")
+            conn.commit()
+            self._index = conn
+            self._load_dim()
+        return self._index
+
+    def _load_dim(self):
+        row = self._index.execute("SELECT value FROM meta WHERE key='dim'").fetchone()
+        if row:
+            self.dim = int(row[0])
+
+    def _disk_rows(self):
+        if not self.dim or not os.path.exists(self.matrix_path):
+            return 0
+        return os.path.getsize(self.matrix_path) // (self.dim * 2)
+
+    def _matrix(self, needed_rows):
+        """Read-only memmap of the matrix, re-mapped when other processes have appended."""
+        if self._mmap is None or self._mmap.shape[0] < needed_rows:
+            rows = self._disk_rows()
+            self._mmap = np.memmap(self.matrix_path, dtype=np.float16, mode="r",
+                                   shape=(rows, self.dim)) if rows else None
+        return self._mmap
+
+    def _read_disk(self, hashes, chunk_size=500):
+        if not hashes:
+            return {}
+        conn = self._conn()
+        located = {}
+        for i in range(0, len(hashes), chunk_size):
+            chunk = hashes[i:i + chunk_size]
+            marks = ",".join("?" * len(chunk))
+            located.update(conn.execute(f"SELECT text_hash, row FROM rows WHERE text_hash IN ({marks})", chunk))
+        if not located:
+            return {}
+        if self.dim is None:
+            self._load_dim()
+        matrix = self._matrix(max(located.values()) + 1)
+        if matrix is None:
+            return {}
+        return {h: np.array(matrix[row], dtype=np.float32) for h, row in located.items() if row < matrix.shape[0]}
+
+    def _write_disk(self, hashes, vectors):
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._load_dim()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('dim', ?)", (str(self.dim),))
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"embedding dim {vectors.shape[1]} != cached dim {self.dim} for {self.model_name}")
+            # Another process may have stored some of these while we were encoding.
+            present = set()
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                present.update(h for (h,) in conn.execute(
+                    f"SELECT text_hash FROM rows WHERE text_hash IN ({marks})", chunk))
+            keep = [k for k, h in enumerate(hashes) if h not in present]
+            if keep:
+                start = self._disk_rows()
+                with open(self.matrix_path, "ab") as f:
+                    f.truncate(start * self.dim * 2)  # drop a partial row left by a crashed writer
+                    f.write(np.ascontiguousarray(vectors[keep], dtype=np.float16).tobytes())
+                conn.executemany("INSERT INTO rows (text_hash, row) VALUES (?,?)",
+                                 [(hashes[k], start + n) for n, k in enumerate(keep)])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
@@ -0,0 +1,226 @@
+# grade_cli.py
+"""
+Headless bulk grading: import submissions from CSV or JSONL files and analyze them
+without the Streamlit app.
+
+    python grade_cli.py last_term.csv [more.jsonl ...] [--db app.db] [--workers 4]
+                        [--chunk-size 1000] [--batch-size 16] [--import-only | --analyze-only]
+    python grade_cli.py --add-instructor prof [--db app.db]
+
+Input rows need username, source_text, student_translation and target_lang; reference
+and created_at (so progress charts land in the right weeks) are optional, and other
+columns (e.g. those of the app's CSV export) are ignored. Files are read as a stream
+(.gz is decompressed on the fly) and stored CHUNK_SIZE rows per transaction, each
+with its analysis job and the file's checkpoint. An interrupted import re-run with
+the same arguments skips the rows already stored; a file whose beginning changed is
+refused unless --restart is given. Skipped rows are still read and parsed (the
+CSV reader reports no byte offsets to seek back to), which costs about a fifth of
+importing them. The checkpoint is removed once a file is fully imported, so
+importing it again later adds its rows again.
+
+Analysis then drains the queue through analysis_worker.AnalysisWorker: one process
+per core, each loading the detectors once at start, with reports, issue aggregates
+and progress metrics written back by this process. The worker id is fixed per host,
+so jobs an interrupted run left running are queued again on the next one instead of
+waiting for their lease to expire.
+
+--add-instructor creates (or resets) an approved instructor account, prompting for
+its password. The web app only takes registrations awaiting approval, so this is how
+a new database gets the instructor who approves everyone else.
+"""
+import os
+import io
+import csv
+import sys
+import json
+import gzip
+import socket
+import hashlib
+import getpass
+import argparse
+import itertools
+import time
+
+import analysis_worker
+import db_utils
+
+CHUNK_SIZE = 1000
+REQUIRED_FIELDS = ("username", "source_text", "student_translation", "target_lang")
+OPTIONAL_FIELDS = ("reference", "created_at")
+FINGERPRINT_BYTES = 64 * 1024
+PROGRESS_INTERVAL = 2.0   # seconds between progress lines
+
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8-sig", newline="")
+    return open(path, encoding="utf-8-sig", newline="")
+
+
+def file_fingerprint(path):
+    """Hash of the file's first FINGERPRINT_BYTES: appending rows keeps it, rewriting the file does not."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read(FINGERPRINT_BYTES)).hexdigest()[:16]
+
+
+def iter_records(path, fmt=None):
+    """(line number, dict) for every record of a CSV or JSONL file, read lazily."""
+    fmt = fmt or ("jsonl" if path.removesuffix(".gz").endswith((".jsonl", ".ndjson")) else "csv")
+    with _open_text(path) as f:
+        if fmt == "csv":
+            csv.field_size_limit(max(csv.field_size_limit(), 1 << 24))   # long translations
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        record = None
+                    yield line_no, record if isinstance(record, dict) else None
+
+
+def normalize(record):
+    """A submission dict for add_submissions, or None when a required field is missing."""
+    if not record:
+        return None
+    row = {}
+    for field in REQUIRED_FIELDS + OPTIONAL_FIELDS:
+        value = record.get(field)
+        row[field] = value.strip() if isinstance(value, str) else value
+    if not all(row[field] for field in REQUIRED_FIELDS):
+        return None
+    row["reference"] = row["reference"] or None
+    return row
+
+
+def import_file(path, chunk_size=CHUNK_SIZE, fmt=None, restart=False, out=sys.stdout):
+    """Stream one file into submissions; returns (stored, skipped) for this run."""
+    source = os.path.abspath(path)
+    fingerprint = file_fingerprint(path)
+    saved = db_utils.get_import_checkpoint(source)
+    done = 0
+    if saved is not None and not restart:
+        if saved[0] != fingerprint:
+            raise SystemExit(f"{path}: changed since its last import (checkpoint at row {saved[1]}); "
+                             f"use --restart to import it from the start")
+        done = saved[1]
+        print(f"{path}: resuming after row {done}", file=out)
+    # Parses the rows it skips; see the module docstring.
+    records = itertools.islice(iter_records(path, fmt), done, None)
+    stored = skipped = 0
+    t0 = last = time.perf_counter()
+    while True:
+        batch = list(itertools.islice(records, chunk_size))
+        if not batch:
+            break
+        rows = []
+        for line_no, record in batch:
+            row = normalize(record)
+            if row is None:
+                skipped += 1
+                if skipped <= 10:
+                    print(f"{path}:{line_no}: skipped (missing {', '.join(REQUIRED_FIELDS)} or not a record)",
+                          file=sys.stderr)
+            else:
+                rows.append(row)
+        done += len(batch)
+        stored += db_utils.add_submissions(rows, checkpoint=(source, fingerprint, done))
+        now = time.perf_counter()
+        if now - last >= PROGRESS_INTERVAL:
+            last = now
+            print(f"{path}: {done} rows read, {stored} stored ({stored / (now - t0):.0f}/s)", file=out)
+    db_utils.clear_import_checkpoint(source)
+    elapsed = time.perf_counter() - t0
+    print(f"{path}: {stored} stored, {skipped} skipped in {elapsed:.1f} s "
+          f"({stored / elapsed if elapsed else 0:.0f}/s)", file=out)
+    return stored, skipped
+
+
+def add_instructor(username, out=sys.stdout):
+    """Create or reset an approved instructor account, reading its password from the terminal."""
+    password = getpass.getpass(f"password for {username}: ")
+    if not password or password != getpass.getpass("again: "):
+        raise SystemExit("passwords are empty or do not match")
+    db_utils.register_user(username, password, "Instructor", approved=1)
+    print(f"{username}: approved instructor", file=out)
+
+
+def analyze(workers, batch_size, out=sys.stdout):
+    """Analyze every queued submission; returns the worker (processed / failed counts)."""
+    worker_id = f"grade-cli:{socket.gethostname()}"
+    requeued = db_utils.requeue_worker_jobs(worker_id)
+    if requeued:
+        print(f"requeued {requeued} jobs left running by an interrupted run", file=out)
+    total = db_utils.get_job_counts().get("queued", 0)
+    where = f"with {workers} worker process(es)" if workers else "in this process"
+    print(f"analyzing {total} queued submissions {where}", file=out)
+    worker = analysis_worker.AnalysisWorker(workers, batch_size, worker_id=worker_id, warm_up=True)
+    t0 = time.perf_counter()
+    state = {"last": t0}
+
+    def progress(w):
+        now = time.perf_counter()
+        if now - state["last"] < PROGRESS_INTERVAL:
+            return
+        state["last"] = now
+        rate = w.processed / (now - t0)
+        left = max(0, total - w.processed - w.failed)
+        eta = f", ~{left / rate / 60:.0f} min left" if rate and left else ""
+        print(f"{w.processed}/{total} analyzed, {w.failed} failed ({rate:.1f}/s{eta})", file=out)
+
+    try:
+        worker.run(once=True, progress=progress)
+    except KeyboardInterrupt:
+        print("interrupted; rerun to continue", file=out)
+    elapsed = time.perf_counter() - t0
+    print(f"{worker.processed} analyzed, {worker.failed} failed in {elapsed:.1f} s "
+          f"({worker.processed / elapsed if elapsed else 0:.1f}/s)", file=out)
+    return worker
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import and grade submissions without the web app.")
+    parser.add_argument("files", nargs="*", help="CSV or JSONL files (optionally .gz)")
+    parser.add_argument("--db", default=db_utils.DB_FILE, help="SQLite database file")
+    parser.add_argument("--idioms", help="idiom file (JSON or CSV) to import into the idiom dictionary first")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="input format (default: from the file name)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per import transaction")
+    parser.add_argument("--workers", type=int, default=analysis_worker.ANALYSIS_WORKERS,
+                        help="analysis processes (0 = analyze in this process)")
+    parser.add_argument("--batch-size", type=int, default=16, help="submissions per worker task")
+    parser.add_argument("--restart", action="store_true", help="ignore saved checkpoints and import from the start")
+    parser.add_argument("--add-instructor", metavar="USER", help="create an approved instructor account first")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--import-only", action="store_true", help="store and queue, but do not analyze")
+    mode.add_argument("--analyze-only", action="store_true", help="only analyze what is already queued")
+    args = parser.parse_args(argv)
+    if not args.files and not args.analyze_only and not args.add_instructor:
+        parser.error("give input files, or --analyze-only")
+
+    db_utils.DB_FILE = args.db
+    db_utils.init_db()
+    if args.add_instructor:
+        add_instructor(args.add_instructor.strip())
+        if not args.files and not args.analyze_only:
+            return 0
+    if args.idioms:
+        counts = db_utils.import_idioms(args.idioms)
+        print(f"{args.idioms}: {counts['idioms']} idioms, {counts['renderings']} renderings imported")
+    if not args.analyze_only:
+        for path in args.files:
+            try:
+                import_file(path, max(1, args.chunk_size), args.format, args.restart)
+            except KeyboardInterrupt:
+                print(f"{path}: interrupted; rerun to resume from the last stored chunk")
+                return 130
+    if args.import_only:
+        return 0
+    worker = analyze(max(0, args.workers), max(1, args.batch_size))
+    return 1 if worker.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,444 @@
+# grammar_service.py
+"""
+Grammar checking through a pool of LanguageTool HTTP servers.
+
+detect_fluency_grammar() used to call one in-process en-US LanguageTool object,
+one text at a time. GrammarService instead:
+
+  * keeps a list of servers per language code. These are either servers started
+    locally through language_tool_python (LANGUAGETOOL_SERVERS_PER_LANG per
+    language, launched on first use) or already-running servers given in
+    LANGUAGETOOL_URL, which serve every language. server_urls() hands the running
+    ones to other processes: analysis_worker starts them once in the parent and
+    its pool processes connect to them instead of each launching a JVM;
+  * packs many texts into one /v2/check request, separated by blank lines, and
+    maps each match back to its text by offset;
+  * sends the requests for a batch concurrently, spread over the servers, each
+    with a timeout;
+  * trips a per-server circuit breaker after repeated failures. Texts that no
+    healthy server could check come back as None, and the caller falls back to
+    its heuristics;
+  * caches results per (text, language) in a bounded LRU.
+
+StandInServer is a dependency-free stand-in that speaks the same protocol with
+a few toy rules, for tests and benchmarks:
+
+    python grammar_service.py serve --port 8081
+    LANGUAGETOOL_URL=http://127.0.0.1:8081 streamlit run main_app.py
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LANGUAGETOOL_URL = os.environ.get("LANGUAGETOOL_URL", "")
+LANGUAGETOOL_SERVERS_PER_LANG = int(os.environ.get("LANGUAGETOOL_SERVERS_PER_LANG", "1"))
+GRAMMAR_TIMEOUT = float(os.environ.get("GRAMMAR_TIMEOUT", "10"))
+GRAMMAR_CACHE_SIZE = int(os.environ.get("GRAMMAR_CACHE_SIZE", "20000"))
+GRAMMAR_BATCH_CHARS = 20000      # characters of text per /v2/check request
+BREAKER_FAILURES = 3             # consecutive failures that open a server's breaker
+BREAKER_RESET_SECONDS = 30.0     # then one trial request is let through
+MAX_MATCHES = 10
+
+# Our short codes -> LanguageTool language codes
+LANGUAGE_CODES = {"en": "en-US", "ar": "ar"}
+_SEPARATOR = "\n\n"
+
+
+def language_code(lang):
+    lang = (lang or "en").strip()
+    if "-" in lang:
+        return lang
+    return LANGUAGE_CODES.get(lang.lower(), lang)
+
+
+def _utf16_len(text):
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _utf16_to_index(text, offset):
+    """Python string index of a UTF-16 offset (LanguageTool counts Java chars)."""
+    if offset <= 0 or len(text) == _utf16_len(text):
+        return offset
+    units = 0
+    for i, ch in enumerate(text):
+        if units >= offset:
+            return i
+        units += 2 if ord(ch) > 0xFFFF else 1
+    return len(text)
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive errors -> half-open after `reset_after` seconds."""
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_after=BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._errors = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self._opened_at >= self.reset_after else "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_after and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._errors = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._errors += 1
+            self._trial = False
+            if self._errors >= self.failures:
+                self._opened_at = time.monotonic()
+
+
+class LanguageToolServer:
+    def __init__(self, url, process=None):
+        self.url = url.rstrip("/")
+        if not self.url.endswith("/v2"):
+            self.url += "/v2"
+        self.process = process     # language_tool_python object owning a local server, if any
+        self.breaker = CircuitBreaker()
+        self.requests = 0
+        self.errors = 0
+
+    def check(self, text, lang, timeout=GRAMMAR_TIMEOUT):
+        """Raw LanguageTool matches for text."""
+        body = urllib.parse.urlencode({"text": text, "language": lang}).encode("utf-8")
+        req = urllib.request.Request(self.url + "/check", data=body,
+                                     headers={"Content-Type": "application/x-www-form-urlencoded"})
+        self.requests += 1
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read().decode("utf-8")).get("matches", [])
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.close()
+            except Exception:
+                pass
+            self.process = None
+
+
+def _launch_local_server(lang):
+    import language_tool_python
+    tool = language_tool_python.LanguageTool(lang)
+    return LanguageToolServer(tool._url, process=tool)
+
+
+class GrammarService:
+    def __init__(self, urls=None, servers_per_lang=LANGUAGETOOL_SERVERS_PER_LANG, timeout=GRAMMAR_TIMEOUT,
+                 cache_size=GRAMMAR_CACHE_SIZE, batch_chars=GRAMMAR_BATCH_CHARS, launcher=_launch_local_server):
+        self.shared = [LanguageToolServer(u) for u in (urls or [])]
+        self.servers_per_lang = max(1, servers_per_lang)
+        self.timeout = timeout
+        self.batch_chars = batch_chars
+        self.cache_size = cache_size
+        self._launcher = launcher
+        self._local = {}            # lang -> [LanguageToolServer]
+        self._launch_errors = {}
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._next = 0
+        self._pool = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.shared) or 2 * self.servers_per_lang),
+                                        thread_name_prefix="grammar")
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def from_env(cls):
+        urls = [u.strip() for u in LANGUAGETOOL_URL.split(",") if u.strip()]
+        return cls(urls=urls)
+
+    # ---------- servers ----------
+    def servers(self, lang):
+        if self.shared:
+            return self.shared
+        with self._lock:
+            if lang not in self._local and lang not in self._launch_errors:
+                started = []
+                try:
+                    for _ in range(self.servers_per_lang):
+                        started.append(self._launcher(lang))
+                except Exception as e:
+                    self._launch_errors[lang] = f"{type(e).__name__}: {e}"
+                self._local[lang] = started
+            return self._local.get(lang, [])
+
+    def server_urls(self):
+        """URLs of the servers in use (shared, or the local ones started so far); each serves every language."""
+        servers = self.shared or [s for group in self._local.values() for s in group]
+        return [s.url for s in servers]
+
+    def unavailable(self, lang):
+        """True if no server could be started for lang (as opposed to servers failing at runtime)."""
+        if self.shared:
+            return False
+        code = language_code(lang)
+        return not self.servers(code) and code in self._launch_errors
+
+    def warm_up(self, langs=("en",)):
+        for lang in langs:
+            self.servers(language_code(lang))
+        return self
+
+    def status(self):
+        servers = list(self.shared) + [s for group in self._local.values() for s in group]
+        return {
+            "servers": [{"url": s.url, "breaker": s.breaker.state, "requests": s.requests, "errors": s.errors}
+                        for s in servers],
+            "launch_errors": dict(self._launch_errors),
+            "cache_entries": len(self._cache), "hits": self.hits, "misses": self.misses,
+            "fallbacks": self.fallbacks,
+        }
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        for group in self._local.values():
+            for s in group:
+                s.close()
+
+    # ---------- checking ----------
+    def check(self, text, lang="en"):
+        return self.check_batch([text], lang)[0]
+
+    def check_batch(self, texts, lang="en"):
+        """
+        Matches ({"message", "replacements", "offset", "length"} dicts) for each text,
+        in order; None for texts no server could check (timeout, errors, open breakers).
+        """
+        code = language_code(lang)
+        texts = [t or "" for t in texts]
+        results = [None] * len(texts)
+        todo = {}
+        with self._lock:
+            for i, t in enumerate(texts):
+                if not t.strip():
+                    results[i] = []
+                    continue
+                hit = self._cache.get((code, t))
+                if hit is not None:
+                    self._cache.move_to_end((code, t))
+                    results[i] = hit
+                    self.hits += 1
+                else:
+                    todo.setdefault(t, []).append(i)
+        if not todo:
+            return results
+        checked = self._check_uncached(list(todo), code)
+        with self._lock:
+            for t, matches in checked.items():
+                if matches is None:
+                    self.fallbacks += 1
+                    continue
+                self.misses += 1
+                self._cache[(code, t)] = matches
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        for t, idxs in todo.items():
+            for i in idxs:
+                results[i] = checked.get(t)
+        return results
+
+    def _batches(self, texts):
+        batch, size = [], 0
+        for t in texts:
+            if batch and size + len(t) > self.batch_chars:
+                yield batch
+                batch, size = [], 0
+            batch.append(t)
+            size += len(t) + len(_SEPARATOR)
+        if batch:
+            yield batch
+
+    def _pick_server(self, servers):
+        with self._lock:
+            for k in range(len(servers)):
+                server = servers[(self._next + k) % len(servers)]
+                if server.breaker.allow():
+                    self._next = (self._next + k + 1) % len(servers)
+                    return server
+        return None
+
+    def _check_uncached(self, texts, code):
+        servers = self.servers(code)
+        out = {}
+        futures = {}
+        for batch in self._batches(texts):
+            server = self._pick_server(servers) if servers else None
+            if server is None:
+                continue
+            futures[self._pool.submit(self._check_packed, server, batch, code)] = (server, batch)
+        done, not_done = wait(futures, timeout=self.timeout + 1.0)
+        for fut in not_done:
+            fut.cancel()
+            futures[fut][0].breaker.failure()
+        for fut in done:
+            server, _batch = futures[fut]
+            try:
+                out.update(fut.result())
+            except Exception:
+                server.errors += 1
+                server.breaker.failure()
+            else:
+                server.breaker.success()
+        return out
+
+    def _check_packed(self, server, batch, code):
+        """Check a batch of texts with one request; {text: [match, ...]}."""
+        packed = _SEPARATOR.join(batch)
+        spans = []
+        start = 0
+        for t in batch:
+            end = start + _utf16_len(t)
+            spans.append((start, end, t))
+            start = end + len(_SEPARATOR)
+        found = {t: [] for t in batch}
+        k = 0
+        for m in sorted(server.check(packed, code, timeout=self.timeout), key=lambda m: m.get("offset", 0)):
+            offset = m.get("offset", 0)
+            while k < len(spans) and offset >= spans[k][1]:
+                k += 1
+            if k == len(spans) or offset < spans[k][0]:
+                continue   # inside a separator
+            seg_start, _seg_end, t = spans[k]
+            matches = found[t]
+            if len(matches) < MAX_MATCHES:
+                # both ends from UTF-16 units to string indexes, so a match spanning emoji keeps its extent
+                start = _utf16_to_index(t, offset - seg_start)
+                end = _utf16_to_index(t, offset - seg_start + m.get("length", 0))
+                matches.append({
+                    "message": m.get("message", ""),
+                    "replacements": [r.get("value", "") for r in (m.get("replacements") or [])[:3]],
+                    "offset": start,
+                    "length": end - start,
+                })
+        return found
+
+
+# ---------- stand-in server ----------
+class StandInServer:
+    """
+    Minimal local /v2/check server with LanguageTool's request and response format,
+    for tests and benchmarks. `delay` (seconds) and `fail` simulate slow or broken servers.
+    """
+    RULES = [
+        (re.compile(r"  +"), "WHITESPACE_RULE", "Possible typo: you repeated a whitespace", " "),
+        (re.compile(r"[!?.]{3,}"), "PUNCTUATION_PARAGRAPH_END", "Excessive punctuation", "."),
+        (re.compile(r"\b(\w+) \1\b", re.IGNORECASE), "WORD_REPEAT_RULE", "Possible typo: you repeated a word", None),
+    ]
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                server.requests += 1
+                length = int(self.headers.get("Content-Length", 0))
+                form = urllib.parse.parse_qs(self.rfile.read(length).decode("utf-8"))
+                if server.delay:
+                    time.sleep(server.delay)
+                if server.fail or not self.path.endswith("/v2/check"):
+                    self.send_error(500 if server.fail else 404)
+                    return
+                text = form.get("text", [""])[0]
+                body = json.dumps({"language": {"code": form.get("language", [""])[0]},
+                                   "matches": server.matches(text)}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def matches(self, text):
+        found = []
+        for pattern, rule, message, replacement in self.RULES:
+            for m in pattern.finditer(text):
+                value = replacement if replacement is not None else m.group(1)
+                found.append({"message": message, "offset": _utf16_len(text[:m.start()]),
+                              "length": _utf16_len(m.group(0)),
+                              "replacements": [{"value": value}], "rule": {"id": rule}})
+        return sorted(found, key=lambda m: m["offset"])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="languagetool-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LanguageTool stand-in server and grammar check client.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("serve", help="run the stand-in /v2/check server")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=8081)
+    c = sub.add_parser("check", help="check texts through GrammarService (LANGUAGETOOL_URL or local servers)")
+    c.add_argument("texts", nargs="+")
+    c.add_argument("--lang", default="en")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "serve":
+        server = StandInServer(args.host, args.port)
+        print(f"stand-in LanguageTool server on {server.url}/v2/check")
+        try:
+            server.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    service = GrammarService.from_env()
+    try:
+        for text, matches in zip(args.texts, service.check_batch(args.texts, args.lang)):
+            print(json.dumps({"text": text, "matches": matches}, ensure_ascii=False))
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
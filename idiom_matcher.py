@@ -0,0 +1,209 @@
+# idiom_matcher.py
+"""
+Compiled multi-pattern idiom matcher for detect_idiomatic_issues.
+
+Two Aho-Corasick automata are built once per idiom dictionary:
+  * source side: the lowercased English idioms, matched on word boundaries;
+  * translation side: the expected renderings and their accepted variants
+    (lowercased, Arabic-normalized) plus the English idioms again, to spot
+    literal copies left in the translation.
+Each submission is then scanned once per side, in time linear in the text length
+plus the number of matches, however many idioms are loaded.
+
+Arabic normalization drops diacritics and tatweel and folds alef (أ إ آ ٱ -> ا)
+and alef maqsura (ى -> ي) variants. Because Arabic attaches conjunctions,
+prepositions and verb prefixes to the word (وكسر، يكسر، سيكسر), a rendering may be
+preceded by up to three such prefix letters; other renderings and the English
+idioms must start and end on a word boundary.
+"""
+import re
+import json
+import hashlib
+import threading
+from collections import deque, OrderedDict
+
+_ARABIC_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_ARABIC_FOLD = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي"})
+_ARABIC_PREFIXES = set("وفبلكسيتنا")
+_MAX_PREFIX = 3
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_arabic(text):
+    text = _ARABIC_DIACRITICS.sub("", text or "")
+    return _SPACES.sub(" ", text.translate(_ARABIC_FOLD)).strip()
+
+
+def normalize_english(text):
+    return _SPACES.sub(" ", (text or "").lower()).strip()
+
+
+def _is_word(ch):
+    return ch.isalnum() or ch == "_"
+
+
+def _prefixed_word_start(text, start):
+    """True if text[:start] ends with a word start followed by at most _MAX_PREFIX prefix letters."""
+    i = start
+    while i > 0 and start - i < _MAX_PREFIX and text[i - 1] in _ARABIC_PREFIXES:
+        i -= 1
+        if i == 0 or not _is_word(text[i - 1]):
+            return True
+    return False
+
+
+class AhoCorasick:
+    """Minimal Aho-Corasick automaton over characters; patterns carry an arbitrary payload."""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for pattern, payload in patterns:
+            if not pattern:
+                continue
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append((len(pattern), payload))
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def iter_matches(self, text):
+        """Yield (start, end, payload) for every pattern occurrence in text."""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length, payload in out[node]:
+                yield i + 1 - length, i + 1, payload
+
+
+class IdiomMatcher:
+    def __init__(self, idioms_dict):
+        self.idioms = []       # (english key, expected rendering) in dictionary order
+        source_patterns = []
+        target_patterns = []
+        for k, (eng, data) in enumerate(idioms_dict.items()):
+            variants = []
+            if isinstance(data, dict):
+                expected = data.get("expected", data.get("arabic"))
+                variants = data.get("variants") or []
+            else:
+                expected = data
+            self.idioms.append((eng, expected))
+            eng_norm = normalize_english(eng)
+            source_patterns.append((eng_norm, k))
+            target_patterns.append((eng_norm, ("literal", k)))
+            for rendering in [expected] + list(variants):
+                if rendering and rendering.strip():
+                    target_patterns.append((normalize_arabic(rendering.lower()), ("expected", k)))
+        self._source = AhoCorasick(source_patterns)
+        self._target = AhoCorasick(target_patterns)
+
+    def source_idioms(self, source_text):
+        """Indexes of idioms occurring in source_text as whole words."""
+        text = normalize_english(source_text)
+        found = set()
+        for start, end, k in self._source.iter_matches(text):
+            if (start == 0 or not _is_word(text[start - 1])) and (end == len(text) or not _is_word(text[end])):
+                found.add(k)
+        return found
+
+    def target_hits(self, translation, wanted):
+        """{idiom index: {"expected", "literal"} subset} for idioms in `wanted` seen in the translation."""
+        hits = {}
+        if not wanted or not translation:
+            return hits
+        text = normalize_arabic(translation.lower())
+        for start, end, (kind, k) in self._target.iter_matches(text):
+            if k not in wanted:
+                continue
+            right_ok = end == len(text) or not _is_word(text[end])
+            left_ok = start == 0 or not _is_word(text[start - 1])
+            if kind == "expected":
+                right_ok = True  # suffixed pronouns are fine
+                if not left_ok:
+                    left_ok = _prefixed_word_start(text, start)
+            if left_ok and right_ok:
+                hits.setdefault(k, set()).add(kind)
+        return hits
+
+    def detect(self, source_text, student_translation):
+        """Same result shape as detect_idiomatic_issues."""
+        in_source = self.source_idioms(source_text)
+        hits = self.target_hits(student_translation or "", in_source)
+        detected = {}
+        for k in sorted(in_source):
+            eng, expected = self.idioms[k]
+            kinds = hits.get(k, ())
+            if "expected" in kinds:
+                detected[eng] = {"status": "idiomatic", "expected": expected}
+            elif "literal" in kinds:
+                detected[eng] = {"status": "non-idiomatic-literal", "expected": expected}
+            else:
+                detected[eng] = {"status": "non-idiomatic-missing", "expected": expected}
+        return detected
+
+
+class IdiomSnapshot(dict):
+    """
+    An idiom dictionary that is not modified once built, identified by `version` (e.g.
+    the data version db_utils.get_idioms loaded it at). get_matcher looks its matcher up
+    by version instead of hashing the contents.
+    """
+
+    def __init__(self, entries, version):
+        super().__init__(entries)
+        self.version = version
+
+
+MAX_CACHED_MATCHERS = 8   # one per target language snapshot in use
+_cached = OrderedDict()   # cache key -> matcher, least recently used first
+_cached_lock = threading.Lock()
+
+
+def _cache_key(idioms_dict):
+    version = getattr(idioms_dict, "version", None)
+    if version is not None:
+        return ("version", version)
+    payload = json.dumps(idioms_dict, sort_keys=True, ensure_ascii=False, default=str)
+    return ("content", hashlib.sha256(payload.encode("utf-8")).hexdigest())
+
+
+def get_matcher(idioms_dict):
+    """
+    The compiled matcher for idioms_dict, rebuilt only when its contents change:
+    IdiomSnapshot dicts are keyed by their version, other dicts by a hash of their
+    contents, so an edited dict never gets the automaton of what it held before.
+    """
+    key = _cache_key(idioms_dict)
+    with _cached_lock:
+        matcher = _cached.get(key)
+        if matcher is not None:
+            _cached.move_to_end(key)
+            return matcher
+    matcher = IdiomMatcher(idioms_dict)
+    with _cached_lock:
+        _cached[key] = matcher
+        while len(_cached) > MAX_CACHED_MATCHERS:
+            _cached.popitem(last=False)
+    return matcher
@@ -1,26 +1,136 @@
-import sqlite3
+import io
+import os
 import json
-import csv
 import streamlit as st
-import nltk
-nltk.download('punkt')
+import streamlit.components.v1 as components
 
 from db_utils import (
-    init_db, register_user, login_user, get_user_role,
-    add_practice_item, assign_practices_to_user, get_user_practice_queue,
-    get_all_submissions, get_all_users,
+    init_db, create_user, approve_user, authenticate,
+    assign_practices_to_user, assign_practices, get_user_practice_queue,
+    set_practice_status, get_practice_items,
+    get_all_users, add_submission, count_submissions,
+    get_submission_report, requeue_submission, get_job_counts, get_error_distribution, get_top_missed_idioms,
+    get_issue_filter_options, data_generation, get_student_progress, get_student_timeline,
     export_submissions_with_errors, export_instructor_report_pdf,
-    load_idioms_from_file, classify_translation_issues,
+    import_idioms, count_idioms, classify_translation_issues,
     highlight_errors, suggest_activities
 )
+from metrics_utils import warm_up_detectors, detector_status, plot_radar_for_student_metrics
+from analysis_worker import start_background_worker
+import auth
+import perf
+import recommender
+
+QUEUE_PAGE_SIZE = 20
+PROGRESS_LABELS = {"semantic": "Semantic", "bleu": "BLEU", "chrf": "chrF",
+                   "word_accuracy": "Word accuracy", "char_accuracy": "Character accuracy"}
+# Seconds a cached query result may lag writes made by other processes (standalone
+# analysis workers); writes made by this app show up on the next rerun regardless.
+CACHE_TTL = int(os.environ.get("DASHBOARD_CACHE_TTL", "60"))
 
 # ---------------- Initialize DB ----------------
-init_db()
+# Streamlit reruns this script on every widget event; cache_resource makes the
+# setup (migrations, model warm-up, worker thread) run once per server process.
+@st.cache_resource(show_spinner=False)
+def startup():
+    init_db()
+    # Models load in the background; pages render before they are ready.
+    warm_up_detectors(background=True)
+    # Submissions are analyzed by a worker pool; skip the in-process one when
+    # standalone `python analysis_worker.py` workers serve this database.
+    if os.environ.get("ANALYSIS_EXTERNAL_WORKERS") != "1":
+        start_background_worker()
+    # PERF_METRICS=1 turns on timing; PERF_METRICS_PORT also serves /metrics for Prometheus.
+    perf.start_metrics_server()
+    return True
+
+startup()
+
+# ---------------- Cached reads ----------------
+# `gen` is db_utils.data_generation(...) for the data each read depends on. Writes
+# bump it, so they invalidate exactly the entries they affect; the rest stay cached.
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_users(gen):
+    return get_all_users()
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_practice_items(gen):
+    return get_practice_items()
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_practice_queue(username, limit, after_id, gen):
+    return get_user_practice_queue(username, limit=limit, after_id=after_id)
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_submission_count(gen):
+    return count_submissions()
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_filter_options(gen):
+    return get_issue_filter_options()
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_issue_summary(filters, gen):
+    """Error distribution and top missed idioms for the dashboard filters (a tuple of items)."""
+    kwargs = dict(filters)
+    return get_error_distribution(**kwargs), get_top_missed_idioms(5, **kwargs)
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_progress(username, gen):
+    return get_student_progress(username), get_student_timeline(username)
+
+@st.cache_data(ttl=5, show_spinner=False)
+def cached_job_counts():
+    return get_job_counts()
+
+def submission_report(sub_id):
+    """get_submission_report for sub_id; ready reports are kept in the session (they never change)."""
+    ready = st.session_state.setdefault("reports", {})
+    if sub_id in ready:
+        return {"status": "ready", "report": ready[sub_id], "error": None}
+    result = get_submission_report(sub_id)
+    if result["status"] == "ready" and not result["report"].get("degraded"):
+        ready[sub_id] = result["report"]
+    return result
 
 # ---------------- Session State ----------------
+# The signed session token is kept in this browser session's state and in a
+# SameSite=Strict cookie, never in the URL (where it would end up in history, logs
+# and shared links). The cookie is what survives a page reload: a new browser
+# session starts from it. Streamlit can only set cookies from the page's script, so
+# it cannot be HttpOnly; it holds nothing but the token, which expires with the
+# session. The token is verified again on every rerun, so logging out elsewhere, a
+# password or role change, or expiry ends the session; verify_session answers
+# known tokens from memory.
+SESSION_COOKIE = "grader_session"
+
 if "username" not in st.session_state:
     st.session_state.username = None
     st.session_state.role = None
+    # st.context.cookies holds the cookies sent when this browser session connected.
+    st.session_state.session_token = st.context.cookies.get(SESSION_COOKIE)
+    st.session_state.cookie_token = st.session_state.session_token
+if st.session_state.session_token:
+    current = auth.verify_session(st.session_state.session_token)
+    if current is None:
+        st.session_state.session_token = None
+        st.session_state.username = None
+        st.session_state.role = None
+    else:
+        st.session_state.username, st.session_state.role = current
+
+def sync_session_cookie():
+    """Write the session token to the browser's cookie (or clear it) when it changed."""
+    token = st.session_state.session_token
+    if token == st.session_state.cookie_token:
+        return
+    max_age = auth.SESSION_TTL if token else 0
+    components.html(f"""<script>
+        window.parent.document.cookie = {json.dumps(SESSION_COOKIE)} + "=" + {json.dumps(token or "")}
+            + "; Path=/; Max-Age={max_age}; SameSite=Strict"
+            + (window.parent.location.protocol === "https:" ? "; Secure" : "");
+        </script>""", height=0)
+    st.session_state.cookie_token = token
 
 # ---------------- Login / Register ----------------
 def login_section():
@@ -29,27 +139,35 @@ def login_section():
     password = st.sidebar.text_input("Password", type="password")
     login_success = False
     if st.sidebar.button("Login"):
-        if login_user(username, password):
-            st.session_state.username = username
-            st.session_state.role = get_user_role(username)
+        user = authenticate(username, password)
+        if user:
+            st.session_state.username = user["username"]
+            st.session_state.role = user["role"]
+            st.session_state.session_token = auth.issue_session(user["username"], user["role"])
             st.success(f"Welcome, {username} ({st.session_state.role})")
             login_success = True
         else:
             st.error("Invalid credentials or not approved yet.")
+    if st.session_state.username and st.sidebar.button("Logout"):
+        auth.revoke_session(st.session_state.session_token)
+        st.session_state.session_token = None
+        st.session_state.username = None
+        st.session_state.role = None
+        st.rerun()
 
     st.sidebar.header("Register")
     new_user = st.sidebar.text_input("New Username")
     new_pass = st.sidebar.text_input("New Password", type="password")
     role = st.sidebar.selectbox("Role", ["Student", "Instructor"])
     if st.sidebar.button("Register"):
-        # Auto-approve everyone
-        conn = sqlite3.connect("app.db")
-        c = conn.cursor()
-        c.execute("INSERT OR REPLACE INTO users (username, password, role, approved) VALUES (?,?,?,?)",
-                  (new_user, new_pass, role, 1))
-        conn.commit()
-        conn.close()
-        st.info("Registration submitted. You are automatically approved.")
+        new_user = new_user.strip()
+        if not new_user or not new_pass:
+            st.sidebar.error("Choose a username and a password.")
+        else:
+            if create_user(new_user, new_pass, role):
+                st.sidebar.info("Registration submitted. You can log in once an instructor approves it.")
+            else:
+                st.sidebar.error(f"The username {new_user!r} is already taken.")
 
     return login_success
 
@@ -62,78 +180,203 @@ def student_dashboard():
     reference = st.text_area("Reference Translation (optional)", height=100)
 
     if st.button("Submit Translation"):
-        idioms_dict = load_idioms_from_file("idioms.json")
-        report = classify_translation_issues(source_text, post_edit, idioms_dict, lang=target_lang)
+        # Analysis runs in the background worker; the feedback appears once the report is ready.
+        sub_id, _job_id = add_submission(st.session_state.username, source_text, post_edit,
+                                         reference, target_lang)
+        st.session_state.last_submission = sub_id
 
-        st.markdown("### 🔍 Error Highlighting")
-        highlighted = highlight_errors(post_edit, report)
-        st.markdown(highlighted, unsafe_allow_html=True)
-
-        st.markdown("### 🎯 Adaptive Suggestions")
-        suggestions = suggest_activities(report)
-        if not suggestions:
-            st.success("✅ No major issues detected. Great job!")
+    if st.session_state.get("last_submission"):
+        result = submission_report(st.session_state.last_submission)
+        report = result["report"]
+        if result["status"] == "failed":
+            st.error(f"❌ Your translation could not be analyzed: {result['error']}")
+            if st.button("Retry analysis"):
+                requeue_submission(st.session_state.last_submission)
+                st.rerun()
+        elif result["status"] == "pending":
+            st.info("⏳ Your translation is being analyzed…")
+            st.button("Check for feedback")
         else:
-            for idx, s in enumerate(suggestions):
-                st.write(f"- {s['type'].capitalize()} → {s['prompt']}")
-                if st.button(f"Add to practice queue ({s['type']})", key=f"pr_{idx}"):
-                    pid = add_practice_item(s["type"], s["prompt"], "")
-                    assign_practices_to_user(st.session_state.username, [pid])
-                    st.success("Added to your practice queue.")
+            if report.get("degraded"):
+                st.caption("Some checks were unavailable; this feedback is updated once they are back.")
+            st.markdown("### 🔍 Error Highlighting")
+            highlighted = highlight_errors(post_edit, report)
+            st.markdown(highlighted, unsafe_allow_html=True)
+
+            st.markdown("### 🎯 Adaptive Suggestions")
+            suggestions = suggest_activities(report, username=st.session_state.username)
+            if not suggestions:
+                st.success("✅ No major issues detected. Great job!")
+            else:
+                for idx, s in enumerate(suggestions):
+                    st.write(f"- {s['type'].capitalize()} → {s['short']}")
+                    # Existing practice items close to this issue, so the bank doesn't fill with copies.
+                    for m in s["matches"]:
+                        col_item, col_add = st.columns([5, 1])
+                        col_item.write(f"    • {m['prompt']}")
+                        if col_add.button("Add", key=f"pm_{idx}_{m['id']}"):
+                            assign_practices_to_user(st.session_state.username, [m["id"]])
+                            st.success("Added to your practice queue.")
+                    if s["category"] and not s["matches"] and \
+                            st.button(f"Add to practice queue ({s['type']})", key=f"pr_{idx}"):
+                        _pid, inserted = recommender.add_suggestion(st.session_state.username, s)
+                        st.success("Added to your practice queue." if inserted else "Already in your practice queue.")
+
+    progress_section(st.session_state.username)
 
     st.markdown("### 📚 My Practice Queue")
-    queue = get_user_practice_queue(st.session_state.username)
-    for q in queue:
-        st.write(f"- {q['category']}: {q['prompt']}")
+    # Keyset pages: each entry is the last assignment id of the previous page.
+    cursors = st.session_state.setdefault("queue_cursors", [0])
+    queue = cached_practice_queue(st.session_state.username, QUEUE_PAGE_SIZE + 1, cursors[-1],
+                                  data_generation("practice", st.session_state.username))
+    for q in queue[:QUEUE_PAGE_SIZE]:
+        col_item, col_done = st.columns([5, 1])
+        due = f" (due {q['due_date']})" if q["due_date"] else ""
+        col_item.write(f"- {q['category']}: {q['prompt']}{due}")
+        if col_done.button("Done", key=f"done_{q['id']}"):
+            set_practice_status(st.session_state.username, q["id"], "completed")
+            st.rerun()
+    col_prev, col_next = st.columns(2)
+    if len(cursors) > 1 and col_prev.button("← Previous"):
+        cursors.pop()
+        st.rerun()
+    if len(queue) > QUEUE_PAGE_SIZE and col_next.button("Next →"):
+        cursors.append(queue[QUEUE_PAGE_SIZE - 1]["id"])
+        st.rerun()
+
+def progress_section(username):
+    """Radar of the last PROGRESS_WINDOW submissions, trends and weekly timeline, from the progress rollups."""
+    st.markdown("### 📈 My Progress")
+    progress, timeline = cached_progress(username, data_generation("issues", username))
+    shown = [(m, label) for m, label in PROGRESS_LABELS.items() if m in progress]
+    if not shown:
+        st.info("Your progress appears here once your submissions are analyzed.")
+        return
+    st.plotly_chart(plot_radar_for_student_metrics({label: progress[m]["last_mean"] for m, label in shown}))
+    for col, (m, label) in zip(st.columns(len(shown)), shown):
+        slope = progress[m]["slope_per_week"]
+        col.metric(label, progress[m]["last_mean"], delta=None if slope is None else f"{slope:+.1f}/week")
+    st.line_chart({label: {week: means.get(m) for week, means in timeline} for m, label in shown})
 
 # ---------------- Instructor Dashboard ----------------
 def instructor_dashboard():
     st.title("📊 Instructor Dashboard")
-    submissions = get_all_submissions()
-    users = get_all_users()
-    idioms_dict = load_idioms_from_file("idioms.json")
+    users = cached_users(data_generation("users"))
+    filters = {}
 
-    if not submissions:
+    if not cached_submission_count(data_generation("submissions")):
         st.info("No student submissions yet.")
     else:
-        error_counts = {"semantic": 0, "idiom": 0, "grammar": 0}
-        idiom_misses = {}
-
-        for sub in submissions:
-            rep = classify_translation_issues(
-                sub["source_text"], sub["student_translation"],
-                idioms_dict, lang=sub["target_lang"]
-            )
-            if rep.get("semantic_flag"):
-                error_counts["semantic"] += 1
-            for idiom, info in rep.get("idiom_issues", {}).items():
-                if info["status"] == "non-idiomatic":
-                    error_counts["idiom"] += 1
-                    idiom_misses[idiom] = idiom_misses.get(idiom, 0) + 1
-            if rep.get("grammar"):
-                error_counts["grammar"] += len(rep["grammar"])
+        # Counts come from the issue_daily_counts aggregate kept up to date by the analysis worker.
+        col_from, col_to, col_student, col_lang = st.columns(4)
+        start = col_from.date_input("From", value=None)
+        end = col_to.date_input("To", value=None)
+        students, langs = cached_filter_options(data_generation("issues"))
+        student = col_student.selectbox("Student", ["All"] + students)
+        lang = col_lang.selectbox("Language", ["All"] + langs)
+        filters = {
+            "start": start, "end": end,
+            "username": None if student == "All" else student,
+            "target_lang": None if lang == "All" else lang,
+        }
 
+        error_counts, idiom_misses = cached_issue_summary(tuple(filters.items()),
+                                                          data_generation("issues", filters["username"]))
         st.markdown("### ⚠️ Error Distribution")
         st.bar_chart(error_counts)
 
         if idiom_misses:
             st.markdown("### ❌ Most Frequently Mistranslated Idioms")
-            for idiom, count in sorted(idiom_misses.items(), key=lambda x: -x[1])[:5]:
+            for idiom, count in idiom_misses:
                 st.write(f"- {idiom}: {count} times")
 
-    if st.button("⬇️ Download Submissions + Errors as CSV"):
-        filepath = export_submissions_with_errors("submissions_with_errors.csv")
-        with open(filepath, "rb") as f:
-            st.download_button("Download CSV File", f, file_name="submissions_with_errors.csv")
+    pending = [u for u in users if u["registered"] and not u["approved"]]
+    with st.expander(f"🕒 Pending registrations ({len(pending)})"):
+        if not pending:
+            st.caption("No registrations are waiting for approval.")
+        for u in pending:
+            col_name, col_approve = st.columns([3, 1])
+            col_name.write(f"{u['username']} ({u['role']})")
+            if col_approve.button("Approve", key=f"approve_{u['username']}"):
+                approve_user(u["username"])
+                st.rerun()
+
+    with st.expander("📚 Assign practice"):
+        items = cached_practice_items(data_generation("practice_bank"))
+        chosen = st.multiselect("Practice items", items, format_func=lambda p: f"{p['category']}: {p['prompt']}")
+        student_names = [u["username"] for u in users if u["role"] == "Student"]
+        assignees = st.multiselect("Students (leave empty for the whole class)", student_names)
+        due_date = st.date_input("Due date", value=None)
+        if st.button("Assign") and chosen:
+            ids = [p["id"] for p in chosen]
+            if assignees:
+                result = assign_practices(ids, usernames=assignees, due_date=due_date)
+            else:
+                result = assign_practices(ids, role="Student", due_date=due_date)
+            st.success(f"Assigned {result['inserted']} item(s); {result['skipped']} already assigned or skipped.")
+
+    with st.expander("📖 Idiom dictionary"):
+        n_idioms, n_renderings = count_idioms()
+        st.caption(f"{n_idioms} idioms, {n_renderings} renderings. JSON as idioms.json, or CSV with columns "
+                   "phrase, target_lang, rendering, variants (separated by |), category.")
+        upload = st.file_uploader("Import idioms", type=["json", "csv"])
+        default_lang = st.text_input("Target language for files without one", value="ar")
+        if st.button("Import") and upload is not None:
+            try:
+                result = import_idioms(upload, target_lang=default_lang.strip() or "ar")
+            except ValueError as e:
+                st.error(f"Could not read {upload.name}: {e}")
+            else:
+                st.success(f"Imported {result['idioms']} idiom(s), {result['renderings']} rendering(s).")
+
+    export_name = st.selectbox("Export format", ["submissions_with_errors.csv", "submissions_with_errors.csv.gz",
+                                                 "submissions_with_errors.parquet"])
+    if st.button("⬇️ Download Submissions + Errors"):
+        # Written into this session's own buffer, like the PDF below: no shared file on disk.
+        export = io.BytesIO()
+        try:
+            export_submissions_with_errors(export_name, fileobj=export)
+        except ImportError:
+            st.error("Parquet export needs the optional 'pyarrow' package.")
+        else:
+            st.download_button("Download Export File", export.getvalue(), file_name=export_name)
 
     if st.button("📄 Download Instructor Report (PDF)"):
-        filepath = export_instructor_report_pdf("instructor_report.pdf")
-        with open(filepath, "rb") as f:
-            st.download_button("Download PDF File", f, file_name="instructor_report.pdf")
+        # Built in memory for the filters above (a student's report when one is selected),
+        # so concurrent sessions never share an output file.
+        pdf = io.BytesIO()
+        export_instructor_report_pdf(pdf, **filters)
+        st.download_button("Download PDF File", pdf.getvalue(),
+                           file_name=f"{filters.get('username') or 'instructor'}_report.pdf")
+
+    with st.expander("Detector status"):
+        st.json(detector_status())
+        st.write("Analysis jobs:", cached_job_counts())
+
+    if perf.enabled():
+        performance_panel()
+
+def performance_panel():
+    """Hidden unless PERF_METRICS=1: latency histograms, counters, cache gauges and profile captures."""
+    with st.expander("Performance"):
+        snap = perf.snapshot()
+        st.markdown("#### Latency")
+        st.dataframe(snap["histograms"])
+        st.markdown("#### Counters and gauges")
+        st.dataframe(snap["counters"] + snap["gauges"])
+        st.download_button("Prometheus text", perf.prometheus_text(), file_name="metrics.prom")
+        captures = perf.profile_captures()
+        if captures:
+            chosen = st.selectbox("Profile capture", captures)
+            st.code(perf.profile_summary(chosen))
+        if st.button("Reset metrics"):
+            perf.reset()
 
 # ---------------- Main ----------------
 def main():
     login_section()  # always show login/register
+    # After login_section: logging out reruns the script, so the cookie is cleared on the next run.
+    sync_session_cookie()
 
     # Show dashboard if user logged in
     if st.session_state.username:
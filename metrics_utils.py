@@ -1,64 +1,298 @@
 # tutor_utils.py
 import re
+import os
 import json
 import math
+import time
+import threading
+import importlib.util
 
-# Optional heavy imports with graceful fallback
-try:
-    from sentence_transformers import SentenceTransformer, util as st_util
-    SEM_MODEL = SentenceTransformer("all-MiniLM-L6-v2")
-    HAVE_SENT_TRANS = True
-except Exception:
-    SEM_MODEL = None
-    HAVE_SENT_TRANS = False
-
-try:
-    import language_tool_python
-    LANG_TOOL = language_tool_python.LanguageTool('en-US')
-    HAVE_LANGTOOL = True
-except Exception:
-    LANG_TOOL = None
-    HAVE_LANGTOOL = False
-
-# For collocation frequency heuristics
-try:
+from idiom_matcher import IdiomSnapshot, get_matcher as get_idiom_matcher
+import perf
+
+# ------------- LAZY DETECTOR REGISTRY -------------
+# The heavy backends (sentence-transformer model, LanguageTool's JVM, NLTK corpora)
+# are loaded on first use instead of at import time, so importing this module is
+# cheap. warm_up_detectors() can load them in a background thread ahead of time.
+#
+# Whether a detector is *configured* comes from the installation and the
+# environment only (DISABLED_DETECTORS lists detectors to leave off), never from
+# whether its backend happened to load in this process. The report cache version
+# is derived from that configuration, so the web app, analysis processes and CLIs
+# on one host agree on it; a configured backend that fails to load marks its
+# reports degraded (served, not cached) instead of changing the version.
+SEM_MODEL_NAME = "all-MiniLM-L6-v2"
+DISABLED_DETECTORS = {n.strip() for n in os.environ.get("DISABLED_DETECTORS", "").split(",") if n.strip()}
+
+def _installed(module):
+    return lambda: importlib.util.find_spec(module) is not None
+
+class LazyDetector:
+    def __init__(self, name, loader, probe, backend, fallback):
+        self.name = name
+        self._loader = loader
+        self._probe = probe
+        self.backend = backend      # id of the configured backend (model, service), part of detector_version()
+        self.fallback = fallback    # id of what answers when the detector is not configured
+        self._configured = None
+        self._lock = threading.Lock()
+        self.state = "not-loaded"   # -> loading -> ready | unavailable
+        self.value = None
+        self.load_seconds = None
+        self.error = None
+
+    def configured(self):
+        """True if this detector is set up to run: not in DISABLED_DETECTORS and its probe passes (checked once)."""
+        if self._configured is None:
+            self._configured = self.name not in DISABLED_DETECTORS and bool(self._probe())
+        return self._configured
+
+    def disable(self, reason="disabled"):
+        """Turn the detector off in this process, as if it were listed in DISABLED_DETECTORS."""
+        with self._lock:
+            self._configured = False
+            self.state = "unavailable"
+            self.value = None
+            self.error = reason
+
+    def get(self):
+        """The loaded backend, or None if it cannot be loaded (callers fall back)."""
+        if self.state in ("ready", "unavailable"):
+            return self.value
+        if not self.configured():
+            self.disable("not configured")
+            return None
+        with self._lock:
+            if self.state not in ("ready", "unavailable"):
+                self.state = "loading"
+                t0 = time.perf_counter()
+                try:
+                    self.value = self._loader()
+                    self.state = "ready"
+                except Exception as e:
+                    self.value = None
+                    self.error = f"{type(e).__name__}: {e}"
+                    self.state = "unavailable"
+                self.load_seconds = time.perf_counter() - t0
+        return self.value
+
+class _SemanticBackend:
+    def __init__(self):
+        from sentence_transformers import SentenceTransformer
+        from embedding_cache import EmbeddingStore
+        self.model = SentenceTransformer(SEM_MODEL_NAME)
+        self.store = EmbeddingStore(SEM_MODEL_NAME)
+
+    def encode(self, texts, batch_size=64):
+        def _encode(batch):
+            return self.model.encode(batch, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+        return self.store.encode(texts, _encode)
+
+# Set in analysis pool processes to the parent's LanguageTool servers (see use_grammar_servers).
+_GRAMMAR_URLS = None
+
+def use_grammar_servers(urls):
+    """
+    Check grammar through these running servers (from shared_grammar_urls() in another
+    process) instead of starting local ones; [] means grammar is configured but the
+    other process could not start a server. Call before the grammar detector loads.
+    """
+    global _GRAMMAR_URLS
+    _GRAMMAR_URLS = list(urls)
+
+def shared_grammar_urls():
+    """
+    URLs of this process's LanguageTool servers, for processes it starts: None when
+    grammar is not configured, [] when it is but no server could be started.
+    """
+    grammar = DETECTORS["grammar"]
+    if not grammar.configured():
+        return None
+    service = grammar.get()
+    return service.server_urls() if service is not None else []
+
+def _load_grammar_service():
+    # Pool of LanguageTool servers (another process's, LANGUAGETOOL_URL, or local ones per language)
+    import grammar_service
+    if _GRAMMAR_URLS is not None:
+        if not _GRAMMAR_URLS:
+            raise RuntimeError("the parent process has no LanguageTool server")
+        return grammar_service.GrammarService(urls=_GRAMMAR_URLS)
+    service = grammar_service.GrammarService.from_env().warm_up(("en",))
+    if service.unavailable("en"):
+        service.close()
+        raise RuntimeError(service.status()["launch_errors"])
+    return service
+
+def _grammar_service_present():
+    return (_GRAMMAR_URLS is not None or bool(os.environ.get("LANGUAGETOOL_URL"))
+            or _installed("language_tool_python")())
+
+def ensure_nltk_resource(resource, package):
+    """Download an NLTK package only if it is not already installed (no network otherwise)."""
     import nltk
-    from nltk.corpus import brown
-    nltk.download('brown', quiet=True)
-    HAVE_NLTK = True
-except Exception:
-    HAVE_NLTK = False
+    try:
+        nltk.data.find(resource)
+    except LookupError:
+        nltk.download(package, quiet=True)
+        nltk.data.find(resource)
+
+def _load_collocation_index():
+    # For collocation frequency heuristics; built from the Brown corpus on first use
+    import collocation_index
+    return collocation_index.load_or_build()
+
+def _collocation_index_present():
+    import collocation_index
+    return os.path.exists(collocation_index.COLLOCATION_INDEX_FILE) or _installed("nltk")()
+
+DETECTORS = {
+    "semantic": LazyDetector("semantic", _SemanticBackend, _installed("sentence_transformers"),
+                             SEM_MODEL_NAME, "difflib"),
+    "grammar": LazyDetector("grammar", _load_grammar_service, _grammar_service_present,
+                            "languagetool", "heuristic"),
+    "collocation": LazyDetector("collocation", _load_collocation_index, _collocation_index_present,
+                                "brown-pmi", "off"),
+}
+
+_warmup_thread = None
+
+def warm_up_detectors(names=None, background=True):
+    """Load detectors ahead of first use; in a daemon thread unless background=False."""
+    global _warmup_thread
+    def _run():
+        for name in names or DETECTORS:
+            DETECTORS[name].get()
+    if not background:
+        _run()
+        return None
+    if _warmup_thread is None or not _warmup_thread.is_alive():
+        _warmup_thread = threading.Thread(target=_run, name="detector-warmup", daemon=True)
+        _warmup_thread.start()
+    return _warmup_thread
+
+def detector_status():
+    """{name: {"configured", "backend", "state", "load_seconds", "error"}} for every registered detector."""
+    return {name: {"configured": d.configured(), "backend": d.backend if d.configured() else d.fallback,
+                   "state": d.state, "load_seconds": d.load_seconds, "error": d.error}
+            for name, d in DETECTORS.items()}
+
+# Bump a detector's version whenever its output can change: cached analysis reports
+# (db_utils.submission_reports) are keyed on detector_version().
+DETECTOR_VERSIONS = {
+    "semantic": "1",
+    "idiom": "2",
+    "grammar": "2",
+    "collocation": "2",
+    "segmenter": "2",   # reports are merged from sentence segments; see segmenter.py
+}
+
+def detector_version():
+    """Version string of the detectors and their configured backends (not of what has loaded so far)."""
+    backends = {name: d.backend if d.configured() else d.fallback for name, d in DETECTORS.items()}
+    return ";".join(f"{name}={ver}/{backends.get(name, '-')}" for name, ver in sorted(DETECTOR_VERSIONS.items()))
+
+# idioms.json loader, for scripts working without a database; the app and the
+# analysis workers read db_utils.get_idioms(target_lang) snapshots instead.
+# The parsed dict is reused until the file changes, so the compiled idiom matcher
+# (keyed on the file's mtime and size) is only rebuilt when idioms.json is edited.
+_idioms_cache = {}
 
-# Idiom DB loader (assumes db_utils idioms table or idioms.json)
 def load_idioms_from_file(path="idioms.json"):
     try:
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = _idioms_cache.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
         with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
             # Accept either {eng: {"arabic":..., "category":...}} or simple mapping
             if isinstance(data, dict):
+                data = IdiomSnapshot(data, version=(os.path.abspath(path),) + stamp)
+                _idioms_cache[path] = (stamp, data)
                 return data
     except Exception:
         pass
     return {}
 
 # ------------- DETECTORS -------------
+def encode_texts(texts, batch_size=64):
+    """
+    Normalized sentence embeddings for texts, served from the shared embedding cache
+    (in-process LRU, then the on-disk matrix); only unseen texts reach the model.
+    Returns None when the sentence-transformer backend is unavailable.
+    """
+    sem = DETECTORS["semantic"].get()
+    return sem.encode(texts, batch_size=batch_size) if sem else None
+
+def embedding_cache_stats():
+    sem = DETECTORS["semantic"].value
+    return sem.store.stats() if sem else {}
+
+@perf.register_collector
+def _perf_gauges():
+    """Cache and detector gauges for perf dumps, read from state the detectors keep anyway."""
+    gauges = {("detector_ready", (("detector", name),)): int(d.state == "ready") for name, d in DETECTORS.items()}
+    emb = embedding_cache_stats()
+    if emb:
+        gauges["embedding_cache_hit_rate"] = round(emb["hit_rate"], 4)
+        gauges["embedding_cache_lru_entries"] = emb["lru_entries"]
+        gauges["embedding_cache_disk_rows"] = emb["disk_rows"]
+    grammar = DETECTORS["grammar"].value
+    if grammar is not None:
+        st = grammar.status()
+        lookups = st["hits"] + st["misses"]
+        gauges["grammar_cache_hit_rate"] = round(st["hits"] / lookups, 4) if lookups else 0.0
+        gauges["grammar_fallbacks"] = st["fallbacks"]
+        for server in st["servers"]:
+            gauges[("grammar_server_open", (("url", server["url"]),))] = int(server["breaker"] != "closed")
+    return gauges
+
 def semantic_similarity_score(source, student_translation, reference=None):
     """
     Returns score 0..100; higher = more semantically similar.
     If SentenceTransformer not available, fallback to simple ratio.
     If reference provided, compare student->reference, else compare source->student (cross-lingual risk).
     """
-    if not student_translation:
-        return 0.0
-    if HAVE_SENT_TRANS and SEM_MODEL:
+    return semantic_similarity_scores_batch([(source, student_translation, reference)])[0]
+
+def semantic_similarity_scores_batch(pairs, batch_size=64):
+    """
+    Batched semantic_similarity_score for many (source, student_translation[, reference]) pairs.
+    Every distinct text is encoded once, in batches of batch_size, and the cosine
+    similarities of all pairs are computed as one row-wise dot product.
+    Returns a list of scores 0..100 in the order of pairs.
+    """
+    return _semantic_scores(pairs, batch_size)[0]
+
+def _semantic_scores(pairs, batch_size=64):
+    """(scores, fell_back): fell_back is True if the configured model could not score the pairs."""
+    pairs = [(p[0], p[1], p[2] if len(p) > 2 else None) for p in pairs]
+    scores = [0.0] * len(pairs)
+    todo = [i for i, (_src, stud, _ref) in enumerate(pairs) if stud]
+    if not todo:
+        return scores, False
+    if DETECTORS["semantic"].get():
         try:
+            import numpy as np
             # If both are same language, straightforward; otherwise still may work with multilingual model
-            a = SEM_MODEL.encode(source if reference is None else reference, convert_to_tensor=True)
-            b = SEM_MODEL.encode(student_translation, convert_to_tensor=True)
-            sim = float(st_util.cos_sim(a, b).item())
-            return max(0.0, min(100.0, sim * 100.0))
+            lefts = [pairs[i][0] if pairs[i][2] is None else pairs[i][2] for i in todo]
+            rights = [pairs[i][1] for i in todo]
+            unique = list(dict.fromkeys(lefts + rights))
+            row = {text: k for k, text in enumerate(unique)}
+            emb = encode_texts(unique, batch_size=batch_size)
+            sims = np.einsum("ij,ij->i", emb[[row[t] for t in lefts]], emb[[row[t] for t in rights]])
+            for i, sim in zip(todo, sims.tolist()):
+                scores[i] = max(0.0, min(100.0, sim * 100.0))
+            return scores, False
         except Exception:
             pass
+    for i in todo:
+        scores[i] = _fallback_similarity(*pairs[i])
+    return scores, DETECTORS["semantic"].configured()
+
+def _fallback_similarity(source, student_translation, reference=None):
     # fallback: rough token overlap ratio
     from difflib import SequenceMatcher
     ref = reference if reference else source
@@ -68,42 +302,60 @@ def semantic_similarity_score(source, student_translation, reference=None):
 def detect_idiomatic_issues(source_text, student_translation, idioms_dict):
     """
     Returns dict: {idiom_text: {"status": "idiomatic"|"non-idiomatic-missing"|"non-idiomatic-literal", "expected": arabic}}
+    Matching uses the compiled idiom_matcher automaton for idioms_dict (built once per dictionary).
     """
-    detected = {}
-    s_low = source_text.lower()
-    st_low = (student_translation or "").lower()
-    for eng, data in idioms_dict.items():
-        eng_low = eng.lower()
-        if eng_low in s_low:
-            expected = data.get("arabic") if isinstance(data, dict) else data
-            # If expected Arabic appears in student translation -> idiomatic
-            if expected and expected.strip() and expected in (student_translation or ""):
-                detected[eng] = {"status": "idiomatic", "expected": expected}
-            else:
-                # literal English words appearing in Arabic text -> literal translation
-                if eng_low in st_low:
-                    detected[eng] = {"status": "non-idiomatic-literal", "expected": expected}
-                else:
-                    detected[eng] = {"status": "non-idiomatic-missing", "expected": expected}
-    return detected
+    if not idioms_dict or not source_text:
+        return {}
+    return get_idiom_matcher(idioms_dict).detect(source_text, student_translation)
 
 def detect_fluency_grammar(student_translation, lang="en"):
     """
     Returns list of grammar/fluency matches (message, replacements).
-    For English uses LanguageTool if available. For Arabic, returns simple heuristics (punctuation, repeated tokens).
+    Uses the LanguageTool server pool for `lang` if available, else simple heuristics
+    (punctuation, repeated spaces, run-on length).
     """
-    if not student_translation:
-        return []
-    if lang.startswith("en") and HAVE_LANGTOOL and LANG_TOOL:
-        try:
-            matches = LANG_TOOL.check(student_translation)
-            results = []
-            for m in matches[:10]:
-                results.append({"message": m.message, "replacements": m.replacements[:3], "offset": m.offset})
-            return results
-        except Exception:
-            pass
-    # Arabic / fallback heuristics
+    return _grammar_batch([student_translation], [lang])[0][0]
+
+def _grammar_batch(texts, langs, heuristics=True):
+    """
+    [(matches, checked_by_service)] in order; texts the service could not check get heuristics,
+    or no matches with heuristics=False.
+    """
+    guess = heuristic_grammar if heuristics else (lambda _text: [])
+    results = [([], True) if not t else None for t in texts]
+    service = DETECTORS["grammar"].get()
+    if service is not None:
+        by_lang = {}
+        for i, (t, lang) in enumerate(zip(texts, langs)):
+            if t:
+                by_lang.setdefault(lang or "en", []).append(i)
+        for lang, idxs in by_lang.items():
+            if service.unavailable(lang):
+                # no LanguageTool for this language at all: heuristics are the real answer
+                for i in idxs:
+                    results[i] = (guess(texts[i]), True)
+                continue
+            try:
+                checked = service.check_batch([texts[i] for i in idxs], lang)
+            except Exception:
+                continue
+            for i, matches in zip(idxs, checked):
+                if matches is not None:
+                    results[i] = (matches, True)
+    # heuristics are the real answer only when LanguageTool is not configured at all
+    configured = DETECTORS["grammar"].configured()
+    return [r if r is not None else (guess(t), not configured) for r, t in zip(results, texts)]
+
+def uses_grammar_heuristics(lang="en"):
+    """True if heuristic_grammar rather than LanguageTool answers for lang."""
+    grammar = DETECTORS["grammar"]
+    if not grammar.configured():
+        return True
+    service = grammar.get()
+    return service is None or service.unavailable(lang or "en")
+
+def heuristic_grammar(student_translation):
+    """Whole-text checks (length, spacing, punctuation) used when LanguageTool is not available."""
     issues = []
     # Check for long run-on sentences (very simple)
     if len(student_translation.split()) > 50:
@@ -117,30 +369,14 @@ def detect_fluency_grammar(student_translation, lang="en"):
 
 def detect_collocation_issues(student_translation, top_n=3):
     """
-    Heuristic: check low-frequency adjacent bigrams in Brown corpus. Returns list of flagged bigrams.
-    Requires NLTK Brown corpus; otherwise returns empty list.
+    Flags adjacent bigrams that are rarer in the Brown corpus than their words' frequencies
+    predict (lowest PMI first). Returns list of flagged bigrams.
+    Uses the precomputed index from collocation_index.py; otherwise returns empty list.
     """
-    if not HAVE_NLTK:
+    index = DETECTORS["collocation"].get()
+    if index is None or not student_translation:
         return []
-    words = re.findall(r"\w+", student_translation.lower())
-    if len(words) < 2:
-        return []
-    bigrams = list(zip(words, words[1:]))
-    freqdist = nltk.FreqDist(brown.words())
-    warnings = []
-    for bg in bigrams:
-        # frequency heuristic: if both tokens appear but bigram rare
-        bg_freq = sum(1 for _ in brown if False)  # placeholder to avoid heavy calc if needed
-    # Simpler: flag rare word combinations using corpus bigram frequency
-    from nltk.collocations import BigramAssocMeasures, BigramCollocationFinder
-    finder = BigramCollocationFinder.from_words(words)
-    scored = finder.score_ngrams(BigramAssocMeasures.likelihood_ratio)
-    # scored is list of ((w1,w2), score). Lower score -> rarer; pick lowest scorers
-    if not scored:
-        return []
-    scored_sorted = sorted(scored, key=lambda x: x[1])
-    flags = [f"{a} {b}" for ((a,b), _s) in scored_sorted[:min(top_n, len(scored_sorted))]]
-    return flags
+    return index.rare_bigrams(student_translation, top_n=top_n)
 
 # ------------- CLASSIFIER & HINT MAPPING -------------
 def classify_translation_issues(source, student_translation, reference=None, idioms_dict=None, student_lang="en"):
@@ -155,20 +391,54 @@ def classify_translation_issues(source, student_translation, reference=None, idi
       "priority": ["semantic","idiom","grammar", ...]
     }
     """
+    return classify_translation_issues_batch([(source, student_translation, reference, student_lang)],
+                                             idioms_dict)[0]
+
+def classify_translation_issues_batch(items, idioms_dict=None, batch_size=64, heuristics=True):
+    """
+    classify_translation_issues for many (source, student_translation, reference, student_lang)
+    tuples. Semantic scores for the whole batch come from one semantic_similarity_scores_batch call.
+    heuristics=False leaves heuristic_grammar out, for callers that run it on the whole text
+    (segmenter); reports LanguageTool should have checked then carry "grammar_fallback".
+    """
+    items = list(items)
+    perf.incr("submissions_analyzed_total", len(items))
+    with perf.timer("detector_batch_seconds", detector="semantic"):
+        sems, sem_fallback = _semantic_scores([(src, stud, ref) for src, stud, ref, _lang in items],
+                                              batch_size=batch_size)
+    with perf.timer("detector_batch_seconds", detector="grammar"):
+        grammar = _grammar_batch([stud for _src, stud, _ref, _lang in items], [lang for *_rest, lang in items],
+                                 heuristics)
+    reports = [_build_report(src, stud, sem, idioms_dict, gram)
+               for (src, stud, _ref, _lang), sem, gram in zip(items, sems, grammar)]
+    if sem_fallback:
+        # difflib stood in for the configured sentence-transformer; don't cache these reports
+        for report in reports:
+            report["degraded"] = True
+    return reports
+
+def _build_report(source, student_translation, sem, idioms_dict, grammar):
     report = {}
-    sem = semantic_similarity_score(source, student_translation, reference)
     report["semantic_score"] = sem
     heur_sem_threshold = 65.0
     report["semantic_flag"] = sem < heur_sem_threshold
 
-    idiom_issues = detect_idiomatic_issues(source, student_translation, idioms_dict or {})
+    with perf.timer("detector_seconds", detector="idiom"):
+        idiom_issues = detect_idiomatic_issues(source, student_translation, idioms_dict or {})
     report["idiom_issues"] = idiom_issues
 
-    grammar_matches = detect_fluency_grammar(student_translation, lang=student_lang)
+    grammar_matches, grammar_checked = grammar
     report["grammar_matches"] = grammar_matches
+    if not grammar_checked:
+        # heuristics stood in for an unreachable LanguageTool; don't cache this report
+        report["degraded"] = True
+        report["grammar_fallback"] = True
 
-    colloc = detect_collocation_issues(student_translation)
+    with perf.timer("detector_seconds", detector="collocation"):
+        colloc = detect_collocation_issues(student_translation)
     report["collocation_flags"] = colloc
+    if student_translation and DETECTORS["collocation"].configured() and DETECTORS["collocation"].value is None:
+        report["degraded"] = True
 
     # priority ordering: semantic > idiom > grammar > collocation
     priority = []
@@ -243,19 +513,24 @@ def suggest_activities_from_report(report):
     return suggestions_sorted
 
 # metrics_utils.py
-import plotly.graph_objects as go
 
 def compute_bleu_chrf(src, tgt):
-    # Dummy implementation
-    return 70.0, 65.0
+    """Sentence BLEU and chrF (0..100) of translation src against reference tgt."""
+    import translation_metrics  # deferred like plotly below: keeps numpy out of the import path
+    scores = translation_metrics.score_batch([src], [tgt])
+    return float(scores["bleu"][0]), float(scores["chrf"][0])
 
 def compute_semantic_score(src, tgt):
-    return 80.0
+    return semantic_similarity_score(src, tgt)
 
 def compute_edits_effort(mt, post_edit):
-    return 5.0, 20.0
+    """(TER, character edit rate), both 0..100+, for turning mt into post_edit."""
+    import translation_metrics
+    scores = translation_metrics.score_batch([mt], [post_edit])
+    return float(scores["ter"][0]), float(scores["char_edit_rate"][0])
 
 def plot_radar_for_student_metrics(metrics):
+    import plotly.graph_objects as go  # deferred: plotly is slow to import and only the dashboard needs it
     fig = go.Figure()
     categories = list(metrics.keys())
     values = list(metrics.values())
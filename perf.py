@@ -0,0 +1,320 @@
+# perf.py
+"""
+Timing histograms, counters and profile captures for the analysis pipeline.
+
+Everything is off unless PERF_METRICS=1. When it is off:
+  * timed() returns the function it decorates unchanged;
+  * timer() and profiled() return one shared no-op context manager;
+  * incr() and observe() return after a single flag check.
+
+When on, metrics accumulate per process in Prometheus-style histograms (fixed
+buckets, in seconds) and counters, keyed by name and labels. They can be read
+three ways:
+  * snapshot(), which the instructor "Performance" panel shows;
+  * prometheus_text(), the text exposition format;
+  * GET /metrics on PERF_METRICS_PORT, if that is set.
+
+register_collector(fn) adds gauges that are read at dump time, such as cache
+sizes and hit rates kept elsewhere, so the hot path does no extra work for them.
+
+With PERF_PROFILE_DIR set, profiled(name) blocks run under cProfile and write
+<dir>/<name>-<pid>-<n>.prof, for pstats or snakeviz. For sampling profilers
+(py-spy record --pid <worker pid>), the work runs in plainly named functions:
+_analyze_chunk, classify_translation_issues_batch, _build_report.
+"""
+import os
+import time
+import bisect
+import functools
+import threading
+import contextlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PERF_ENABLED = os.environ.get("PERF_METRICS", "").lower() in ("1", "true", "yes", "on")
+PERF_METRICS_PORT = int(os.environ.get("PERF_METRICS_PORT", "0") or 0)
+PERF_PROFILE_DIR = os.environ.get("PERF_PROFILE_DIR", "")
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_NULL = contextlib.nullcontext()
+_lock = threading.Lock()
+_histograms = {}   # (name, labels) -> [bucket counts..., +Inf count], sum
+_counters = {}     # (name, labels) -> value
+_collectors = []
+_profile_seq = 0
+
+
+def enabled():
+    return PERF_ENABLED
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    """Record one duration in the histogram `name`."""
+    if not PERF_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+        hist[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+        hist[1] += seconds
+
+
+def incr(name, value=1, **labels):
+    if not PERF_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "t0")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.t0, **self.labels)
+
+
+def timer(name, **labels):
+    """Context manager timing its block into histogram `name`."""
+    if not PERF_ENABLED:
+        return _NULL
+    return _Timer(name, labels)
+
+
+def timed(name, rows=None, **labels):
+    """
+    Decorator timing every call into histogram `name`. With rows="<counter>", the length
+    of each list or dict result is added to that counter. A no-op when disabled.
+    """
+    def decorate(fn):
+        if not PERF_ENABLED:
+            return fn
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - t0, **labels)
+            if rows and isinstance(result, (list, dict)):
+                incr(rows, len(result), **labels)
+            return result
+        return wrapper
+    return decorate
+
+
+def register_collector(fn):
+    """fn() -> {(name, labels_tuple) or name: value} gauges, read on each dump."""
+    if fn not in _collectors:
+        _collectors.append(fn)
+    return fn
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def drain():
+    """Take (and clear) this process's histograms and counters, e.g. to ship them to a parent process."""
+    with _lock:
+        state = {"histograms": {k: (list(v[0]), v[1]) for k, v in _histograms.items()},
+                 "counters": dict(_counters)}
+        _histograms.clear()
+        _counters.clear()
+    return state
+
+
+def merge(state):
+    """Add a drain() result from another process into this one."""
+    if not PERF_ENABLED or not state:
+        return
+    with _lock:
+        for key, (buckets, total) in state["histograms"].items():
+            hist = _histograms.get(key)
+            if hist is None:
+                hist = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+            hist[0] = [a + b for a, b in zip(hist[0], buckets)]
+            hist[1] += total
+        for key, value in state["counters"].items():
+            _counters[key] = _counters.get(key, 0) + value
+
+
+def _gauges():
+    gauges = {}
+    for fn in list(_collectors):
+        try:
+            for k, v in (fn() or {}).items():
+                gauges[k if isinstance(k, tuple) else (k, ())] = v
+        except Exception:
+            continue
+    return gauges
+
+
+def _quantile(buckets, count, q):
+    """Upper bucket bound containing quantile q (like histogram_quantile, without interpolation)."""
+    if not count:
+        return None
+    target = q * count
+    seen = 0
+    for bound, n in zip(BUCKETS + (float("inf"),), buckets):
+        seen += n
+        if seen >= target:
+            return bound
+    return float("inf")
+
+
+def snapshot():
+    """{"histograms": [...], "counters": [...], "gauges": [...]} rows for display."""
+    with _lock:
+        hists = {k: (list(v[0]), v[1]) for k, v in _histograms.items()}
+        counters = dict(_counters)
+    rows = []
+    for (name, labels), (buckets, total) in sorted(hists.items()):
+        count = sum(buckets)
+        rows.append({"metric": name, **dict(labels), "count": count,
+                     "mean_ms": round(1000.0 * total / count, 3) if count else None,
+                     "p50_ms_le": _ms(_quantile(buckets, count, 0.5)),
+                     "p95_ms_le": _ms(_quantile(buckets, count, 0.95)),
+                     "total_s": round(total, 3)})
+    return {
+        "histograms": rows,
+        "counters": [{"metric": name, **dict(labels), "value": value}
+                     for (name, labels), value in sorted(counters.items())],
+        "gauges": [{"metric": name, **dict(labels), "value": value}
+                   for (name, labels), value in sorted(_gauges().items())],
+    }
+
+
+def _ms(bound):
+    return None if bound is None else (round(bound * 1000.0, 3) if bound != float("inf") else "inf")
+
+
+def _labels_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+
+def prometheus_text(prefix="tutor_"):
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        hists = {k: (list(v[0]), v[1]) for k, v in _histograms.items()}
+        counters = dict(_counters)
+    lines = []
+    typed = set()
+    for (name, labels), (buckets, total) in sorted(hists.items()):
+        metric = prefix + name
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} histogram")
+            typed.add(metric)
+        cumulative = 0
+        for bound, n in zip(BUCKETS + ("+Inf",), buckets):
+            cumulative += n
+            lines.append(f"{metric}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{metric}_sum{_labels_text(labels)} {total}")
+        lines.append(f"{metric}_count{_labels_text(labels)} {cumulative}")
+    for kind, values in (("counter", counters), ("gauge", _gauges())):
+        for (name, labels), value in sorted(values.items()):
+            metric = prefix + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} {kind}")
+                typed.add(metric)
+            lines.append(f"{metric}{_labels_text(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- profile capture ----------
+@contextlib.contextmanager
+def _profile_block(name):
+    global _profile_seq
+    import cProfile
+    with _lock:
+        _profile_seq += 1
+        seq = _profile_seq
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield prof
+    finally:
+        prof.disable()
+        try:
+            os.makedirs(PERF_PROFILE_DIR, exist_ok=True)
+            prof.dump_stats(os.path.join(PERF_PROFILE_DIR, f"{name}-{os.getpid()}-{seq}.prof"))
+        except OSError:
+            pass
+
+
+def profiled(name):
+    """Run the block under cProfile when PERF_PROFILE_DIR is set; a no-op otherwise."""
+    if not PERF_PROFILE_DIR:
+        return _NULL
+    return _profile_block(name)
+
+
+def profile_captures(limit=20):
+    """Newest-first paths of captured .prof files."""
+    if not PERF_PROFILE_DIR or not os.path.isdir(PERF_PROFILE_DIR):
+        return []
+    paths = [os.path.join(PERF_PROFILE_DIR, f) for f in os.listdir(PERF_PROFILE_DIR) if f.endswith(".prof")]
+    return sorted(paths, key=os.path.getmtime, reverse=True)[:limit]
+
+
+def profile_summary(path, top=15, sort="cumulative"):
+    """pstats text of the top functions in a capture."""
+    import io
+    import pstats
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).strip_dirs().sort_stats(sort).print_stats(top)
+    return out.getvalue()
+
+
+# ---------- /metrics endpoint ----------
+_server = None
+
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """Serve prometheus_text() on http://host:port/metrics (once per process)."""
+    global _server
+    port = PERF_METRICS_PORT if port is None else port
+    if not PERF_ENABLED or not port or _server is not None:
+        return _server
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        _server = ThreadingHTTPServer((host, port), Handler)
+    except OSError:
+        return None   # another process on this host already serves the port
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="perf-metrics", daemon=True).start()
+    return _server
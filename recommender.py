@@ -0,0 +1,224 @@
+# recommender.py
+"""
+Practice recommendations drawn from the existing practice_bank.
+
+Every practice_bank prompt is embedded once, into unit-row float32 matrices held
+in this process, one per category. A query is one matrix-vector product over its
+category plus argpartition for the top k. At 50k items that takes a few
+milliseconds, so there is no approximate index (see
+benchmarks/bench_recommender.py). The index is incremental: refresh() only embeds
+rows with an id above the last one it has seen, and appends them into spare
+capacity. It runs when this process
+has added items (db_utils.data_generation("practice_bank")), and otherwise at
+most every REFRESH_INTERVAL seconds, to pick up other processes' items.
+
+Embeddings come from the sentence-transformer when the semantic detector is
+already loaded; they go through the shared embedding cache, so prompts are not
+re-encoded across processes or restarts. Until then, and on installs without
+the model, hashed character trigrams stand in. Recommendations never wait for a
+model load. When the backend changes, the next refresh re-embeds the whole bank.
+
+recommend(report) turns each issue into a query, namely the template activity
+from metrics_utils.suggest_activities_from_report, and returns the k most
+similar items of that category that are not already in the student's queue.
+add_suggestion() reuses the closest item when one is a near duplicate, and only
+creates a new practice_bank row when none is.
+"""
+import time
+import zlib
+import threading
+
+import numpy as np
+
+import db_utils
+import metrics_utils
+import perf
+
+REFRESH_INTERVAL = 30.0
+HASH_DIM = 512
+# Cosine thresholds per embedding backend: a match must reach RELEVANT to be recommended
+# and DUPLICATE to be reused instead of creating a new item.
+THRESHOLDS = {
+    "minilm": {"relevant": 0.45, "duplicate": 0.9},
+    "char-trigram": {"relevant": 0.3, "duplicate": 0.85},
+}
+
+
+def hashed_trigrams(texts, dim=HASH_DIM):
+    """Unit-length bag of character trigrams (crc32-hashed into dim buckets) per text."""
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        padded = f"  {' '.join((text or '').lower().split())} "
+        grams = [padded[j:j + 3] for j in range(len(padded) - 2)]
+        if grams:
+            np.add.at(out[i], [zlib.crc32(g.encode("utf-8")) % dim for g in grams], 1.0)
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    return out / np.maximum(norms, 1e-12)
+
+
+def _backend():
+    return "minilm" if metrics_utils.DETECTORS["semantic"].state == "ready" else "char-trigram"
+
+
+def embed(texts, backend):
+    if backend == "minilm":
+        vecs = metrics_utils.encode_texts(texts)
+        if vecs is not None:
+            return np.asarray(vecs, dtype=np.float32)
+    return hashed_trigrams(texts)
+
+
+class _Block:
+    """Rows of one category: ids, prompts and a unit-row matrix with spare capacity for appends."""
+    def __init__(self, dim):
+        self.n = 0
+        self.ids = np.zeros(64, dtype=np.int64)
+        self.matrix = np.zeros((64, dim), dtype=np.float32)
+        self.prompts = []
+
+    def append(self, ids, prompts, vecs):
+        need = self.n + len(ids)
+        if need > len(self.ids):
+            cap = max(need, 2 * len(self.ids))
+            self.ids = np.resize(self.ids, cap)
+            grown = np.zeros((cap, self.matrix.shape[1]), dtype=np.float32)
+            grown[:self.n] = self.matrix[:self.n]
+            self.matrix = grown
+        self.ids[self.n:need] = ids
+        self.matrix[self.n:need] = vecs
+        self.prompts += prompts
+        self.n = need
+
+    def search(self, qvecs, k, exclude_ids, min_score):
+        ids, matrix = self.ids[:self.n], self.matrix[:self.n]
+        scores = qvecs @ matrix.T
+        if exclude_ids:
+            scores[:, np.isin(ids, np.fromiter(exclude_ids, dtype=np.int64))] = -np.inf
+        top = min(k, self.n)
+        results = []
+        for row in scores:
+            best = np.argpartition(-row, top - 1)[:top] if top else []
+            results.append([(int(ids[j]), self.prompts[j], round(float(row[j]), 4))
+                            for j in best if row[j] >= min_score])
+        return results
+
+
+class PracticeIndex:
+    def __init__(self):
+        self.backend = None
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.blocks = {}   # category -> _Block
+        self.last_id = 0
+        self._generation = None
+        self._refreshed_at = 0.0
+
+    def __len__(self):
+        return sum(block.n for block in self.blocks.values())
+
+    def refresh(self, force=False):
+        """Embed practice_bank rows added since the last refresh; returns how many were added."""
+        backend = _backend()
+        generation = db_utils.data_generation("practice_bank")
+        with self._lock:
+            if backend != self.backend:
+                self._clear()
+                self.backend = backend
+                force = True
+            if not force and generation == self._generation and \
+                    time.monotonic() - self._refreshed_at < REFRESH_INTERVAL:
+                return 0
+            self._generation = generation
+            self._refreshed_at = time.monotonic()
+            added = 0
+            with perf.timer("recommender_refresh_seconds"):
+                while True:
+                    rows = db_utils.get_practice_items_after(self.last_id)
+                    if not rows:
+                        break
+                    vecs = embed([r["prompt"] or "" for r in rows], backend)
+                    by_category = {}
+                    for i, r in enumerate(rows):
+                        by_category.setdefault(r["category"], []).append(i)
+                    for category, rows_idx in by_category.items():
+                        block = self.blocks.get(category)
+                        if block is None:
+                            block = self.blocks[category] = _Block(vecs.shape[1])
+                        block.append([rows[i]["id"] for i in rows_idx], [rows[i]["prompt"] for i in rows_idx],
+                                     vecs[rows_idx])
+                    self.last_id = rows[-1]["id"]
+                    added += len(rows)
+            return added
+
+    def search(self, queries, k=3, category=None, exclude_ids=(), min_score=None):
+        """For each query text, up to k [(id, prompt, score)] best first, optionally within one category."""
+        self.refresh()
+        queries = list(queries)
+        # Appends happen under the lock, so searching a consistent snapshot needs it too.
+        with self._lock, perf.timer("recommender_search_seconds"):
+            blocks = [self.blocks[category]] if category in self.blocks else \
+                ([] if category is not None else list(self.blocks.values()))
+            if not blocks or not queries:
+                return [[] for _ in queries]
+            min_score = THRESHOLDS[self.backend]["relevant"] if min_score is None else min_score
+            qvecs = embed(queries, self.backend)
+            merged = [[] for _ in queries]
+            for block in blocks:
+                for found, hits in zip(merged, block.search(qvecs, k, exclude_ids, min_score)):
+                    found += hits
+        return [sorted(found, key=lambda hit: -hit[2])[:k] for found in merged]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PracticeIndex()
+        return _index
+
+
+def recommend(report, username=None, k=3):
+    """
+    metrics_utils.suggest_activities_from_report suggestions for a db_utils report, each
+    with "category", "prompt" (the template activity) and "matches": up to k existing
+    practice items [{"id", "prompt", "score"}] of that category not already in the user's queue.
+    """
+    rep = dict(report)
+    rep.setdefault("grammar_matches", report.get("grammar") or [])
+    suggestions = metrics_utils.suggest_activities_from_report(rep)
+    queued = db_utils.get_assigned_practice_ids(username) if username else set()
+    index = get_index()
+    out = []
+    for s in suggestions:
+        activity = s.get("activity") or {}
+        category = activity.get("category")
+        prompt = activity.get("prompt") or ""
+        matches = []
+        if category and prompt:
+            matches = [{"id": pid, "prompt": text, "score": score}
+                       for pid, text, score in index.search([prompt], k, category, queued)[0]]
+        out.append({"type": s["type"], "short": s.get("short"), "long": s.get("long"),
+                    "category": category, "prompt": prompt, "matches": matches})
+    return out
+
+
+def add_suggestion(username, suggestion, due_date=None):
+    """
+    Put a suggestion's activity in the user's queue: the closest existing item if it is a
+    near duplicate, otherwise a new practice_bank item. Returns (practice_id, inserted).
+    """
+    index = get_index()
+    found = index.search([suggestion["prompt"]], 1, suggestion["category"],
+                         min_score=THRESHOLDS[index.backend or _backend()]["duplicate"])[0]
+    if found:
+        practice_id = found[0][0]
+    else:
+        practice_id = db_utils.add_practice_item(suggestion["category"], suggestion["prompt"], "")
+    result = db_utils.assign_practices_to_user(username, [practice_id], due_date=due_date)
+    return practice_id, result["inserted"] > 0
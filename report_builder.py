@@ -0,0 +1,176 @@
+# report_builder.py
+"""
+Instructor PDF reports for a class or a single student.
+
+The figures come from the issue aggregates that db_utils keeps up to date at
+analysis time: get_error_distribution, get_top_missed_idioms and
+get_error_distribution_by_student. Building a report runs a few GROUP BY queries
+and analyzes nothing. The chart is a vector reportlab Drawing rather than a
+pyplot PNG, so there is no global figure state shared between Streamlit sessions
+and nothing to leak on errors.
+
+render_reports() renders many reports in a process pool, e.g. one per student at
+the end of term:
+
+    python report_builder.py --db app.db --out reports/ --class --students all --workers 4
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib import colors
+from reportlab.graphics.shapes import Drawing, String
+from reportlab.graphics.charts.barcharts import VerticalBarChart
+
+import db_utils
+import perf
+
+TOP_IDIOMS = 5
+MIN_JOBS_PER_WORKER = 50
+BAR_COLOR = colors.HexColor("#4C72B0")
+_HEADER_STYLE = [("BACKGROUND", (0, 0), (-1, 0), colors.grey),
+                 ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+                 ("GRID", (0, 0), (-1, -1), 1, colors.black)]
+
+
+def bar_chart(counts, title="Error Distribution", width=400, height=200):
+    drawing = Drawing(width, height)
+    chart = VerticalBarChart()
+    chart.x, chart.y = 45, 30
+    chart.width, chart.height = width - 70, height - 60
+    chart.data = [list(counts.values()) or [0]]
+    chart.categoryAxis.categoryNames = list(counts) or [""]
+    chart.valueAxis.valueMin = 0
+    chart.valueAxis.valueMax = max(list(counts.values()) + [1]) * 1.15
+    chart.bars[0].fillColor = BAR_COLOR
+    drawing.add(chart)
+    drawing.add(String(width / 2, height - 15, title, textAnchor="middle", fontSize=12))
+    return drawing
+
+
+def _scope_text(username, start, end, target_lang):
+    parts = [f"Student: {username}" if username else "Whole class"]
+    if start or end:
+        parts.append(f"{start or '…'} to {end or '…'}")
+    if target_lang:
+        parts.append(f"language: {target_lang}")
+    return " · ".join(parts)
+
+
+@perf.timed("pdf_build_seconds")
+def build_report(target, username=None, start=None, end=None, target_lang=None, title=None):
+    """Write a report PDF to target (path or binary file object); returns target."""
+    filters = {"username": username, "start": start, "end": end, "target_lang": target_lang}
+    error_counts = db_utils.get_error_distribution(**filters)
+    idiom_misses = db_utils.get_top_missed_idioms(TOP_IDIOMS, **filters)
+    n_submissions = db_utils.count_submissions(**filters)
+
+    styles = getSampleStyleSheet()
+    elements = [
+        Paragraph(title or ("Student Report" if username else "Instructor Report"), styles["Title"]),
+        Paragraph(_scope_text(username, start, end, target_lang), styles["Normal"]),
+        Paragraph(f"Submissions: {n_submissions} · generated {datetime.date.today().isoformat()}",
+                  styles["Normal"]),
+        Spacer(1, 12),
+        Paragraph("Error Distribution:", styles["Heading2"]),
+    ]
+    table = Table([["Error Type", "Count"]] + [[k, v] for k, v in error_counts.items()])
+    table.setStyle(TableStyle(_HEADER_STYLE))
+    elements += [table, Spacer(1, 12), bar_chart(error_counts), Spacer(1, 12)]
+
+    if idiom_misses:
+        elements.append(Paragraph("Most Frequently Mistranslated Idioms:", styles["Heading2"]))
+        idiom_table = Table([["Idiom", "Miss Count"]] + [list(row) for row in idiom_misses])
+        idiom_table.setStyle(TableStyle([("GRID", (0, 0), (-1, -1), 1, colors.black)]))
+        elements += [idiom_table, Spacer(1, 12)]
+
+    if not username:
+        by_student = db_utils.get_error_distribution_by_student(start, end, target_lang)
+        if by_student:
+            elements.append(Paragraph("Errors by Student:", styles["Heading2"]))
+            rows = [["Student"] + list(db_utils.ISSUE_TYPES)]
+            rows += [[u] + [counts[t] for t in db_utils.ISSUE_TYPES] for u, counts in by_student.items()]
+            student_table = Table(rows, repeatRows=1)
+            student_table.setStyle(TableStyle(_HEADER_STYLE))
+            elements.append(student_table)
+
+    SimpleDocTemplate(target, pagesize=A4, title=title or "Instructor Report").build(elements)
+    return target
+
+
+# ---------- batch rendering ----------
+def report_filename(username=None):
+    if not username:
+        return "class_report.pdf"
+    return re.sub(r"[^\w.-]", "_", username) + ".pdf"
+
+
+def _init_worker(db_file):
+    db_utils.DB_FILE = db_file
+
+
+def _render_one(out_dir, job):
+    path = os.path.join(out_dir, report_filename(job.get("username")))
+    build_report(path, **job)
+    return path
+
+
+def render_reports(jobs, out_dir, workers=None, db_file=None):
+    """
+    Render one PDF per job ({"username", "start", "end", "target_lang"}, all optional)
+    into out_dir; returns the paths in job order. workers=0 (or a small batch) renders
+    in this process.
+    """
+    jobs = list(jobs)
+    os.makedirs(out_dir, exist_ok=True)
+    db_file = db_file or db_utils.DB_FILE
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # A spawned worker costs ~0.5 s of imports; below MIN_JOBS_PER_WORKER reports each it doesn't pay off.
+    workers = min(workers, len(jobs) // MIN_JOBS_PER_WORKER)
+    if workers <= 1:
+        return [_render_one(out_dir, job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_file,),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(_render_one, [out_dir] * len(jobs), jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render class and per-student PDF reports.")
+    parser.add_argument("--db", default=db_utils.DB_FILE)
+    parser.add_argument("--out", default="reports")
+    parser.add_argument("--class", dest="class_report", action="store_true", help="render the class report")
+    parser.add_argument("--students", nargs="*", default=[], help="usernames, or 'all' for every student")
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--lang")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    db_utils.DB_FILE = args.db
+    students = args.students
+    if students == ["all"]:
+        students = [u["username"] for u in db_utils.get_all_users() if u["role"] == "Student"]
+    filters = {"start": args.start, "end": args.end, "target_lang": args.lang}
+    jobs = ([{"username": None, **filters}] if args.class_report else []) + \
+           [{"username": u, **filters} for u in students]
+    if not jobs:
+        parser.error("nothing to render: pass --class and/or --students")
+    t0 = time.perf_counter()
+    paths = render_reports(jobs, args.out, workers=args.workers, db_file=args.db)
+    elapsed = time.perf_counter() - t0
+    print(f"rendered {len(paths)} report(s) into {args.out} in {elapsed:.1f} s "
+          f"({1000.0 * elapsed / len(paths):.1f} ms/report)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
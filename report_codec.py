@@ -0,0 +1,359 @@
+# report_codec.py
+"""
+Compact binary encoding of analysis reports, and a slotted in-memory report.
+
+JSON reports spell out every key, idiom, status, grammar message and replacement
+each time they are stored. Here all strings are replaced by integer ids from a
+string table (db_utils keeps it in report_strings, so ids are shared by every
+process), and numbers are fixed width:
+
+    header   <BBdHHHH   format version, flags, semantic_score,
+                        counts of idiom issues, grammar matches, collocations, segments
+    idioms   <III       idiom, status, expected (string ids; 0 = None)     per issue
+    grammar  <IiiB      message, offset, length (-1 = absent), #replacements per match,
+             <I         each replacement
+    colloc   <I         per flagged bigram
+    segments <iiiidB    source start/end, translation start/end (-1 = None),
+                        semantic_score, semantic_flag                       per segment
+    extras   JSON       (FLAG_EXTRAS) keys or values this layout cannot express
+
+Idioms are stored as the phrase and rendering strings the analysis saw, not as
+ids from db_utils' idioms table. That table is replaced on re-import (ids can be
+reassigned, rows deleted, renderings edited), while a stored report must still
+decode to what it said when it was made: exports and the student page serve
+reports of earlier idiom versions until they are purged. report_strings is
+append-only, so its ids never change meaning.
+
+priority is not stored: it is always derived from the other fields in the fixed
+order semantic > idiom > grammar > collocation. A report whose priority differs
+keeps it in extras. Anything else unusual (an idiom entry or grammar match with
+extra keys, a non-numeric score) also goes into extras, so decode(encode(r))
+always equals r.
+
+Report is the decoded form: one object with __slots__, where idiom issues,
+matches and collocations are tuples of strings taken from the shared table, and
+segments are arrays. It is a read-only Mapping with the same keys as the
+report dict, so report.get("idiom_issues") and dict(report) keep working. The
+nested dicts are built only when a key is read. benchmarks/bench_report_codec.py
+compares size and speed with JSON.
+"""
+import json
+import struct
+from array import array
+from collections.abc import Mapping
+
+FORMAT_VERSION = 1
+FLAG_SEMANTIC = 1
+FLAG_DEGRADED = 2
+FLAG_GRAMMAR_MATCHES = 4   # matches stored under "grammar_matches" (metrics_utils) rather than "grammar" (db_utils)
+FLAG_SEGMENTS = 8
+FLAG_EXTRAS = 16
+
+_HEADER = struct.Struct("<BBdHHHH")
+_IDIOM = struct.Struct("<III")
+_MATCH = struct.Struct("<IiiB")
+_SEGMENT = struct.Struct("<iiiidB")
+_PRIORITY_ORDER = ("semantic", "idiom", "grammar", "collocation")
+_KNOWN_KEYS = {"semantic_score", "semantic_flag", "idiom_issues", "grammar", "grammar_matches",
+               "collocation_flags", "priority", "degraded", "segments"}
+_IDIOM_KEYS = {"status", "expected"}
+_MATCH_KEYS = {"message", "replacements", "offset", "length"}
+_SEGMENT_KEYS = {"source", "translation", "semantic_score", "semantic_flag"}
+_MAX_COUNT = 0xFFFF
+_MAX_INT = 2 ** 31 - 1
+
+
+class Report(Mapping):
+    """A decoded report; reads like the report dict it was made from."""
+    __slots__ = ("semantic_score", "flags", "idioms", "matches", "collocations", "spans", "scores",
+                 "segment_flags", "extras")
+
+    def __init__(self, semantic_score=0.0, flags=0, idioms=(), matches=(), collocations=(),
+                 spans=None, scores=None, segment_flags=None, extras=None):
+        self.semantic_score = semantic_score
+        self.flags = flags
+        self.idioms = idioms                # ((idiom, status, expected), ...)
+        self.matches = matches              # ((message, offset, length, (replacement, ...)), ...); None = absent
+        self.collocations = collocations    # (bigram, ...)
+        self.spans = spans                  # array("i"), 4 per segment: source and translation span, -1 = None
+        self.scores = scores                # array("d"), semantic score per segment
+        self.segment_flags = segment_flags  # bytes, semantic flag per segment
+        self.extras = extras                # {key: value} for keys the fields above cannot hold
+
+    @property
+    def grammar_key(self):
+        return "grammar_matches" if self.flags & FLAG_GRAMMAR_MATCHES else "grammar"
+
+    def _keys(self):
+        keys = ["semantic_score", "semantic_flag", "idiom_issues", self.grammar_key, "collocation_flags",
+                "priority"]
+        if self.flags & FLAG_DEGRADED:
+            keys.append("degraded")
+        if self.flags & FLAG_SEGMENTS:
+            keys.append("segments")
+        if self.extras:
+            keys += [k for k in self.extras if k not in keys]
+        return keys
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __contains__(self, key):
+        return key in self._keys()
+
+    def __getitem__(self, key):
+        if self.extras and key in self.extras:
+            return self.extras[key]
+        if key == "semantic_score":
+            return self.semantic_score
+        if key == "semantic_flag":
+            return bool(self.flags & FLAG_SEMANTIC)
+        if key == "idiom_issues":
+            return {idiom: {"status": status, "expected": expected} for idiom, status, expected in self.idioms}
+        if key == self.grammar_key:
+            return [_match_dict(m) for m in self.matches]
+        if key == "collocation_flags":
+            return list(self.collocations)
+        if key == "priority":
+            return _priority(self.flags & FLAG_SEMANTIC, self.idioms, self.matches, self.collocations)
+        if key == "degraded" and self.flags & FLAG_DEGRADED:
+            return True
+        if key == "segments" and self.flags & FLAG_SEGMENTS:
+            return [_segment_dict(self.spans[4 * i:4 * i + 4], score, bool(flag))
+                    for i, (score, flag) in enumerate(zip(self.scores, self.segment_flags))]
+        raise KeyError(key)
+
+    def to_dict(self):
+        return {key: self[key] for key in self._keys()}
+
+    def __repr__(self):
+        return f"Report({self.to_dict()!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, Mapping) and self.to_dict() == dict(other)
+
+    __hash__ = None
+
+    def strings(self):
+        """Every string the encoding refers to by id."""
+        out = set()
+        for idiom, status, expected in self.idioms:
+            out.update((idiom, status))
+            if expected is not None:
+                out.add(expected)
+        for message, _offset, _length, replacements in self.matches:
+            out.add(message)
+            out.update(replacements)
+        out.update(self.collocations)
+        return out
+
+    @classmethod
+    def from_dict(cls, report):
+        """The Report holding a report dict; parts the fixed layout cannot express go to extras."""
+        if isinstance(report, Report):
+            return report
+        extras = {k: v for k, v in report.items() if k not in _KNOWN_KEYS}
+        flags = 0
+        score = report.get("semantic_score")
+        if isinstance(score, float):
+            semantic_score = score
+        else:
+            semantic_score = 0.0
+            extras["semantic_score"] = score
+        flag = report.get("semantic_flag")
+        if flag is True:
+            flags |= FLAG_SEMANTIC
+        elif flag is not False:
+            extras["semantic_flag"] = flag
+        if report.get("degraded") is True:
+            flags |= FLAG_DEGRADED
+        elif "degraded" in report:
+            extras["degraded"] = report["degraded"]
+
+        issues = report.get("idiom_issues")
+        idioms = _pack_idioms(issues) if type(issues) is dict and len(issues) <= _MAX_COUNT else None
+        if idioms is None:
+            idioms = ()
+            extras["idiom_issues"] = issues
+
+        key = "grammar_matches" if "grammar_matches" in report else "grammar"
+        if key == "grammar_matches":
+            flags |= FLAG_GRAMMAR_MATCHES
+        gram = report.get(key)
+        matches = _pack_matches(gram) if type(gram) is list and len(gram) <= _MAX_COUNT else None
+        if matches is None:
+            matches = ()
+            extras[key] = gram
+
+        collocations = ()
+        colloc = report.get("collocation_flags")
+        if isinstance(colloc, list) and len(colloc) <= _MAX_COUNT and all(isinstance(c, str) for c in colloc):
+            collocations = tuple(colloc)
+        else:
+            extras["collocation_flags"] = colloc
+
+        if report.get("priority") != _priority(flags & FLAG_SEMANTIC, idioms, matches, collocations):
+            extras["priority"] = report.get("priority")
+
+        spans = scores = segment_flags = None
+        if "segments" in report:
+            segments = report["segments"]
+            packed = _pack_segments(segments) if type(segments) is list and len(segments) <= _MAX_COUNT else None
+            if packed is not None:
+                flags |= FLAG_SEGMENTS
+                spans, scores, segment_flags = packed
+            else:
+                extras["segments"] = segments
+        return cls(semantic_score, flags, idioms, matches, collocations, spans, scores, segment_flags,
+                   extras or None)
+
+
+def _pack_idioms(issues):
+    """((idiom, status, expected), ...) for plain idiom_issues, or None if an entry is not plain."""
+    out = []
+    for idiom, info in issues.items():
+        if type(info) is not dict or info.keys() != _IDIOM_KEYS:
+            return None
+        status, expected = info["status"], info["expected"]
+        if type(idiom) is not str or type(status) is not str or (expected is not None and type(expected) is not str):
+            return None
+        out.append((idiom, status, expected))
+    return tuple(out)
+
+
+def _plain_int(value):
+    return value is None or (type(value) is int and 0 <= value <= _MAX_INT)
+
+
+def _pack_matches(gram):
+    """((message, offset, length, replacements), ...) for plain grammar matches, or None if one is not plain."""
+    out = []
+    for m in gram:
+        if type(m) is not dict or not m.keys() <= _MATCH_KEYS:
+            return None
+        message, replacements = m.get("message"), m.get("replacements")
+        offset, length = m.get("offset"), m.get("length")
+        if type(message) is not str or type(replacements) is not list or len(replacements) > 255 or \
+                not _plain_int(offset) or not _plain_int(length):
+            return None
+        for rep in replacements:
+            if type(rep) is not str:
+                return None
+        out.append((message, offset, length, tuple(replacements)))
+    return tuple(out)
+
+
+def _plain_span(v):
+    return v is None or (type(v) is list and len(v) == 2 and type(v[0]) is int and type(v[1]) is int and
+                         0 <= v[0] <= _MAX_INT and 0 <= v[1] <= _MAX_INT)
+
+
+def _pack_segments(segments):
+    """(spans, scores, flags) for a list of plain segment dicts, or None if one is not plain."""
+    spans, scores, flags = array("i"), array("d"), bytearray()
+    for s in segments:
+        if type(s) is not dict or s.keys() != _SEGMENT_KEYS:
+            return None
+        source, translation, score, flag = s["source"], s["translation"], s["semantic_score"], s["semantic_flag"]
+        if type(score) is not float or (flag is not True and flag is not False) or \
+                not _plain_span(source) or not _plain_span(translation):
+            return None
+        spans.extend(source or (-1, -1))
+        spans.extend(translation or (-1, -1))
+        scores.append(score)
+        flags.append(flag)
+    return spans, scores, bytes(flags)
+
+
+def _match_dict(m):
+    message, offset, length, replacements = m
+    d = {"message": message, "replacements": list(replacements)}
+    if offset is not None:
+        d["offset"] = offset
+    if length is not None:
+        d["length"] = length
+    return d
+
+
+def _segment_dict(span, score, flag):
+    return {"source": [span[0], span[1]] if span[0] >= 0 else None,
+            "translation": [span[2], span[3]] if span[2] >= 0 else None,
+            "semantic_score": score, "semantic_flag": flag}
+
+
+def _priority(semantic, idioms, matches, collocations):
+    return [name for name, present in zip(_PRIORITY_ORDER, (semantic, idioms, matches, collocations)) if present]
+
+
+def encode(report, ids):
+    """
+    Bytes for a report dict or Report. ids maps each of Report.strings() to its id (> 0);
+    see db_utils.encode_reports for the shared table.
+    """
+    rep = Report.from_dict(report)
+    flags = rep.flags | (FLAG_EXTRAS if rep.extras else 0)
+    n_segments = len(rep.scores) if rep.scores is not None else 0
+    fmt = [_HEADER.format.lstrip("<")]
+    values = [FORMAT_VERSION, flags, rep.semantic_score, len(rep.idioms), len(rep.matches),
+              len(rep.collocations), n_segments]
+    for idiom, status, expected in rep.idioms:
+        fmt.append("III")
+        values += (ids[idiom], ids[status], 0 if expected is None else ids[expected])
+    for message, offset, length, replacements in rep.matches:
+        fmt.append(f"IiiB{len(replacements)}I")
+        values += (ids[message], -1 if offset is None else offset, -1 if length is None else length,
+                   len(replacements))
+        values += [ids[r] for r in replacements]
+    if rep.collocations:
+        fmt.append(f"{len(rep.collocations)}I")
+        values += [ids[c] for c in rep.collocations]
+    for i in range(n_segments):
+        fmt.append("iiiidB")
+        values += rep.spans[4 * i:4 * i + 4]
+        values += (rep.scores[i], rep.segment_flags[i])
+    blob = struct.pack("<" + "".join(fmt), *values)
+    if rep.extras:
+        blob += json.dumps(rep.extras, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return blob
+
+
+def decode(blob, texts):
+    """
+    The Report for bytes from encode(). texts[id] is the string with that id; an id beyond
+    the end of texts raises IndexError (the caller reloads its table and retries).
+    """
+    version, flags, score, n_idioms, n_matches, n_colloc, n_segments = _HEADER.unpack_from(blob, 0)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"unknown report format version: {version}")
+    pos = _HEADER.size
+    idioms = []
+    for _ in range(n_idioms):
+        idiom, status, expected = _IDIOM.unpack_from(blob, pos)
+        pos += _IDIOM.size
+        idioms.append((texts[idiom], texts[status], texts[expected] if expected else None))
+    matches = []
+    for _ in range(n_matches):
+        message, offset, length, n_repl = _MATCH.unpack_from(blob, pos)
+        pos += _MATCH.size
+        repl = struct.unpack_from(f"<{n_repl}I", blob, pos)
+        pos += 4 * n_repl
+        matches.append((texts[message], None if offset < 0 else offset, None if length < 0 else length,
+                        tuple(texts[r] for r in repl)))
+    colloc = struct.unpack_from(f"<{n_colloc}I", blob, pos)
+    pos += 4 * n_colloc
+    spans = scores = segment_flags = None
+    if flags & FLAG_SEGMENTS:
+        spans, scores, seg_flags = array("i"), array("d"), bytearray()
+        for _ in range(n_segments):
+            a, b, c, d, seg_score, seg_flag = _SEGMENT.unpack_from(blob, pos)
+            pos += _SEGMENT.size
+            spans.extend((a, b, c, d))
+            scores.append(seg_score)
+            seg_flags.append(seg_flag)
+        segment_flags = bytes(seg_flags)
+    extras = json.loads(blob[pos:].decode("utf-8")) if flags & FLAG_EXTRAS else None
+    return Report(score, flags & ~FLAG_EXTRAS, tuple(idioms), tuple(matches), tuple(texts[c] for c in colloc),
+                  spans, scores, segment_flags, extras)
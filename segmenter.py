@@ -0,0 +1,217 @@
+# segmenter.py
+"""
+Sentence-level analysis of long translations.
+
+A submission is split into sentences on both sides, and the translation's
+sentences are aligned to the reference (or, without one, to the source). The
+alignment is a Gale-Church-style dynamic program over character lengths with
+1-1, 1-2, 2-1, 1-0 and 0-1 beads. Each aligned segment is analyzed on its own,
+which gives:
+  * the semantic model sees one sentence at a time rather than a long text that
+    MiniLM would silently truncate, and a meaning change is pinned to its sentence;
+  * LanguageTool's per-text match cap (grammar_service.MAX_MATCHES) applies per
+    sentence, so long texts keep all their matches;
+  * segment reports are cached (in submission_reports, under the report version
+    plus db_utils.SEGMENT_VERSION_SUFFIX). A resubmission with one edited sentence only
+    analyzes that sentence.
+
+All segments of a batch of submissions go through one
+metrics_utils.classify_translation_issues_batch call: one embedding pass and
+pooled grammar requests. Idioms are still matched on the whole texts, since an
+idiom and its rendering may end up in different segments when the alignment
+merges or splits sentences, against db_utils.get_idioms(target_lang) unless a
+dictionary is passed in.
+
+merge_reports() rebuilds the usual report shape:
+  * semantic_score is the length-weighted mean of the segment scores;
+  * semantic_flag is set if any segment is flagged;
+  * grammar matches have their offsets shifted into the whole translation. The
+    heuristic checks that stand in for LanguageTool run once on the whole
+    translation instead of per segment, since splitting drops the whitespace and
+    run-on length between sentences that they look at;
+  * "segments" lists each segment's spans and semantic score.
+"""
+import re
+import math
+
+import db_utils
+import metrics_utils
+import perf
+
+# Penalties (in length-mismatch units) for beads other than 1-1.
+BEAD_PENALTIES = {(1, 1): 0.0, (1, 2): 2.0, (2, 1): 2.0, (1, 0): 4.5, (0, 1): 4.5}
+MAX_ALIGN_SENTENCES = 400   # beyond this the DP is skipped and the texts are paired as one segment
+
+_BOUNDARY = re.compile(r"([.!?؟…]+[\"'»”’)\]]*)(\s+)|\n\s*")
+_ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "st", "vs", "etc", "e.g", "i.e", "no", "fig", "jr", "sr"}
+
+
+def split_sentences(text):
+    """[(start, end)] spans of the sentences in text, without surrounding whitespace."""
+    text = text or ""
+    spans = []
+    start = 0
+    for m in _BOUNDARY.finditer(text):
+        if m.group(1):
+            if m.group(1) == ".":
+                word = text[start:m.start()].rsplit(None, 1)[-1:] or [""]
+                word = word[0].lower()
+                if word in _ABBREVIATIONS or (len(word) == 1 and word.isalpha()):
+                    continue
+            end = m.end(1)
+        else:
+            end = m.start()
+        _add_span(text, start, end, spans)
+        start = m.end()
+    _add_span(text, start, len(text), spans)
+    return spans
+
+
+def _add_span(text, start, end, spans):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if end > start:
+        spans.append((start, end))
+
+
+def align(left_lengths, right_lengths):
+    """
+    Beads [(left sentence indices, right sentence indices)] covering both sides in order,
+    minimizing length mismatch (Gale-Church style) plus BEAD_PENALTIES.
+    """
+    n, m = len(left_lengths), len(right_lengths)
+    total_left = sum(left_lengths) or 1
+    ratio = (sum(right_lengths) or 1) / total_left
+    inf = float("inf")
+    cost = [[inf] * (m + 1) for _ in range(n + 1)]
+    back = [[None] * (m + 1) for _ in range(n + 1)]
+    cost[0][0] = 0.0
+    for i in range(n + 1):
+        for j in range(m + 1):
+            here = cost[i][j]
+            if here == inf:
+                continue
+            for (a, b), penalty in BEAD_PENALTIES.items():
+                if i + a > n or j + b > m:
+                    continue
+                la = sum(left_lengths[i:i + a]) * ratio
+                lb = sum(right_lengths[j:j + b])
+                c = here + penalty + abs(la - lb) / math.sqrt(la + lb + 1.0)
+                if c < cost[i + a][j + b]:
+                    cost[i + a][j + b] = c
+                    back[i + a][j + b] = (a, b)
+    beads = []
+    i, j = n, m
+    while i or j:
+        a, b = back[i][j]
+        beads.append((list(range(i - a, i)), list(range(j - b, j))))
+        i, j = i - a, j - b
+    return beads[::-1]
+
+
+def segment_submission(left, translation):
+    """
+    Aligned segments of one submission: [(left_span, translation_span)], each span a
+    (start, end) into its text, or None when that side has no sentence in the bead.
+    """
+    left_spans, right_spans = split_sentences(left), split_sentences(translation)
+    if len(left_spans) <= 1 and len(right_spans) <= 1 or \
+            max(len(left_spans), len(right_spans)) > MAX_ALIGN_SENTENCES:
+        return [(_cover(left_spans), _cover(right_spans))]
+    beads = align([e - s for s, e in left_spans], [e - s for s, e in right_spans])
+    return [(_cover([left_spans[i] for i in li]), _cover([right_spans[j] for j in rj])) for li, rj in beads]
+
+
+def _cover(spans):
+    return (spans[0][0], spans[-1][1]) if spans else None
+
+
+def _text(text, span):
+    return text[span[0]:span[1]] if span else ""
+
+
+def analyze(submissions, idioms_dict=None, version=None):
+    """
+    Reports for submission dicts (source_text, student_translation, reference, target_lang),
+    in order, in metrics_utils' report shape plus "segments". Segment reports are read
+    from and written to the report cache.
+    """
+    version = version or db_utils.get_report_version()
+    segment_version = version + db_utils.SEGMENT_VERSION_SUFFIX
+    layouts = []
+    wanted = {}
+    for s in submissions:
+        left = s.get("reference") or s.get("source_text") or ""
+        translation = s.get("student_translation") or ""
+        lang = s.get("target_lang")
+        layout = []
+        for left_span, right_span in segment_submission(left, translation):
+            item = (_text(left, left_span), _text(translation, right_span), None, lang)
+            key = db_utils.report_key(item[0], item[1], None, lang, segment_version)
+            wanted.setdefault(key, item)
+            layout.append((key, left_span, right_span))
+        layouts.append(layout)
+
+    reports = db_utils.get_cached_reports(wanted)
+    todo = [key for key in wanted if key not in reports]
+    perf.incr("segment_cache_hits_total", len(wanted) - len(todo))
+    perf.incr("segment_cache_misses_total", len(todo))
+    if todo:
+        # idioms_dict=None: idioms are matched on the whole texts in merge_reports
+        # heuristics=False: heuristic grammar checks run on the whole translation in merge_reports
+        fresh = dict(zip(todo, metrics_utils.classify_translation_issues_batch([wanted[k] for k in todo], None,
+                                                                               heuristics=False)))
+        db_utils.store_reports(segment_version, fresh)
+        reports.update(fresh)
+    return [merge_reports(s, [(reports[key], left_span, right_span) for key, left_span, right_span in layout],
+                          idioms_dict if idioms_dict is not None else db_utils.get_idioms(s.get("target_lang")))
+            for s, layout in zip(submissions, layouts)]
+
+
+def merge_reports(submission, segments, idioms_dict):
+    """One report from [(segment report, left_span, translation_span)] of a submission."""
+    source = submission.get("source_text") or ""
+    translation = submission.get("student_translation") or ""
+    weights = [max(_span_len(ls), _span_len(rs), 1) for _rep, ls, rs in segments]
+    semantic = sum(rep["semantic_score"] * w for (rep, _ls, _rs), w in zip(segments, weights)) / sum(weights)
+    grammar = []
+    colloc = []
+    for rep, _ls, rs in segments:
+        shift = rs[0] if rs else 0
+        for match in rep.get("grammar_matches") or []:
+            if shift and "offset" in match:
+                match = dict(match, offset=match["offset"] + shift)
+            grammar.append(match)
+        colloc += [flag for flag in rep.get("collocation_flags") or [] if flag not in colloc]
+    if any(rep.get("grammar_fallback") for rep, _ls, _rs in segments) or \
+            metrics_utils.uses_grammar_heuristics(submission.get("target_lang")):
+        grammar += metrics_utils.heuristic_grammar(translation)
+    report = {
+        "semantic_score": round(semantic, 4),
+        "semantic_flag": any(rep.get("semantic_flag") for rep, _ls, _rs in segments),
+        "idiom_issues": metrics_utils.detect_idiomatic_issues(source, translation, idioms_dict or {}),
+        "grammar_matches": grammar,
+        "collocation_flags": colloc,
+    }
+    if any(rep.get("degraded") for rep, _ls, _rs in segments):
+        report["degraded"] = True
+    priority = []
+    if report["semantic_flag"]:
+        priority.append("semantic")
+    if report["idiom_issues"]:
+        priority.append("idiom")
+    if grammar:
+        priority.append("grammar")
+    if colloc:
+        priority.append("collocation")
+    report["priority"] = priority
+    report["segments"] = [{"source": list(ls) if ls else None, "translation": list(rs) if rs else None,
+                           "semantic_score": rep["semantic_score"], "semantic_flag": rep["semantic_flag"]}
+                          for rep, ls, rs in segments]
+    return report
+
+
+def _span_len(span):
+    return span[1] - span[0] if span else 0
@@ -0,0 +1,40 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_utils
+import metrics_utils
+
+IDIOMS = {
+    "kick the bucket": {"arabic": "فارق الحياة"},
+    "break the ice": {"arabic": "كسر الجمود", "variants": ["كسر الحاجز"]},
+    "spill the beans": {"arabic": "كشف السر"},
+}
+
+
+@pytest.fixture(autouse=True)
+def fallback_detectors():
+    """Run every detector on its fallback (difflib, heuristics, no collocations) and restore them afterwards."""
+    saved = {name: dict(det.__dict__) for name, det in metrics_utils.DETECTORS.items()}
+    for det in metrics_utils.DETECTORS.values():
+        det.disable("off in tests")
+    yield
+    for name, det in metrics_utils.DETECTORS.items():
+        det.__dict__.clear()
+        det.__dict__.update(saved[name])
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh, fully migrated database seeded with IDIOMS; yields its path."""
+    idioms_file = tmp_path / "idioms.json"
+    idioms_file.write_text(json.dumps(IDIOMS, ensure_ascii=False), encoding="utf-8")
+    monkeypatch.setattr(db_utils, "DB_FILE", str(tmp_path / "app.db"))
+    monkeypatch.setattr(db_utils, "IDIOMS_FILE", str(idioms_file))
+    db_utils.init_db()
+    yield db_utils.DB_FILE
+    db_utils.close_all_connections()
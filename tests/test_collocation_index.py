@@ -0,0 +1,50 @@
+import math
+import threading
+import time
+
+import pytest
+
+import collocation_index
+
+# "strong tea" is a collocation here; "powerful tea" never occurs though both words are common
+TOKENS = ("strong tea is good . powerful engine is good . " * 10).split()
+
+
+@pytest.fixture
+def index_file(tmp_path):
+    return collocation_index.build_index(str(tmp_path / "bigrams.db"), tokens=iter(TOKENS), source="test")
+
+
+def test_pmi_matches_the_formula(index_file):
+    index = collocation_index.CollocationIndex(index_file)
+    assert (index.total, index.source) == (len(TOKENS), "test")
+    scores = {(a, b): (pmi, n) for a, b, pmi, n in index.score_bigrams(["strong", "tea", "is", "good"])}
+    assert scores[("strong", "tea")] == (pytest.approx(math.log2(10.5 * len(TOKENS) / (10 * 10))), 10)
+    assert index.rare_bigrams("Powerful tea; strong tea; strong engine.", top_n=5) == \
+        ["powerful tea", "tea strong", "strong engine"]
+    assert index.rare_bigrams("Powerful tea; strong tea; strong engine.", top_n=1) == ["powerful tea"]
+    # words below MIN_UNIGRAM_COUNT (or unknown) are not scored
+    assert index.score_bigrams(["strong", "coffee"]) == []
+
+
+def test_concurrent_first_use_builds_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "bigrams.db")
+    builds = []
+    real_build = collocation_index.build_index
+
+    def slow_build(p):
+        builds.append(p)
+        time.sleep(0.2)
+        return real_build(p, tokens=iter(TOKENS), source="test")
+
+    monkeypatch.setattr(collocation_index, "build_index", slow_build)
+    opened = []
+    threads = [threading.Thread(target=lambda: opened.append(collocation_index.load_or_build(path)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert builds == [path]
+    assert [idx.total for idx in opened] == [len(TOKENS)] * 4
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
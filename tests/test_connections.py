@@ -0,0 +1,45 @@
+import sqlite3
+
+import pytest
+
+import db_utils
+
+
+def test_connections_are_pooled_and_configured(db):
+    with db_utils.db_connection() as conn:
+        first = conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+        with db_utils.db_connection() as other:   # nested use gets a second connection
+            assert other is not conn
+    with db_utils.db_connection() as conn:
+        assert conn is first   # LIFO: the connection returned last is reused first
+
+
+def test_failed_transaction_is_rolled_back_before_reuse(db):
+    with pytest.raises(RuntimeError):
+        with db_utils.db_cursor(commit=True) as c:
+            c.execute("INSERT INTO users (username, role, approved) VALUES ('ghost', 'Student', 0)")
+            raise RuntimeError
+    with db_utils.db_connection() as conn:
+        assert not conn.in_transaction
+    assert db_utils.get_all_users() == []
+
+
+def test_retry_on_busy_only(monkeypatch):
+    monkeypatch.setattr(db_utils.time, "sleep", lambda _s: None)
+    calls = []
+
+    @db_utils.db_retry
+    def flaky(error):
+        calls.append(error)
+        if len(calls) < 3:
+            raise sqlite3.OperationalError(error)
+        return "ok"
+
+    assert flaky("database is locked") == "ok"
+    assert len(calls) == 3
+    calls.clear()
+    with pytest.raises(sqlite3.OperationalError):
+        flaky("no such table: nope")
+    assert len(calls) == 1
@@ -0,0 +1,65 @@
+import numpy as np
+
+from embedding_cache import EmbeddingStore
+
+
+class Encoder:
+    """Deterministic stand-in for the sentence-transformer, recording what it was asked to encode."""
+
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return np.stack([np.random.default_rng(len(t) * 7919 + sum(map(ord, t))).standard_normal(self.dim)
+                         for t in texts])
+
+
+def test_disk_round_trip_across_processes(tmp_path):
+    encoder = Encoder()
+    first = EmbeddingStore("org/model-v1", cache_dir=str(tmp_path))
+    fresh = first.encode(["a cat", "a dog", "a cat"], encoder)
+    assert encoder.calls == [["a cat", "a dog"]]
+    assert fresh.dtype == np.float32 and fresh.shape == (3, 8)
+    assert np.array_equal(fresh[0], fresh[2])
+    # fresh vectors are already rounded through float16, like cached ones
+    assert np.array_equal(fresh, fresh.astype(np.float16).astype(np.float32))
+
+    # a second store on the same directory stands in for another worker process
+    second = EmbeddingStore("org/model-v1", cache_dir=str(tmp_path))
+    again = second.encode(["a dog", "a cat", "a bird"], encoder)
+    assert encoder.calls[1:] == [["a bird"]]
+    assert np.array_equal(again[:2], fresh[[1, 0]])
+    assert second.stats()["disk_hits"] == 2
+    assert second.stats()["disk_rows"] == 3
+
+    # and the first one maps the rows the second appended
+    first.clear_memory()
+    assert np.array_equal(first.encode(["a bird"], encoder), again[2:])
+    assert len(encoder.calls) == 2
+
+
+def test_memory_budget_evicts_least_recently_used(tmp_path):
+    encoder = Encoder(dim=256)   # 1 KiB per float32 vector
+    store = EmbeddingStore("m", cache_dir=str(tmp_path), memory_budget_mb=2.5 / 1024)
+    store.encode(["one", "two"], encoder)
+    store.encode(["one"], encoder)   # "one" is now the most recently used
+    store.encode(["three"], encoder)
+    stats = store.stats()
+    assert (stats["lru_entries"], stats["evictions"], stats["hits"]) == (2, 1, 1)
+    # the evicted vector comes back from disk, not from the encoder
+    store.encode(["two"], encoder)
+    assert store.stats()["disk_hits"] == 1
+    assert encoder.calls == [["one", "two"], ["three"]]
+
+
+def test_unwritable_cache_still_serves_from_memory(tmp_path):
+    blocked = tmp_path / "file"
+    blocked.write_text("not a directory")
+    encoder = Encoder()
+    store = EmbeddingStore("m", cache_dir=str(blocked))
+    first = store.encode(["x"], encoder)
+    assert np.array_equal(store.encode(["x"], encoder), first)
+    assert store.stats()["hits"] == 1
+    assert store.encode([], encoder).shape[0] == 0
@@ -0,0 +1,31 @@
+import csv
+import gzip
+import io
+
+import db_utils
+
+
+def _submit(n):
+    db_utils.add_submissions([{"username": f"s{i % 2}", "source_text": f"Break the ice, part {i}.",
+                               "student_translation": f"كسر الجمود، الجزء {i}.", "reference": None,
+                               "target_lang": "ar"} for i in range(n)])
+
+
+def test_csv_export_streams_every_chunk(db, tmp_path):
+    _submit(7)
+    path = db_utils.export_submissions_with_errors(str(tmp_path / "out.csv"), chunk_size=3)
+    with open(path, encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [r["source_text"] for r in rows] == [f"Break the ice, part {i}." for i in range(7)]
+    assert list(rows[0]) == db_utils.EXPORT_HEADERS
+    assert '"break the ice"' in rows[0]["idiom_issues"]
+
+
+def test_gzip_export_into_a_buffer(db):
+    _submit(2)
+    buf = io.BytesIO()
+    assert db_utils.export_submissions_with_errors("export.csv.gz", fileobj=buf) is buf
+    assert not buf.closed   # left open for the caller (a download button)
+    lines = gzip.decompress(buf.getvalue()).decode("utf-8").splitlines()
+    assert lines[0] == ",".join(db_utils.EXPORT_HEADERS)
+    assert len(lines) == 3
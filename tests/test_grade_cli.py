@@ -0,0 +1,52 @@
+import csv
+import io
+import os
+
+import pytest
+
+import db_utils
+import grade_cli
+
+
+def write_csv(path, n):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["username", "source_text", "student_translation", "target_lang"])
+        for i in range(n):
+            writer.writerow([f"s{i % 3}", f"source {i}", f"ترجمة {i}", "ar"])
+
+
+def test_interrupted_import_resumes_and_clears_its_checkpoint(db, tmp_path, monkeypatch):
+    path = str(tmp_path / "term.csv")
+    write_csv(path, 10)
+    source = os.path.abspath(path)
+    add_submissions = db_utils.add_submissions
+    calls = []
+
+    def interrupted(rows, checkpoint=None):
+        calls.append(len(rows))
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return add_submissions(rows, checkpoint=checkpoint)
+
+    monkeypatch.setattr(db_utils, "add_submissions", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        grade_cli.import_file(path, chunk_size=4, out=io.StringIO())
+    assert db_utils.count_submissions() == 8
+    assert db_utils.get_import_checkpoint(source)[1] == 8
+
+    monkeypatch.setattr(db_utils, "add_submissions", add_submissions)
+    out = io.StringIO()
+    assert grade_cli.import_file(path, chunk_size=4, out=out) == (2, 0)
+    assert "resuming after row 8" in out.getvalue()
+    assert db_utils.count_submissions() == 10
+    assert db_utils.get_import_checkpoint(source) is None
+
+
+def test_changed_file_needs_restart(db, tmp_path):
+    path = str(tmp_path / "term.csv")
+    write_csv(path, 3)
+    db_utils.add_submissions([], checkpoint=(path, "stale", 2))
+    with pytest.raises(SystemExit):
+        grade_cli.import_file(path, out=io.StringIO())
+    assert grade_cli.import_file(path, restart=True, out=io.StringIO()) == (3, 0)
@@ -0,0 +1,185 @@
+import re
+import time
+
+import pytest
+
+import db_utils
+import metrics_utils
+from analysis_worker import AnalysisWorker
+from grammar_service import CircuitBreaker, GrammarService, StandInServer
+
+
+@pytest.fixture
+def server():
+    with StandInServer() as srv:
+        yield srv
+
+
+@pytest.fixture
+def service(server):
+    svc = GrammarService(urls=[server.url], timeout=2.0)
+    yield svc
+    svc.close()
+
+
+def _messages(matches):
+    return [(m["message"], m["offset"], m["length"]) for m in matches]
+
+
+def test_texts_are_packed_into_one_request(server, service):
+    texts = ["It is is late.", "All fine.", "Too  many spaces", "Really?!?"]
+    results = service.check_batch(texts, "en")
+    assert server.requests == 1
+    assert _messages(results[0]) == [("Possible typo: you repeated a word", 3, 5)]
+    assert results[1] == []
+    assert _messages(results[2]) == [("Possible typo: you repeated a whitespace", 3, 2)]
+    assert _messages(results[3]) == [("Excessive punctuation", 6, 3)]
+
+    # cached: no second request
+    assert service.check_batch(texts[:2], "en") == results[:2]
+    assert server.requests == 1
+
+
+def test_batches_are_split_by_size(server):
+    service = GrammarService(urls=[server.url], batch_chars=30)
+    try:
+        texts = [f"Sentence number {i}  here." for i in range(4)]
+        results = service.check_batch(texts, "en")
+    finally:
+        service.close()
+    assert server.requests == 4
+    assert all(_messages(r) == [("Possible typo: you repeated a whitespace", 17, 2)] for r in results)
+
+
+def test_offsets_map_back_past_non_bmp_characters(server, service):
+    # LanguageTool counts UTF-16 units; emoji take two
+    texts = ["😀😀 ok  go", "𝒜 b  c", "plain  text"]
+    results = service.check_batch(texts, "en")
+    assert server.requests == 1
+    for text, matches in zip(texts, results):
+        [m] = matches
+        assert text[m["offset"]:m["offset"] + 2] == "  "
+
+
+class EmojiServer(StandInServer):
+    RULES = StandInServer.RULES + [(re.compile("🙂+ ?"), "EMOJI_RULE", "Emoji in text", "")]
+
+
+def test_lengths_map_back_past_non_bmp_characters():
+    texts = ["𝒜 has 🙂🙂 here", "fine 🙂 ok  go"]
+    with EmojiServer() as server:
+        service = GrammarService(urls=[server.url])
+        try:
+            results = service.check_batch(texts, "en")
+        finally:
+            service.close()
+    spans = [[t[m["offset"]:m["offset"] + m["length"]] for m in matches] for t, matches in zip(texts, results)]
+    assert spans == [["🙂🙂 "], ["🙂 ", "  "]]
+
+
+def test_breaker_opens_and_closes():
+    breaker = CircuitBreaker(failures=2, reset_after=0.05)
+    breaker.failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()   # one trial request at a time
+    breaker.success()
+    assert breaker.state == "closed"
+
+
+def test_failing_server_trips_breaker_then_recovers(server, service):
+    breaker = service.shared[0].breaker = CircuitBreaker(failures=2, reset_after=0.1)
+    server.fail = True
+    assert service.check_batch(["a  b"], "en") == [None]
+    assert service.check_batch(["a  b"], "en") == [None]
+    assert breaker.state == "open"
+    requests = server.requests
+    assert service.check_batch(["a  b"], "en") == [None]
+    assert server.requests == requests     # open breaker: no request sent
+
+    server.fail = False
+    time.sleep(0.11)
+    [matches] = service.check_batch(["a  b"], "en")
+    assert _messages(matches) == [("Possible typo: you repeated a whitespace", 1, 2)]
+    assert breaker.state == "closed"
+
+
+@pytest.fixture
+def grammar_detector(monkeypatch):
+    """The grammar detector configured (as if LanguageTool were installed) and not loaded yet."""
+    det = metrics_utils.DETECTORS["grammar"]
+    monkeypatch.setattr(metrics_utils, "_GRAMMAR_URLS", None)
+    det.__dict__.update(_configured=True, state="not-loaded", value=None, error=None)
+    yield det
+    if det.value is not None:
+        det.value.close()
+
+
+def test_detector_uses_shared_servers(server, grammar_detector):
+    metrics_utils.use_grammar_servers([server.url])
+    [report] = metrics_utils.classify_translation_issues_batch([("src", "a  b", None, "en")], {})
+    assert _messages(report["grammar_matches"]) == [("Possible typo: you repeated a whitespace", 1, 2)]
+    assert "degraded" not in report
+    assert metrics_utils.shared_grammar_urls() == [server.url + "/v2"]
+
+
+def test_server_down_falls_back_to_heuristics(server, grammar_detector):
+    server.fail = True
+    metrics_utils.use_grammar_servers([server.url])
+    [report] = metrics_utils.classify_translation_issues_batch([("src", "a  b", None, "en")], {})
+    assert [m["message"] for m in report["grammar_matches"]] == ["Multiple consecutive spaces"]
+    assert report["degraded"] is True
+
+
+def test_no_parent_server_falls_back_to_heuristics(grammar_detector):
+    metrics_utils.use_grammar_servers([])
+    assert metrics_utils.shared_grammar_urls() == []
+    [report] = metrics_utils.classify_translation_issues_batch([("src", "a  b", None, "en")], {})
+    assert [m["message"] for m in report["grammar_matches"]] == ["Multiple consecutive spaces"]
+    assert report["degraded"] is True
+
+
+def test_pool_processes_use_the_parents_servers(db, server, grammar_detector, monkeypatch):
+    # pool processes would otherwise find no LanguageTool at all (not installed here)
+    monkeypatch.setenv("DISABLED_DETECTORS", "semantic,collocation")
+    metrics_utils.use_grammar_servers([server.url])
+    db_utils.add_submissions([{"username": "amal", "source_text": "It is late.", "student_translation": "It is  late.",
+                               "reference": None, "target_lang": "en"}])
+    worker = AnalysisWorker(concurrency=1)
+    worker.run(once=True)
+    assert worker.processed == 1
+    assert server.requests == 1
+    report = db_utils.get_submission_report(1)["report"]
+    assert _messages(report["grammar"]) == [("Possible typo: you repeated a whitespace", 5, 2)]
+
+
+def test_outage_is_recorded_once_and_retried_after_backoff(db, grammar_detector, monkeypatch):
+    metrics_utils.use_grammar_servers([])   # configured, but no server could be started
+    db_utils.add_submissions([{"username": "amal", "source_text": "It is late.", "student_translation": "It is  late.",
+                               "reference": None, "target_lang": "en"}])
+    worker = AnalysisWorker(concurrency=0)
+    for _ in range(3):
+        worker._next_backfill = 0.0   # an idle sweep on every round
+        worker.run_once()
+    assert db_utils.get_job_counts() == {"done": 1}
+    with db_utils.db_cursor() as c:
+        assert c.execute("SELECT version FROM submission_analysis").fetchone()[0].endswith(
+            db_utils.DEGRADED_VERSION_SUFFIX)
+    # the dashboard counts the heuristic findings meanwhile
+    assert db_utils.get_error_distribution()["grammar"] == 1
+    result = db_utils.get_submission_report(1)
+    assert result["status"] == "ready" and result["report"]["degraded"] is True
+    assert db_utils.get_job_counts() == {"done": 1}
+
+    monkeypatch.setattr(db_utils, "DEGRADED_RETRY_SECONDS", 0)
+    with db_utils.db_cursor(commit=True) as c:
+        c.execute("UPDATE submission_analysis SET analyzed_at = datetime('now', '-1 minute')")
+    worker._next_backfill = 0.0
+    worker.run_once()
+    worker.run_once()
+    assert db_utils.get_job_counts() == {"done": 2}
+    assert db_utils.get_error_distribution()["grammar"] == 1
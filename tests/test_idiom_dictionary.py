@@ -0,0 +1,60 @@
+import io
+import json
+
+import db_utils
+import idiom_matcher
+from conftest import IDIOMS
+
+
+def test_parse_json_shapes():
+    data = {
+        "break the ice": {"arabic": "كسر الجمود", "category": "social"},
+        "spill the beans": "كشف السر",
+        " kick the bucket ": {"renderings": {"ar": ["فارق الحياة", "مات", "فارق الحياة"], "fr": "casser sa pipe"}},
+    }
+    entries = db_utils.parse_idioms(io.StringIO(json.dumps(data, ensure_ascii=False)))
+    assert entries == [
+        {"phrase": "break the ice", "category": "social", "renderings": {"ar": ["كسر الجمود"]}},
+        {"phrase": "spill the beans", "category": None, "renderings": {"ar": ["كشف السر"]}},
+        {"phrase": "kick the bucket", "category": None, "renderings": {"ar": ["فارق الحياة", "مات"],
+                                                                        "fr": ["casser sa pipe"]}},
+    ]
+
+
+def test_parse_csv_merges_rows_per_language():
+    text = ("phrase,target_lang,rendering,variants,category\n"
+            "break the ice,ar,كسر الجمود,كسر الحاجز|كسر الجليد,social\n"
+            "break the ice,fr,briser la glace,,\n"
+            ",ar,orphan,,\n")
+    [entry] = db_utils.parse_idioms(io.BytesIO(text.encode("utf-8")), fmt="csv")
+    assert entry == {"phrase": "break the ice", "category": "social",
+                     "renderings": {"ar": ["كسر الجمود", "كسر الحاجز", "كسر الجليد"], "fr": ["briser la glace"]}}
+
+
+def test_seeded_from_idioms_file(db):
+    idioms = db_utils.get_idioms()
+    assert set(idioms) == set(IDIOMS)
+    assert idioms["break the ice"] == {"expected": "كسر الجمود", "variants": ["كسر الحاجز"]}
+    assert db_utils.get_idioms("fr") == {}
+    assert db_utils.count_idioms() == (3, 4)
+
+
+def test_import_replaces_renderings_and_invalidates_snapshot(db, tmp_path):
+    before = db_utils.get_idioms()
+    assert db_utils.get_idioms() is before   # unchanged version: same snapshot, same matcher
+    matcher = idiom_matcher.get_matcher(before)
+    version = db_utils.get_report_version()
+
+    path = tmp_path / "more.json"
+    path.write_text(json.dumps({"break the ice": {"renderings": {"ar": ["أذاب الجليد"]}},
+                                "hit the road": "انطلق"}, ensure_ascii=False), encoding="utf-8")
+    counts = db_utils.import_idioms(str(path))
+    assert (counts["idioms"], counts["renderings"]) == (2, 2)
+
+    after = db_utils.get_idioms()
+    assert after is not before
+    assert after["break the ice"] == {"expected": "أذاب الجليد", "variants": []}
+    assert after["kick the bucket"] == before["kick the bucket"]   # idioms not in the file are kept
+    assert "hit the road" in after
+    assert idiom_matcher.get_matcher(after) is not matcher
+    assert db_utils.get_report_version() != version
@@ -0,0 +1,62 @@
+import idiom_matcher
+from idiom_matcher import IdiomMatcher
+
+from conftest import IDIOMS
+
+
+def _statuses(source, translation, idioms=IDIOMS):
+    return {eng: issue["status"] for eng, issue in IdiomMatcher(idioms).detect(source, translation).items()}
+
+
+def test_statuses():
+    assert _statuses("Let's break the ice.", "لنكسر الجمود.") == {"break the ice": "idiomatic"}
+    assert _statuses("Let's break the ice.", "لنفعل break the ice.") == {"break the ice": "non-idiomatic-literal"}
+    assert _statuses("Let's break the ice.", "لنبدأ الحديث.") == {"break the ice": "non-idiomatic-missing"}
+
+
+def test_variants_and_expected_rendering():
+    detected = IdiomMatcher(IDIOMS).detect("Time to BREAK THE ICE!", "حان وقت كسر الحاجز")
+    assert detected == {"break the ice": {"status": "idiomatic", "expected": "كسر الجمود"}}
+
+
+def test_whole_words_only():
+    assert _statuses("He will kick the buckets.", "") == {}
+    assert _statuses("", "فارق الحياة") == {}
+
+
+def test_arabic_normalization_and_attached_prefixes():
+    idioms = {"spill the beans": "كشف السرّ"}
+    # diacritics are ignored and a prefixed conjunction still matches
+    assert _statuses("Don't spill the beans.", "وكشف السر كان خطأ", idioms) == {"spill the beans": "idiomatic"}
+
+
+def test_several_idioms_in_dictionary_order():
+    detected = IdiomMatcher(IDIOMS).detect("Spill the beans and break the ice.", "كشف السر")
+    assert list(detected) == ["break the ice", "spill the beans"]
+    assert detected["spill the beans"]["status"] == "idiomatic"
+
+
+def test_get_matcher_cache():
+    idioms = dict(IDIOMS)
+    matcher = idiom_matcher.get_matcher(idioms)
+    assert idiom_matcher.get_matcher(idioms) is matcher
+    idioms["let the cat out of the bag"] = "أفشى السر"
+    assert idiom_matcher.get_matcher(idioms) is not matcher
+
+
+def test_edited_dict_gets_a_new_matcher():
+    idioms = {"break the ice": "كسر الجمود"}
+    assert _statuses("Break the ice.", "كسر الجمود", idioms) == {"break the ice": "idiomatic"}
+    idiom_matcher.get_matcher(idioms)
+    # same object, same size, different contents
+    idioms["break the ice"] = "بدء الحديث"
+    detected = idiom_matcher.get_matcher(idioms).detect("Break the ice.", "بدء الحديث")
+    assert detected["break the ice"]["status"] == "idiomatic"
+
+
+def test_snapshots_are_cached_by_version():
+    snapshot = idiom_matcher.IdiomSnapshot(IDIOMS, version=("test", 1))
+    matcher = idiom_matcher.get_matcher(snapshot)
+    assert idiom_matcher.get_matcher(idiom_matcher.IdiomSnapshot(IDIOMS, version=("test", 1))) is matcher
+    assert idiom_matcher.get_matcher(idiom_matcher.IdiomSnapshot(IDIOMS, version=("test", 2))) is not matcher
+
@@ -0,0 +1,52 @@
+import db_utils
+
+MISSED = {"status": "non-idiomatic (literal)"}
+# (username, target_lang, created_at, report)
+SUBMISSIONS = [
+    ("amal", "ar", "2024-03-01 10:00:00", {"semantic_flag": True, "semantic_score": 40.0,
+                                           "idiom_issues": {"break the ice": MISSED}, "grammar": [{}, {}]}),
+    ("amal", "ar", "2024-03-02 10:00:00", {"idiom_issues": {"break the ice": MISSED,
+                                                            "spill the beans": {"status": "idiomatic"}}}),
+    ("badr", "fr", "2024-03-02 11:00:00", {"idiom_issues": {"spill the beans": MISSED}, "grammar": [{}]}),
+]
+
+
+def _record(version, reports):
+    db_utils.add_submissions([{"username": user, "source_text": f"source {i}", "student_translation": "t",
+                               "target_lang": lang, "created_at": created}
+                              for i, (user, lang, created, _rep) in enumerate(SUBMISSIONS)])
+    _analyze(version, reports)
+
+
+def _analyze(version, reports):
+    subs = db_utils.get_submissions_by_id(range(1, len(reports) + 1))
+    return db_utils.record_submission_issues(version, [(subs[i + 1], rep) for i, rep in enumerate(reports)])
+
+
+def test_distribution_and_filters(db):
+    _record("v1", [rep for *_rest, rep in SUBMISSIONS])
+    assert db_utils.get_error_distribution() == {"semantic": 1, "idiom": 3, "grammar": 3}
+    assert db_utils.get_error_distribution(username="amal") == {"semantic": 1, "idiom": 2, "grammar": 2}
+    assert db_utils.get_error_distribution(start="2024-03-02") == {"semantic": 0, "idiom": 2, "grammar": 1}
+    assert db_utils.get_error_distribution(target_lang="fr", end="2024-03-01") == {"semantic": 0, "idiom": 0,
+                                                                                  "grammar": 0}
+    assert db_utils.get_error_distribution_by_student() == {"amal": {"semantic": 1, "idiom": 2, "grammar": 2},
+                                                            "badr": {"semantic": 0, "idiom": 1, "grammar": 1}}
+    assert db_utils.get_top_missed_idioms() == [("break the ice", 2), ("spill the beans", 1)]
+    assert db_utils.get_top_missed_idioms(target_lang="fr") == [("spill the beans", 1)]
+    assert db_utils.get_top_missed_idioms(start="2024-03-02") == [("break the ice", 1), ("spill the beans", 1)]
+    assert db_utils.get_issue_filter_options() == (["amal", "badr"], ["ar", "fr"])
+
+
+def test_reanalysis_replaces_counts_and_is_idempotent(db):
+    _record("v1", [rep for *_rest, rep in SUBMISSIONS])
+    assert _analyze("v1", [{}] * 3) == 0   # same version: nothing changes
+    assert db_utils.get_error_distribution()["idiom"] == 3
+
+    assert _analyze("v2", [{}, {"grammar": [{}]}, {}]) == 3
+    assert db_utils.get_error_distribution() == {"semantic": 0, "idiom": 0, "grammar": 1}
+    assert db_utils.get_top_missed_idioms() == []
+    assert db_utils.get_error_distribution_by_student() == {"amal": {"semantic": 0, "idiom": 0, "grammar": 1}}
+    with db_utils.db_cursor() as c:
+        c.execute("SELECT COUNT(*) FROM issue_daily_counts")
+        assert c.fetchone()[0] == 1   # rows that dropped to zero are deleted
@@ -0,0 +1,95 @@
+import db_utils
+from analysis_worker import AnalysisWorker
+
+
+def _submit(n):
+    db_utils.add_submissions([{"username": "amal", "source_text": f"Break the ice number {i}.",
+                               "student_translation": f"كسر الجمود رقم {i}.", "reference": None,
+                               "target_lang": "ar"} for i in range(n)])
+
+
+def test_claim_is_exclusive_and_ordered(db):
+    _submit(5)
+    first = db_utils.claim_analysis_jobs("w1", 3)
+    second = db_utils.claim_analysis_jobs("w2", 3)
+    assert [j for j, _sid in first] == [1, 2, 3]
+    assert [j for j, _sid in second] == [4, 5]
+    assert db_utils.claim_analysis_jobs("w3", 3) == []
+    assert db_utils.get_job_counts() == {"running": 5}
+
+
+def test_failed_jobs_are_retried_then_failed(db):
+    _submit(1)
+    for attempt in range(1, db_utils.JOB_MAX_ATTEMPTS + 1):
+        [(job_id, _sid)] = db_utils.claim_analysis_jobs("w1", 10)
+        db_utils.finish_analysis_jobs(failed={job_id: "boom"})
+        job = db_utils.get_analysis_job(job_id)
+        assert job["attempts"] == attempt
+        assert job["error"] == "boom"
+    assert job["status"] == "failed"
+    assert db_utils.claim_analysis_jobs("w1", 10) == []
+
+
+def test_requeue_stale_and_worker_jobs(db):
+    _submit(2)
+    (a, _), (b, _) = db_utils.claim_analysis_jobs("w1", 1) + db_utils.claim_analysis_jobs("w2", 1)
+    assert db_utils.requeue_stale_jobs(lease_seconds=3600) == 0
+    with db_utils.db_cursor(commit=True) as c:
+        c.execute("UPDATE analysis_jobs SET updated_at = datetime('now', '-2 hours') WHERE id=?", (a,))
+    assert db_utils.requeue_stale_jobs(lease_seconds=3600) == 1
+    assert db_utils.get_analysis_job(a)["status"] == "queued"
+
+    assert db_utils.requeue_worker_jobs("w2") == 1
+    job = db_utils.get_analysis_job(b)
+    assert (job["status"], job["attempts"], job["error"]) == ("queued", 0, "worker restarted")
+
+
+def test_worker_drains_queue(db):
+    _submit(3)
+    worker = AnalysisWorker(concurrency=0, batch_size=2)
+    worker.run(once=True)
+    assert worker.processed == 3
+    assert db_utils.get_job_counts() == {"done": 3}
+    report = db_utils.get_submission_report(1)["report"]
+    assert report["idiom_issues"]["break the ice"]["status"] == "idiomatic"
+
+
+def test_add_submission_queues_a_job(db):
+    db_utils.add_submissions([{"username": "amal", "source_text": "s", "student_translation": "t",
+                               "target_lang": "ar"}])
+    sub_id, job_id = db_utils.add_submission("amal", "Hello.", "مرحبا.", None, "ar")
+    assert db_utils.get_analysis_job(job_id) == {"id": job_id, "submission_id": sub_id, "status": "queued",
+                                                 "attempts": 0, "error": None}
+
+
+def test_report_states(db):
+    _submit(1)
+    assert db_utils.get_submission_report(1)["status"] == "pending"
+    AnalysisWorker(concurrency=0).run(once=True)
+    result = db_utils.get_submission_report(1)
+    assert result["status"] == "ready" and result["error"] is None
+    assert db_utils.get_submission_report(99) == {"status": "failed", "report": None,
+                                                  "error": "submission not found"}
+
+
+def test_failed_analysis_is_reported(db):
+    _submit(1)
+    for _ in range(db_utils.JOB_MAX_ATTEMPTS):
+        [(job_id, _sid)] = db_utils.claim_analysis_jobs("w1", 10)
+        db_utils.finish_analysis_jobs(failed={job_id: "RuntimeError: boom"})
+    assert db_utils.get_submission_report(1) == {"status": "failed", "report": None, "error": "RuntimeError: boom"}
+    # a retry queues a new job
+    assert db_utils.requeue_submission(1) == 1
+    assert db_utils.get_submission_report(1)["status"] == "pending"
+
+
+def test_cache_miss_is_queued_not_analyzed_inline(db):
+    _submit(1)
+    AnalysisWorker(concurrency=0).run(once=True)
+    with db_utils.db_cursor(commit=True) as c:
+        c.execute("DELETE FROM submission_reports")
+    assert db_utils.get_submission_report(1)["status"] == "pending"
+    assert db_utils.get_job_counts() == {"done": 1, "queued": 1}
+    # polling again does not queue a second job
+    db_utils.get_submission_report(1)
+    assert db_utils.get_job_counts() == {"done": 1, "queued": 1}
@@ -0,0 +1,59 @@
+import sqlite3
+
+import pytest
+
+import db_utils
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """A database with only the original (version 0) tables, as app.db files from before migrations."""
+    monkeypatch.setattr(db_utils, "DB_FILE", str(tmp_path / "legacy.db"))
+    monkeypatch.setattr(db_utils, "IDIOMS_FILE", str(tmp_path / "missing.json"))
+    monkeypatch.setattr(db_utils, "migrate", lambda target=None: 0)
+    db_utils.init_db()
+    monkeypatch.undo()
+    monkeypatch.setattr(db_utils, "DB_FILE", str(tmp_path / "legacy.db"))
+    monkeypatch.setattr(db_utils, "IDIOMS_FILE", str(tmp_path / "missing.json"))
+    with db_utils.db_cursor(commit=True) as c:
+        c.execute("INSERT INTO users (username, password, role, approved) VALUES ('amal', 'pw', 'Student', 1)")
+        c.execute("INSERT INTO practice_bank (category, prompt, reference) VALUES ('idiom', 'p', 'r')")
+        c.executemany("INSERT INTO practice_assignments (username, practice_id) VALUES (?, 1)", [("amal",)] * 2)
+        c.executemany("""INSERT INTO submissions (username, source_text, student_translation, reference, target_lang)
+                         VALUES (?, 'src', 'tr', NULL, 'ar')""", [("amal",), ("gone",)])
+    yield db_utils.DB_FILE
+    db_utils.close_all_connections()
+
+
+def _columns(table):
+    with db_utils.db_cursor() as c:
+        return [r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def test_fresh_database_reaches_latest_version(db):
+    assert db_utils.get_schema_version() == len(db_utils.MIGRATIONS)
+    assert db_utils.migrate() == len(db_utils.MIGRATIONS)
+
+
+def test_legacy_database_is_upgraded_in_steps(legacy_db):
+    assert db_utils.get_schema_version() == 0
+    assert db_utils.migrate(target=3) == 3
+    assert "created_at" in _columns("submissions")
+    assert "status" not in _columns("practice_assignments")
+
+    assert db_utils.migrate() == len(db_utils.MIGRATIONS)
+    with db_utils.db_cursor() as c:
+        assert c.execute("SELECT COUNT(*) FROM submissions").fetchone()[0] == 2
+        # submissions of deleted accounts keep an unapproved stub user
+        assert c.execute("SELECT approved FROM users WHERE username='gone'").fetchone() == (0,)
+        # duplicate assignments collapse to the oldest one
+        assert c.execute("SELECT id, status FROM practice_assignments").fetchall() == [(1, "assigned")]
+        assert c.execute("PRAGMA foreign_key_check").fetchall() == []
+
+
+def test_migrations_enforce_foreign_keys(db):
+    db_utils.add_submissions([{"username": "amal", "source_text": "s", "student_translation": "t",
+                               "target_lang": "ar"}])
+    with pytest.raises(sqlite3.IntegrityError):
+        with db_utils.db_cursor(commit=True) as c:
+            c.execute("INSERT INTO analysis_jobs (submission_id) VALUES (999)")
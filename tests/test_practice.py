@@ -0,0 +1,45 @@
+import pytest
+
+import db_utils
+
+
+@pytest.fixture
+def bank(db):
+    for name, role, approved in [("amal", "Student", 1), ("badr", "Student", 1), ("new", "Student", 0),
+                                 ("prof", "Instructor", 1)]:
+        db_utils._upsert_user(name, None, role, approved)
+    return [db_utils.add_practice_item("idiom", f"prompt {i}", f"ref {i}") for i in range(3)]
+
+
+def test_assign_skips_existing_pairs_and_unknowns(bank):
+    assert db_utils.assign_practices(bank[:2], usernames=["amal"]) == {"inserted": 2, "skipped": 0}
+    result = db_utils.assign_practices(bank + [999], usernames=["amal", "badr", "ghost"], due_date="2024-05-01")
+    # 3 users x 4 ids: amal's two existing pairs, the unknown id and the unknown user are skipped
+    assert result == {"inserted": 4, "skipped": 8}
+    assert db_utils.get_assigned_practice_ids("badr") == set(bank)
+    due = {row["prompt"]: row["due_date"] for row in db_utils.get_user_practice_queue("amal")}
+    assert due == {"prompt 0": None, "prompt 1": None, "prompt 2": "2024-05-01"}
+
+    with pytest.raises(ValueError):
+        db_utils.assign_practices(bank)
+
+
+def test_assign_by_role_takes_approved_users_only(bank):
+    assert db_utils.assign_practices(bank[:1], role="Student") == {"inserted": 2, "skipped": 0}
+    assert db_utils.get_assigned_practice_ids("new") == set()
+    assert db_utils.get_assigned_practice_ids("prof") == set()
+    assert db_utils.assign_practices(bank[:1], role="Student") == {"inserted": 0, "skipped": 2}
+
+
+def test_queue_pages_and_status(bank):
+    db_utils.assign_practices_to_user("amal", bank)
+    first = db_utils.get_user_practice_queue("amal", limit=2)
+    rest = db_utils.get_user_practice_queue("amal", limit=2, after_id=first[-1]["id"])
+    assert [r["prompt"] for r in first + rest] == ["prompt 0", "prompt 1", "prompt 2"]
+
+    assert db_utils.set_practice_status("amal", first[0]["id"], "completed") == 1
+    assert db_utils.set_practice_status("badr", first[1]["id"], "completed") == 0   # not theirs
+    assert [r["prompt"] for r in db_utils.get_user_practice_queue("amal")] == ["prompt 1", "prompt 2"]
+    assert len(db_utils.get_user_practice_queue("amal", status=None)) == 3
+    with pytest.raises(ValueError):
+        db_utils.set_practice_status("amal", first[0]["id"], "skipped")
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import db_utils
+
+# (created_at, semantic score, grammar matches); Jan 1 and Jan 8 2024 are Mondays
+HISTORY = [("2024-01-01 09:00:00", 60.0, 2), ("2024-01-03 09:00:00", 70.0, 1), ("2024-01-08 09:00:00", 90.0, 0)]
+
+
+def _record(version, history, username="amal"):
+    db_utils.add_submissions([{"username": username, "source_text": f"source {i}", "student_translation": "t",
+                               "target_lang": "ar", "created_at": created}
+                              for i, (created, _score, _grammar) in enumerate(history)])
+    return _analyze(version, history, username)
+
+
+def _analyze(version, history, username="amal"):
+    with db_utils.db_cursor() as c:
+        c.execute("SELECT id FROM submissions WHERE username=? ORDER BY id", (username,))
+        ids = [r[0] for r in c.fetchall()]
+    subs = db_utils.get_submissions_by_id(ids)
+    reports = [{"semantic_score": score, "semantic_flag": False, "grammar": [{}] * grammar}
+               for _created, score, grammar in history]
+    db_utils.record_submission_issues(version, [(subs[sid], rep) for sid, rep in zip(ids, reports)])
+
+
+def _expected_slope_per_week(history):
+    days = [(np.datetime64(created[:10]) - np.datetime64("2020-01-01")).astype(float) + 9 / 24
+            for created, _score, _grammar in history]
+    return 7 * np.polyfit(days, [score for _created, score, _grammar in history], 1)[0]
+
+
+def test_weekly_means_and_rollup(db):
+    _record("v1", HISTORY)
+    assert db_utils.get_student_timeline("amal") == [
+        ("2024-01-01", {"semantic": 65.0, "semantic_issues": 0.0, "idiom_issues": 0.0, "grammar_issues": 1.5}),
+        ("2024-01-08", {"semantic": 90.0, "semantic_issues": 0.0, "idiom_issues": 0.0, "grammar_issues": 0.0}),
+    ]
+    assert [week for week, _m in db_utils.get_student_timeline("amal", start="2024-01-02")] == ["2024-01-08"]
+
+    semantic = db_utils.get_student_progress("amal")["semantic"]
+    assert (semantic["n"], semantic["mean"], semantic["last_n"]) == (3, 73.333, 3)
+    assert semantic["slope_per_week"] == pytest.approx(_expected_slope_per_week(HISTORY), abs=1e-3)
+    assert "bleu" not in db_utils.get_student_progress("amal")   # no references, nothing to score
+
+
+def test_reanalysis_replaces_old_rows(db):
+    _record("v1", HISTORY)
+    revised = [(created, score - 10, grammar + 1) for created, score, grammar in HISTORY]
+    _analyze("v2", revised)
+    progress = db_utils.get_student_progress("amal")
+    assert (progress["semantic"]["n"], progress["semantic"]["mean"]) == (3, 63.333)
+    assert progress["semantic"]["slope_per_week"] == pytest.approx(_expected_slope_per_week(revised), abs=1e-3)
+    assert progress["grammar_issues"]["mean"] == 2.0
+    assert db_utils.get_student_timeline("amal")[0][1]["semantic"] == 55.0
+
+    _analyze("v2", HISTORY)   # same version: skipped
+    assert db_utils.get_student_progress("amal")["semantic"]["mean"] == 63.333
+
+
+def test_last_window_covers_latest_submissions(db, monkeypatch):
+    monkeypatch.setattr(db_utils, "PROGRESS_WINDOW", 2)
+    _record("v1", HISTORY)
+    semantic = db_utils.get_student_progress("amal")["semantic"]
+    assert (semantic["n"], semantic["mean"]) == (3, 73.333)
+    assert (semantic["last_n"], semantic["last_mean"]) == (2, 80.0)
+    assert db_utils.get_student_progress("nobody") == {}
@@ -0,0 +1,44 @@
+import pytest
+
+import db_utils
+import recommender
+
+
+@pytest.fixture
+def index(db, monkeypatch):
+    monkeypatch.setattr(recommender, "_index", None)
+    return recommender.get_index()
+
+
+def test_refresh_is_incremental_and_grows_blocks(index):
+    for i in range(70):
+        db_utils.add_practice_item("grammar", f"Fix the verb agreement in sentence {i}.", "")
+    assert index.refresh(force=True) == 70
+    assert index.backend == "char-trigram"   # the semantic model is off in tests
+    db_utils.add_practice_item("idiom", "Translate 'break the ice' idiomatically.", "")
+    assert index.refresh() == 1   # this process wrote, so no need to wait for REFRESH_INTERVAL
+    assert index.refresh() == 0
+    assert (len(index), index.blocks["grammar"].n, index.blocks["idiom"].n) == (71, 70, 1)
+
+
+def test_search_by_category_excluding_queued(index):
+    ice = db_utils.add_practice_item("idiom", "Translate 'break the ice' idiomatically.", "")
+    beans = db_utils.add_practice_item("idiom", "Translate 'spill the beans' idiomatically.", "")
+    db_utils.add_practice_item("grammar", "Translate 'break the ice' idiomatically.", "")
+    [hits] = index.search(["Translate 'break the ice' idiomatically."], k=2, category="idiom")
+    assert [pid for pid, _prompt, _score in hits] == [ice, beans]
+    assert hits[0][2] == pytest.approx(1.0, abs=1e-4)
+    [hits] = index.search(["Translate 'break the ice' idiomatically."], k=2, category="idiom", exclude_ids={ice})
+    assert [pid for pid, _prompt, _score in hits] == [beans]
+    assert index.search(["anything"], category="collocation") == [[]]
+
+
+def test_add_suggestion_reuses_near_duplicates(index):
+    db_utils._upsert_user("amal", None, "Student", 1)
+    db_utils.add_practice_item("idiom", "Translate 'break the ice' idiomatically.", "")
+    near = {"category": "idiom", "prompt": "Translate 'break the ice' idiomatically!"}
+    other = {"category": "idiom", "prompt": "Rewrite the paragraph with natural collocations."}
+    assert recommender.add_suggestion("amal", near) == (1, True)
+    assert recommender.add_suggestion("amal", near) == (1, False)
+    assert recommender.add_suggestion("amal", other) == (2, True)
+    assert len(db_utils.get_practice_items()) == 2
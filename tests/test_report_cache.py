@@ -0,0 +1,56 @@
+import pytest
+
+import db_utils
+
+
+@pytest.fixture
+def analyzed(monkeypatch):
+    """Count the submissions classify_translation_issues_batch is asked to analyze."""
+    calls = []
+    batch = db_utils.classify_translation_issues_batch
+
+    def counting(submissions, *args, **kwargs):
+        calls.append([s["student_translation"] for s in submissions])
+        return batch(submissions, *args, **kwargs)
+
+    monkeypatch.setattr(db_utils, "classify_translation_issues_batch", counting)
+    return calls
+
+
+def _subs(*translations):
+    return [{"id": None, "source_text": "Break the ice.", "student_translation": t, "reference": None,
+             "target_lang": "ar"} for t in translations]
+
+
+def test_only_misses_are_analyzed_once(db, analyzed):
+    first = db_utils.get_reports_for_submissions(_subs("كسر الجمود.", "حطم الثلج.", "كسر الجمود."))
+    assert analyzed == [["كسر الجمود.", "حطم الثلج."]]
+    again = db_utils.get_reports_for_submissions(_subs("حطم الثلج.", "كسر الجمود."))
+    assert analyzed == [["كسر الجمود.", "حطم الثلج."]]
+    assert [r["idiom_issues"] for r in again] == [first[1]["idiom_issues"], first[0]["idiom_issues"]]
+
+
+def test_version_change_misses_and_purge_keeps_current_variants(db, analyzed, tmp_path):
+    db_utils.get_reports_for_submissions(_subs("كسر الجمود."))
+    old = db_utils.get_report_version()
+    path = tmp_path / "idioms.json"
+    path.write_text('{"hit the road": "انطلق"}', encoding="utf-8")
+    db_utils.import_idioms(str(path))
+    new = db_utils.get_report_version()
+    assert new != old
+
+    db_utils.get_reports_for_submissions(_subs("كسر الجمود."))
+    assert len(analyzed) == 2
+    assert db_utils.purge_stale_reports() == 2   # the old report and its sentence segment
+    with db_utils.db_cursor() as c:
+        c.execute("SELECT version FROM submission_reports ORDER BY version")
+        assert [r[0] for r in c.fetchall()] == [new, new + db_utils.SEGMENT_VERSION_SUFFIX]
+
+
+def test_degraded_reports_are_not_cached(db, analyzed, monkeypatch):
+    batch = db_utils.classify_translation_issues_batch
+    monkeypatch.setattr(db_utils, "classify_translation_issues_batch",
+                        lambda subs, *a, **kw: [dict(rep, degraded=["grammar"]) for rep in batch(subs, *a, **kw)])
+    db_utils.get_reports_for_submissions(_subs("كسر الجمود."))
+    db_utils.get_reports_for_submissions(_subs("كسر الجمود."))
+    assert len(analyzed) == 2
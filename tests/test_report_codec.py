@@ -0,0 +1,102 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import db_utils
+import report_codec
+
+REPORT = {
+    "semantic_score": 0.6125,
+    "semantic_flag": True,
+    "idiom_issues": {
+        "break the ice": {"status": "non-idiomatic-literal", "expected": "كسر الجمود"},
+        "spill the beans": {"status": "idiomatic", "expected": None},
+    },
+    "grammar_matches": [
+        {"message": "Possible typo", "replacements": ["the", "then"], "offset": 4, "length": 3},
+        {"message": "Multiple consecutive spaces", "replacements": []},
+    ],
+    "collocation_flags": ["strong rain"],
+    "priority": ["semantic", "idiom", "grammar", "collocation"],
+    "degraded": True,
+    "segments": [
+        {"source": [0, 12], "translation": [0, 10], "semantic_score": 0.9, "semantic_flag": False},
+        {"source": None, "translation": [11, 20], "semantic_score": 0.25, "semantic_flag": True},
+    ],
+}
+
+
+def _table(report):
+    texts = [None] + sorted(report_codec.Report.from_dict(report).strings())
+    return texts, {t: i for i, t in enumerate(texts) if i}
+
+
+def test_round_trip():
+    texts, ids = _table(REPORT)
+    decoded = report_codec.decode(report_codec.encode(REPORT, ids), texts)
+    assert decoded == REPORT
+    assert decoded.to_dict() == REPORT
+
+
+def test_round_trip_keeps_unusual_values():
+    report = dict(REPORT, semantic_score=None, priority=["grammar"], grammar=[{"message": 3}], extra={"a": 1})
+    del report["grammar_matches"]
+    texts, ids = _table(report)
+    assert report_codec.decode(report_codec.encode(report, ids), texts) == report
+
+
+def test_unknown_string_id_raises_index_error():
+    texts, ids = _table(REPORT)
+    blob = report_codec.encode(REPORT, ids)
+    with pytest.raises(IndexError):
+        report_codec.decode(blob, texts[:2])
+
+
+def test_stored_reports_round_trip(db):
+    version = db_utils.get_report_version()
+    db_utils.store_reports(version, {"k1": dict(REPORT, degraded=False), "k2": REPORT})
+    cached = db_utils.get_cached_reports(["k1", "k2", "k3"])
+    # degraded reports are served but never cached
+    assert list(cached) == ["k1"]
+    assert cached["k1"] == dict(REPORT, degraded=False)
+
+
+def _report(word):
+    """A report whose strings are all new for each word."""
+    return {"semantic_score": 0.5, "semantic_flag": False,
+            "idiom_issues": {f"idiom {word}": {"status": f"status {word}", "expected": f"expected {word}"}},
+            "grammar_matches": [{"message": f"message {word}", "replacements": [f"fix {word}"], "offset": 1,
+                                 "length": 2}],
+            "collocation_flags": [f"bigram {word}"], "priority": ["grammar", "collocation"]}
+
+
+def _store_in_child(db_file, key, report):
+    db_utils.DB_FILE = db_file
+    db_utils.store_reports("v", {key: report})
+
+
+def _read_in_child(keys):
+    return {key: dict(report) for key, report in db_utils.get_cached_reports(keys).items()}
+
+
+def test_reports_interned_by_other_processes_decode(db):
+    # Each side interns strings while the other has added some it has not loaded yet.
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as child:
+        db_utils.store_reports("v", {"r1": _report("one")})
+        child.submit(_store_in_child, db, "r2", _report("two")).result()
+        db_utils.store_reports("v", {"r3": _report("three")})
+        assert db_utils.get_cached_reports(["r2"])["r2"] == _report("two")
+        assert child.submit(_read_in_child, ["r1", "r3"]).result() == {"r1": _report("one"),
+                                                                     "r3": _report("three")}
+
+
+def test_stored_reports_survive_an_idiom_reimport(db, tmp_path):
+    report = _report("kept")
+    report["idiom_issues"] = {"break the ice": {"status": "idiomatic", "expected": "كسر الجمود"}}
+    db_utils.store_reports("v", {"r": report})
+    path = tmp_path / "new.json"
+    path.write_text('{"spill the beans": {"arabic": "أفشى السر"}}', encoding="utf-8")
+    db_utils.import_idioms(str(path))
+    db_utils._report_strings.update(db=None)   # as in a fresh process
+    assert db_utils.get_cached_reports(["r"])["r"] == report
@@ -0,0 +1,74 @@
+import pytest
+
+import metrics_utils
+import segmenter
+
+
+def _sentences(text):
+    return [text[s:e] for s, e in segmenter.split_sentences(text)]
+
+
+def test_split_sentences():
+    assert _sentences("Mr. Smith arrived.  He sat down!\nDid he? Yes") == \
+        ["Mr. Smith arrived.", "He sat down!", "Did he?", "Yes"]
+    assert _sentences("وصل الضيف. هل جلس؟ نعم") == ["وصل الضيف.", "هل جلس؟", "نعم"]
+    assert _sentences("  ") == []
+
+
+def test_align_beads():
+    assert segmenter.align([20, 30], [21, 29]) == [([0], [0]), ([1], [1])]
+    assert segmenter.align([20, 20, 40], [41, 40]) == [([0, 1], [0]), ([2], [1])]
+    assert segmenter.align([], [10]) == [([], [0])]
+
+
+def test_single_sentences_are_one_segment():
+    assert segmenter.segment_submission("One sentence.", "جملة واحدة.") == [((0, 13), (0, 11))]
+
+
+@pytest.fixture
+def analyzed(monkeypatch):
+    """Segment texts sent to classify_translation_issues_batch, per call; each gets a grammar match at 0."""
+    calls = []
+    classify = metrics_utils.classify_translation_issues_batch
+
+    def counting(items, idioms_dict=None, **kwargs):
+        calls.append([item[1] for item in items])
+        reports = classify(items, idioms_dict, **kwargs)
+        for rep in reports:
+            rep["grammar_matches"] = [{"message": "marker", "replacements": [], "offset": 0, "length": 1}]
+        return reports
+
+    monkeypatch.setattr(metrics_utils, "classify_translation_issues_batch", counting)
+    return calls
+
+
+SUBMISSION = {"source_text": "The team met. They had to break the ice. Then they worked.",
+              "student_translation": "اجتمع الفريق. حاولوا كسر الجمود. ثم عملوا.",
+              "reference": None, "target_lang": "ar"}
+
+
+def test_offsets_shift_into_the_whole_translation(db, analyzed):
+    [report] = segmenter.analyze([SUBMISSION])
+    translation = SUBMISSION["student_translation"]
+    starts = [s for s, _e in segmenter.split_sentences(translation)]
+    assert [m["offset"] for m in report["grammar_matches"]] == starts
+    assert [seg["translation"][0] for seg in report["segments"]] == starts
+    assert report["idiom_issues"]["break the ice"]["status"] == "idiomatic"
+
+
+def test_only_edited_sentences_are_analyzed_again(db, analyzed):
+    segmenter.analyze([SUBMISSION])
+    edited = dict(SUBMISSION, student_translation="اجتمع الفريق. حاولوا كسر الثلج. ثم عملوا.")
+    segmenter.analyze([edited])
+    assert [len(call) for call in analyzed] == [3, 1]
+    assert analyzed[1] == ["حاولوا كسر الثلج."]
+
+
+def test_whole_text_heuristics_see_the_gaps_between_sentences(db):
+    spaced = dict(SUBMISSION, student_translation="اجتمع الفريق.  حاولوا كسر الجمود. ثم عملوا!!!")
+    [report] = segmenter.analyze([spaced])
+    assert [m["message"] for m in report["grammar_matches"]] == ["Multiple consecutive spaces",
+                                                                 "Excessive punctuation"]
+    # cached segments carry no heuristic matches of their own
+    [again] = segmenter.analyze([spaced])
+    assert again["grammar_matches"] == report["grammar_matches"]
@@ -0,0 +1,33 @@
+import pytest
+
+import translation_metrics as tm
+
+# (hypothesis, reference, metric, expected score) worked out by hand
+KNOWN_SCORES = [
+    ("the cat sat on the mat", "the cat sat on the mat", "bleu", 100.0),
+    ("the cat sat on the mat", "the cat sat on the mat", "chrf", 100.0),
+    ("the cat sat on the mat", "the cat sat on the mat", "ter", 0.0),
+    # precisions 5/6, 3/5, 1/4 and smoothed 1/(2*3): geometric mean 37.9918
+    ("the cat sat on the mat", "the cat is on the mat", "bleu", 37.9918),
+    ("the cat sat on the mat", "the cat is on the mat", "ter", 100.0 / 6),
+    # "sat" -> "is": 2 substitutions + 1 deletion over 21 reference characters
+    ("the cat sat on the mat", "the cat is on the mat", "char_edit_rate", 100.0 * 3 / 21),
+    ("kitten", "sitting", "char_edit_rate", 100.0 * 3 / 7),
+    ("", "anything", "bleu", 0.0),
+    ("", "anything", "ter", 100.0),
+    ("xyz", "abc", "chrf", 0.0),
+]
+
+
+@pytest.mark.parametrize("hyp, ref, metric, expected", KNOWN_SCORES)
+def test_known_scores(hyp, ref, metric, expected):
+    assert float(tm.score_batch([hyp], [ref])[metric][0]) == pytest.approx(expected, abs=1e-3)
+
+
+def test_batch_matches_single_pairs():
+    pairs = [(hyp, ref) for hyp, ref, _metric, _expected in KNOWN_SCORES]
+    batch = tm.score_batch([h for h, _r in pairs], [r for _h, r in pairs])
+    for k, (hyp, ref) in enumerate(pairs):
+        single = tm.score_batch([hyp], [ref])
+        for metric in ("bleu", "chrf", "ter", "char_edit_rate"):
+            assert batch[metric][k] == pytest.approx(single[metric][0])
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+import auth
+import db_utils
+import grade_cli
+
+
+@pytest.fixture(autouse=True)
+def cheap_hashes(monkeypatch):
+    monkeypatch.setattr(auth, "SCRYPT_N", 2 ** 10)
+
+
+def test_every_registration_needs_approval(db):
+    assert db_utils.create_user("amal", "pw1", "Student") is True
+    assert db_utils.create_user("prof", "pw2", "Instructor") is True
+    assert db_utils.authenticate("amal", "pw1") is None
+    assert db_utils.authenticate("prof", "pw2") is None
+
+    db_utils.approve_user("amal")
+    assert db_utils.authenticate("amal", "pw1") == {"username": "amal", "role": "Student"}
+
+
+def test_first_instructor_comes_from_the_cli(db, monkeypatch, capsys):
+    monkeypatch.setattr(grade_cli.getpass, "getpass", lambda prompt="": "secret")
+    assert grade_cli.main(["--db", db_utils.DB_FILE, "--add-instructor", "prof"]) == 0
+    assert db_utils.authenticate("prof", "secret") == {"username": "prof", "role": "Instructor"}
+
+    answers = iter(["one", "two"])
+    monkeypatch.setattr(grade_cli.getpass, "getpass", lambda prompt="": next(answers))
+    with pytest.raises(SystemExit):
+        grade_cli.add_instructor("prof2")
+    assert db_utils.authenticate("prof2", "one") is None
+
+
+def test_taken_usernames_are_rejected(db):
+    db_utils.register_user("prof", "secret", "Instructor", approved=1)
+    assert db_utils.create_user("prof", "mine-now", "Instructor") is False
+    assert db_utils.authenticate("prof", "secret") == {"username": "prof", "role": "Instructor"}
+    assert db_utils.authenticate("prof", "mine-now") is None
+
+
+def test_imported_students_can_be_claimed_once(db):
+    db_utils.add_submissions([{"username": "amal", "source_text": "s", "student_translation": "t",
+                               "target_lang": "ar"}])
+    assert [u["registered"] for u in db_utils.get_all_users()] == [False]
+    # claiming a stub cannot pick a different role
+    assert db_utils.create_user("amal", "pw", "Instructor") is True
+    assert db_utils.get_all_users() == [{"username": "amal", "role": "Student", "approved": 0, "registered": True}]
+    assert db_utils.create_user("amal", "other", "Student") is False
+
+
+def test_revoked_tokens_are_forgotten_once_expired():
+    short = auth.issue_session("amal", "Student", ttl=1)
+    token = auth.issue_session("amal", "Student")
+    auth.revoke_session(short)
+    auth.revoke_session(token)
+    assert auth.verify_session(short) is None
+    assert auth.verify_session(token) is None
+    assert auth._revoked[token] == pytest.approx(time.time() + auth.SESSION_TTL, abs=2)
+
+    time.sleep(1.1)
+    auth.revoke_session(auth.issue_session("prof", "Instructor"))
+    assert short not in auth._revoked
+    assert token in auth._revoked
+    # forged tokens are not remembered at all
+    auth.revoke_session("payload.bad-signature")
+    assert "payload.bad-signature" not in auth._revoked
+
+
+def test_session_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(auth, "MAX_CACHED_SESSIONS", 3)
+    monkeypatch.setattr(auth, "_sessions", auth.OrderedDict())
+    first, second, third = (auth.issue_session(name, "Student") for name in ("a", "b", "c"))
+    assert auth.verify_session(first) == ("a", "Student")   # now the most recently used
+    fourth = auth.issue_session("d", "Student")
+    assert list(auth._sessions) == [third, first, fourth]
+    # an evicted token is still valid, it just costs a signature check
+    assert auth.verify_session(second) == ("b", "Student")
+    assert list(auth._sessions) == [first, fourth, second]
@@ -0,0 +1,252 @@
+# translation_metrics.py
+"""
+Reference-based translation metrics with a batch API: BLEU, chrF, TER and
+character edit rate.
+
+score_batch() scores many (hypothesis, reference) pairs in one call. All texts in
+the batch are flattened into a single token array. Each n-gram order gets a dense
+integer id (order n is the unique pair of its (n-1)-gram id and its last token).
+The per-pair n-gram count tables are then np.unique over (pair, n-gram id) keys.
+Clipped matches are the minimum of the hypothesis and reference counts at the
+keys both sides share, summed per pair with np.bincount. Python only runs once
+per text, to tokenize it.
+
+Definitions:
+  * BLEU (Papineni et al., 2002): n = 1..4, brevity penalty, and "exp" smoothing
+    for orders with no match (as in mteval and sacreBLEU). Sentence scores use
+    the effective order, i.e. only orders the hypothesis is long enough for.
+  * chrF (Popović, 2015): character n = 1..6 with whitespace removed. Precision
+    and recall are averaged over the orders both sides have, then combined as
+    F-beta with beta = 2.
+  * TER: word edit distance / reference words. There are no block shifts, so a
+    moved phrase costs its edits.
+  * Character edit rate: character Levenshtein distance / reference characters.
+    This is the effort measure of compute_edits_effort.
+
+Every score is on a 0..100 scale. Corpus-level scores come from summed
+sufficient statistics, not from averaging sentence scores.
+"""
+import re
+
+import numpy as np
+
+BLEU_ORDER = 4
+CHRF_ORDER = 6
+CHRF_BETA = 2.0
+EDIT_CHUNK = 256   # pairs per dynamic-programming block in edit_distances
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def tokenize(text):
+    """Words and punctuation marks, in order ("don't." -> don ' t .)."""
+    return _TOKEN_RE.findall(text or "")
+
+
+def _word_ids(texts, vocab):
+    return [np.array([vocab.setdefault(t, len(vocab)) for t in tokenize(text)], dtype=np.int64)
+            for text in texts]
+
+
+def _char_ids(texts, keep_spaces=False):
+    out = []
+    for text in texts:
+        text = text or ""
+        if not keep_spaces:
+            text = _SPACES.sub("", text)
+        out.append(np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.int64))
+    return out
+
+
+def _flatten(seqs):
+    lengths = np.array([len(s) for s in seqs], dtype=np.int64)
+    flat = np.concatenate(seqs) if lengths.sum() else np.zeros(0, dtype=np.int64)
+    seg = np.repeat(np.arange(len(seqs), dtype=np.int64), lengths)
+    return flat, seg, lengths
+
+
+def ngram_stats(hyp_seqs, ref_seqs, max_order):
+    """
+    (matches, hyp_totals, ref_totals), each an int64 array of shape (pairs, max_order):
+    clipped n-gram matches and n-gram counts of every hypothesis/reference token sequence.
+    """
+    n_pairs = len(hyp_seqs)
+    matches = np.zeros((n_pairs, max_order), dtype=np.int64)
+    flat, seg, lengths = _flatten(list(hyp_seqs) + list(ref_seqs))
+    orders = np.arange(1, max_order + 1)
+    hyp_tot = np.maximum(lengths[:n_pairs, None] - orders + 1, 0)
+    ref_tot = np.maximum(lengths[n_pairs:, None] - orders + 1, 0)
+    if not len(flat):
+        return matches, hyp_tot, ref_tot
+    _, tokens = np.unique(flat, return_inverse=True)
+    tokens = tokens.ravel().astype(np.int64)
+    vocab = int(tokens.max()) + 1
+    ids = tokens
+    for n in range(1, max_order + 1):
+        if n > 1:
+            if len(ids) < 2:
+                break
+            # ids has one entry per (n-1)-gram start; extend each by its next token
+            _, ids = np.unique(ids[:-1] * vocab + tokens[n - 1:], return_inverse=True)
+            ids = ids.ravel().astype(np.int64)
+        start_seg = seg[:len(ids)]
+        valid = start_seg == seg[n - 1:]
+        gram = ids[valid]
+        owner = start_seg[valid]
+        if not len(gram):
+            break
+        width = int(gram.max()) + 1
+        keys = (owner % n_pairs) * width + gram
+        is_ref = owner >= n_pairs
+        hyp_keys, hyp_counts = np.unique(keys[~is_ref], return_counts=True)
+        ref_keys, ref_counts = np.unique(keys[is_ref], return_counts=True)
+        common, hi, ri = np.intersect1d(hyp_keys, ref_keys, assume_unique=True, return_indices=True)
+        clipped = np.minimum(hyp_counts[hi], ref_counts[ri])
+        matches[:, n - 1] = np.bincount(common // width, weights=clipped, minlength=n_pairs).astype(np.int64)
+    return matches, hyp_tot, ref_tot
+
+
+def bleu_from_stats(matches, hyp_tot, hyp_len, ref_len, effective_order=True):
+    """BLEU per row of the statistics arrays (1-D hyp_len/ref_len)."""
+    matches = np.atleast_2d(matches).astype(np.float64)
+    hyp_tot = np.atleast_2d(hyp_tot).astype(np.float64)
+    hyp_len = np.atleast_1d(hyp_len).astype(np.float64)
+    ref_len = np.atleast_1d(ref_len).astype(np.float64)
+    valid = hyp_tot > 0
+    misses = np.cumsum((matches == 0) & valid, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(matches > 0, 100.0 * matches / hyp_tot, 100.0 / (2.0 ** misses * hyp_tot))
+        log_p = np.where(valid, np.log(np.where(valid, precision, 1.0)), 0.0)
+        if effective_order:
+            order = valid.sum(axis=1)
+        else:
+            order = np.full(len(matches), matches.shape[1])
+            log_p = np.where(valid, log_p, -np.inf)
+        score = np.exp(log_p.sum(axis=1) / np.maximum(order, 1))
+        bp = np.where(hyp_len < ref_len, np.exp(1.0 - ref_len / np.maximum(hyp_len, 1.0)), 1.0)
+    score = np.where((order > 0) & (hyp_len > 0) & (matches.sum(axis=1) > 0), bp * score, 0.0)
+    return score
+
+
+def chrf_from_stats(matches, hyp_tot, ref_tot, beta=CHRF_BETA):
+    """chrF per row of the statistics arrays."""
+    matches = np.atleast_2d(matches).astype(np.float64)
+    hyp_tot = np.atleast_2d(hyp_tot).astype(np.float64)
+    ref_tot = np.atleast_2d(ref_tot).astype(np.float64)
+    both = (hyp_tot > 0) & (ref_tot > 0)
+    order = both.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(both, matches / hyp_tot, 0.0).sum(axis=1) / np.maximum(order, 1)
+        recall = np.where(both, matches / ref_tot, 0.0).sum(axis=1) / np.maximum(order, 1)
+        factor = beta ** 2
+        f = (1 + factor) * precision * recall / (factor * precision + recall)
+    return np.where((precision + recall) > 0, 100.0 * f, 0.0)
+
+
+def edit_distances(hyp_seqs, ref_seqs, chunk_size=EDIT_CHUNK):
+    """
+    Levenshtein distance of every (hypothesis, reference) sequence pair.
+    Pairs are processed in blocks of similar length; each block advances one
+    hypothesis position at a time over all its pairs, with insertions resolved
+    by a running minimum along the reference axis.
+    """
+    n_pairs = len(hyp_seqs)
+    hyp_len = np.array([len(s) for s in hyp_seqs], dtype=np.int64)
+    ref_len = np.array([len(s) for s in ref_seqs], dtype=np.int64)
+    out = ref_len.copy()   # empty hypothesis: insert the whole reference
+    order = np.argsort(hyp_len + ref_len, kind="stable")
+    for start in range(0, n_pairs, chunk_size):
+        idx = order[start:start + chunk_size]
+        idx = idx[hyp_len[idx] > 0]
+        if not len(idx):
+            continue
+        hl, rl = hyp_len[idx], ref_len[idx]
+        width = int(rl.max())
+        hyp = np.full((len(idx), int(hl.max())), -1, dtype=np.int64)
+        ref = np.full((len(idx), width), -2, dtype=np.int64)
+        for row, k in enumerate(idx):
+            hyp[row, :hl[row]] = hyp_seqs[k]
+            ref[row, :rl[row]] = ref_seqs[k]
+        cols = np.arange(width + 1, dtype=np.int64)
+        prev = np.broadcast_to(cols, (len(idx), width + 1)).copy()
+        for i in range(hyp.shape[1]):
+            cur = np.empty_like(prev)
+            cur[:, 0] = i + 1
+            cur[:, 1:] = np.minimum(prev[:, :-1] + (hyp[:, i:i + 1] != ref), prev[:, 1:] + 1)
+            cur = np.minimum.accumulate(cur - cols, axis=1) + cols
+            done = hl == i + 1
+            if done.any():
+                out[idx[done]] = cur[done, rl[done]]
+            prev = cur
+    return out
+
+
+def _rate(edits, ref_len):
+    edits = np.asarray(edits, dtype=np.float64)
+    ref_len = np.asarray(ref_len, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = 100.0 * edits / ref_len
+    return np.where(ref_len > 0, rate, np.where(edits > 0, 100.0, 0.0))
+
+
+def _batch_stats(hyps, refs):
+    if len(hyps) != len(refs):
+        raise ValueError(f"{len(hyps)} hypotheses for {len(refs)} references")
+    vocab = {}
+    hyp_words, ref_words = _word_ids(hyps, vocab), _word_ids(refs, vocab)
+    hyp_chars, ref_chars = _char_ids(hyps), _char_ids(refs)
+    return {
+        "bleu": ngram_stats(hyp_words, ref_words, BLEU_ORDER),
+        "hyp_words": np.array([len(s) for s in hyp_words], dtype=np.int64),
+        "ref_words": np.array([len(s) for s in ref_words], dtype=np.int64),
+        "chrf": ngram_stats(hyp_chars, ref_chars, CHRF_ORDER),
+        "word_edits": edit_distances(hyp_words, ref_words),
+        "char_edits": edit_distances(_char_ids(hyps, keep_spaces=True), _char_ids(refs, keep_spaces=True)),
+        "ref_chars": np.array([len(r or "") for r in refs], dtype=np.int64),
+    }
+
+
+def score_batch(hyps, refs):
+    """
+    Sentence-level scores for parallel lists of hypotheses and references.
+    Returns {"bleu", "chrf", "ter", "char_edit_rate"}, each a float array with one entry per pair.
+    """
+    hyps, refs = list(hyps), list(refs)
+    if not hyps:
+        empty = np.zeros(0)
+        return {"bleu": empty, "chrf": empty, "ter": empty, "char_edit_rate": empty}
+    s = _batch_stats(hyps, refs)
+    b_match, b_hyp, _b_ref = s["bleu"]
+    c_match, c_hyp, c_ref = s["chrf"]
+    return {
+        "bleu": bleu_from_stats(b_match, b_hyp, s["hyp_words"], s["ref_words"], effective_order=True),
+        "chrf": chrf_from_stats(c_match, c_hyp, c_ref),
+        "ter": _rate(s["word_edits"], s["ref_words"]),
+        "char_edit_rate": _rate(s["char_edits"], s["ref_chars"]),
+    }
+
+
+def corpus_scores(hyps, refs):
+    """Corpus-level {"bleu", "chrf", "ter", "char_edit_rate"} from summed sentence statistics."""
+    hyps, refs = list(hyps), list(refs)
+    if not hyps:
+        return {"bleu": 0.0, "chrf": 0.0, "ter": 0.0, "char_edit_rate": 0.0}
+    s = _batch_stats(hyps, refs)
+    b_match, b_hyp, _b_ref = (a.sum(axis=0) for a in s["bleu"])
+    c_match, c_hyp, c_ref = (a.sum(axis=0) for a in s["chrf"])
+    return {
+        "bleu": float(bleu_from_stats(b_match, b_hyp, s["hyp_words"].sum(), s["ref_words"].sum(),
+                                      effective_order=False)[0]),
+        "chrf": float(chrf_from_stats(c_match, c_hyp, c_ref)[0]),
+        "ter": float(_rate(s["word_edits"].sum(), s["ref_words"].sum())),
+        "char_edit_rate": float(_rate(s["char_edits"].sum(), s["ref_chars"].sum())),
+    }
+
+
+def sentence_bleu(hyp, ref):
+    return float(score_batch([hyp], [ref])["bleu"][0])
+
+
+def sentence_chrf(hyp, ref):
+    return float(score_batch([hyp], [ref])["chrf"][0])